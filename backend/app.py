@@ -1,13 +1,26 @@
 from flask import Flask, request, jsonify, render_template
 from flask_cors import CORS
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import text
+from sqlalchemy import text, table, column, func, literal_column, event
+from sqlalchemy.orm import selectinload
 from datetime import datetime, timedelta
+from collections import namedtuple
 from werkzeug.security import generate_password_hash, check_password_hash
 import jwt
 import json
 import os
+import re
+import time
+import atexit
+import threading
+import base64
 import logging
+import numpy as np
+
+from geo import resolve_location, haversine_km, bounding_box, cell_ranges, grid_cell
+from hours import compile_intervals, day_start, minute_of_week
+from occupancy import OccupancyTracker, hour_index
+from ranking import GymRankIndex, RANK_COLUMNS, top_k
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -18,13 +31,30 @@ CORS(app)
 
 # Database configuration
 basedir = os.path.abspath(os.path.dirname(__file__))
-app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{os.path.join(basedir, "fitness_app.db")}'
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', f'sqlite:///{os.path.join(basedir, "fitness_app.db")}')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'dev-secret-key')
+app.config['GYM_TOTAL_TTL_SECONDS'] = 60  # how long /api/gyms totals and facets are reused per filter set
+app.config['GYM_PRICE_BUCKET_WIDTH'] = 25  # price histogram bucket size in /api/gyms/facets
+# sort_by=best: component weights, Bayesian prior strength (in reviews at the mean rating) and
+# the distance at which the distance component halves
+app.config['GYM_BEST_WEIGHTS'] = {'rating': 0.5, 'distance': 0.25, 'price': 0.15, 'amenities': 0.1}
+app.config['GYM_BEST_PRIOR_REVIEWS'] = 20  # must be > 0, checked by _best_scorer()
+app.config['GYM_BEST_DISTANCE_KM'] = 5.0
+app.config['GYM_RANK_INDEX_TTL_SECONDS'] = 300  # how often the rank index sweeps in other processes' writes
+app.config['GYM_REVIEW_BULK_LIMIT'] = 5000  # reviews per /api/gyms/reviews/bulk request
+app.config['GYM_OCCUPANCY_PERSIST_SECONDS'] = 30  # how often live occupancy is snapshotted to gym_occupancy
+app.config['GYM_BUSY_WEEKS'] = 5  # busy-hours window: the current week plus four completed ones
+app.config['GYM_FEATURE_RELOAD_SECONDS'] = 60  # how often filtering on an unknown feature name may reload gym_feature
 
 db = SQLAlchemy(app)
 
 # Models
+def _seed_rating_sum(context):
+    # Gyms created with a seeded rating and review_count start with the matching sum
+    params = context.get_current_parameters()
+    return (params.get('rating') or 0.0) * (params.get('review_count') or 0)
+
 class Gym(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
@@ -32,13 +62,19 @@ class Gym(db.Model):
     city = db.Column(db.String(100), nullable=False)
     rating = db.Column(db.Float, default=0.0)
     review_count = db.Column(db.Integer, default=0)
+    rating_sum = db.Column(db.Float, nullable=False, default=_seed_rating_sum)  # rating * review_count, see add_gym_reviews
     distance = db.Column(db.Float, default=0.0)
+    latitude = db.Column(db.Float)  # resolved from city when not given explicitly
+    longitude = db.Column(db.Float)
     price_per_month = db.Column(db.Float, nullable=False)
     image_url = db.Column(db.String(200))
     phone = db.Column(db.String(20))
     website = db.Column(db.String(200))
     description = db.Column(db.Text)
     is_open = db.Column(db.Boolean, default=True)
+    amenity_mask = db.Column(db.Integer, nullable=False, default=0)  # GymFeature bits, see GYM_FEATURES
+    equipment_mask = db.Column(db.Integer, nullable=False, default=0)
+    class_mask = db.Column(db.Integer, nullable=False, default=0)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
@@ -48,28 +84,105 @@ class Gym(db.Model):
     equipment = db.relationship('GymEquipment', backref='gym', lazy=True, cascade='all, delete-orphan')
     classes = db.relationship('GymClass', backref='gym', lazy=True, cascade='all, delete-orphan')
 
+    # One index per /api/gyms sort order, with id as the keyset tie-breaker
+    __table_args__ = (
+        db.Index('ix_gym_distance_id', 'distance', 'id'),
+        db.Index('ix_gym_rating_id', db.text('rating DESC'), 'id'),
+        db.Index('ix_gym_price_id', 'price_per_month', 'id'),
+        db.Index('ix_gym_name_id', 'name', 'id'),
+        db.Index('ix_gym_latitude_longitude', 'latitude', 'longitude'),
+        db.Index('ix_gym_updated_at', 'updated_at'),  # rank index sweeps, see gym_rank_index()
+    )
+
 class GymAmenity(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    gym_id = db.Column(db.Integer, db.ForeignKey('gym.id'), nullable=False)
+    gym_id = db.Column(db.Integer, db.ForeignKey('gym.id'), nullable=False, index=True)
     name = db.Column(db.String(50), nullable=False)
 
+    __table_args__ = (
+        db.Index('ix_gym_amenity_name_gym', 'name', 'gym_id'),
+    )
+
 class GymOperatingHours(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    gym_id = db.Column(db.Integer, db.ForeignKey('gym.id'), nullable=False)
-    day_of_week = db.Column(db.String(10), nullable=False)  # 'weekdays' or 'weekends'
+    gym_id = db.Column(db.Integer, db.ForeignKey('gym.id'), nullable=False, index=True)
+    day_of_week = db.Column(db.String(10), nullable=False)  # 'daily', 'weekdays', 'weekends' or a day name ('monday')
     open_time = db.Column(db.String(10), nullable=False)  # 'HH:MM' format
     close_time = db.Column(db.String(10), nullable=False)  # 'HH:MM' format
 
 class GymEquipment(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    gym_id = db.Column(db.Integer, db.ForeignKey('gym.id'), nullable=False)
+    gym_id = db.Column(db.Integer, db.ForeignKey('gym.id'), nullable=False, index=True)
     name = db.Column(db.String(100), nullable=False)
 
 class GymClass(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    gym_id = db.Column(db.Integer, db.ForeignKey('gym.id'), nullable=False)
+    gym_id = db.Column(db.Integer, db.ForeignKey('gym.id'), nullable=False, index=True)
     name = db.Column(db.String(100), nullable=False)
 
+class GymDocument(db.Model):
+    """Pre-serialized API JSON for a gym, rewritten whenever the gym or its child rows change"""
+    gym_id = db.Column(db.Integer, db.ForeignKey('gym.id', ondelete='CASCADE'), primary_key=True)
+    document = db.Column(db.Text, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class GymFeature(db.Model):
+    """Dictionary interning amenity, equipment and class names to a bit of the gym's mask column"""
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(20), nullable=False)  # a GYM_FEATURES key
+    name = db.Column(db.String(100), nullable=False)
+    bit = db.Column(db.Integer)  # None once the kind has used all GYM_FEATURE_BITS bits
+
+    __table_args__ = (
+        db.UniqueConstraint('kind', 'name', name='uq_gym_feature_kind_name'),
+    )
+
+class GymOpenInterval(db.Model):
+    """Operating hours compiled to half-open [start_minute, end_minute) minute-of-week ranges"""
+    id = db.Column(db.Integer, primary_key=True)
+    gym_id = db.Column(db.Integer, db.ForeignKey('gym.id', ondelete='CASCADE'), nullable=False)
+    start_minute = db.Column(db.Integer, nullable=False)  # Monday 00:00 is minute 0
+    end_minute = db.Column(db.Integer, nullable=False)
+
+    # "Is this gym open at minute m" is one probe of the first index; "which gyms are open"
+    # scans the second over a single day, since intervals never cross midnight
+    __table_args__ = (
+        db.Index('ix_gym_open_interval_gym_start_end', 'gym_id', 'start_minute', 'end_minute'),
+        db.Index('ix_gym_open_interval_start_end_gym', 'start_minute', 'end_minute', 'gym_id'),
+    )
+
+class GymReview(db.Model):
+    """A member's review; written through add_gym_reviews / delete_gym_review, which keep the
+    gym's rating, review_count and rating_sum in step"""
+    id = db.Column(db.Integer, primary_key=True)
+    gym_id = db.Column(db.Integer, db.ForeignKey('gym.id', ondelete='CASCADE'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    rating = db.Column(db.Integer, nullable=False)  # 1-5
+    comment = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    # Review pages are a backwards range scan of one gym's slice, id breaking created_at ties
+    __table_args__ = (
+        db.Index('ix_gym_review_gym_created_id', 'gym_id', 'created_at', 'id'),
+    )
+
+class GymOccupancy(db.Model):
+    """Periodic snapshot of a gym's live occupancy and busy-hours histogram (see occupancy.py)"""
+    gym_id = db.Column(db.Integer, db.ForeignKey('gym.id', ondelete='CASCADE'), primary_key=True)
+    occupancy = db.Column(db.Integer, nullable=False, default=0)
+    histogram = db.Column(db.Text)  # BusyHistogram.state() JSON, None before the first check-in
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+GYM_CHILD_MODELS = (GymAmenity, GymOperatingHours, GymEquipment, GymClass)
+
+# /api/gyms filter param -> (child model, mask column) for the interned gym features
+GYM_FEATURES = {
+    'amenity': (GymAmenity, Gym.amenity_mask),
+    'equipment': (GymEquipment, Gym.equipment_mask),
+    'class': (GymClass, Gym.class_mask),
+}
+GYM_FEATURE_BITS = 63  # bits usable in a signed 64-bit SQLite integer
+
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
@@ -82,6 +195,9 @@ class User(db.Model):
     weight = db.Column(db.Float)
     fitness_level = db.Column(db.String(20))  # 'beginner', 'intermediate', 'advanced'
     location = db.Column(db.String(200))
+    latitude = db.Column(db.Float)  # resolved from location at write time
+    longitude = db.Column(db.Float)
+    geo_cell = db.Column(db.Integer, index=True)  # geo.grid_cell(latitude, longitude)
     bio = db.Column(db.Text)
     avatar_url = db.Column(db.String(200))
     goals = db.Column(db.Text)  # JSON array string
@@ -170,6 +286,12 @@ def index():
         'version': '1.0.0',
         'endpoints': {
             'gyms': '/api/gyms',
+            'gyms_facets': '/api/gyms/facets',
+            'gym_reviews': '/api/gyms/<gym_id>/reviews',
+            'gym_reviews_bulk': '/api/gyms/reviews/bulk',
+            'gym_checkin': '/api/gyms/<gym_id>/checkin',
+            'gym_checkout': '/api/gyms/<gym_id>/checkout',
+            'gym_occupancy_events': '/api/gyms/occupancy/events',
             'workouts': '/api/workouts',
             'exercises': '/api/exercises',
             'users': '/api/users',
@@ -183,6 +305,16 @@ def index():
     })
 
 # -------- AUTH ---------
+def _set_user_location(user, location):
+    """Store a user's free-text location along with its resolved coordinates"""
+    user.location = location
+    coords = resolve_location(location)
+    if coords:
+        user.latitude, user.longitude = coords
+        user.geo_cell = grid_cell(*coords)
+    else:
+        user.latitude = user.longitude = user.geo_cell = None
+
 def _generate_token(user_id: int):
     payload = {
         'user_id': user_id,
@@ -213,7 +345,6 @@ def register():
         weight=data.get('weight'),
         age=data.get('age'),
         fitness_level=data.get('fitness_level'),
-        location=data.get('location'),
         bio=data.get('bio'),
         avatar_url=data.get('avatar_url'),
         goals=json.dumps(data.get('goals', [])) if isinstance(data.get('goals'), list) else data.get('goals'),
@@ -221,6 +352,7 @@ def register():
         availability_schedule=json.dumps(data.get('availability_schedule', {})) if isinstance(data.get('availability_schedule'), dict) else data.get('availability_schedule'),
         last_active=datetime.utcnow(),
     )
+    _set_user_location(user, data.get('location'))
     db.session.add(user)
     db.session.commit()
 
@@ -287,9 +419,11 @@ def profile():
 
     # PUT update
     data = request.get_json() or {}
-    for field in ['name','age','gender','height','weight','fitness_level','location','bio','avatar_url','preferred_workout_time']:
+    for field in ['name','age','gender','height','weight','fitness_level','bio','avatar_url','preferred_workout_time']:
         if field in data:
             setattr(user, field, data[field])
+    if 'location' in data:
+        _set_user_location(user, data['location'])
     if 'goals' in data:
         user.goals = json.dumps(data['goals']) if isinstance(data['goals'], list) else data['goals']
     if 'availability_schedule' in data:
@@ -299,30 +433,75 @@ def profile():
     return jsonify({'success': True})
 
 # -------- PARTNERS ---------
+# FTS5 index over user search fields, created and kept in sync by init_db (not an ORM model)
+user_fts = table('user_fts', column('rowid'))
+USER_FTS_COLUMNS = ('name', 'username', 'email')
+USER_FTS_WEIGHTS = (10.0, 5.0, 1.0)  # bm25 weight per column, in USER_FTS_COLUMNS order
+
+def _user_fts_match(q):
+    """FTS5 MATCH expression requiring every word of q as a prefix, or None if q has no words"""
+    words = re.findall(r'\w+', q)
+    if not words:
+        return None
+    return ' '.join(f'"{word}"*' for word in words)
+
 @app.route('/api/partners/search', methods=['GET'])
 def partners_search():
-    # filters: q, fitness_level, min_age, max_age, location
+    # filters: q, fitness_level, min_age, max_age, location, lat/lon, radius_km, user_id
     q = request.args.get('q', '').strip().lower()
     fitness_level = request.args.get('fitness_level')
     min_age = request.args.get('min_age', type=int)
     max_age = request.args.get('max_age', type=int)
     location = request.args.get('location')
+    lat = request.args.get('lat', type=float)
+    lon = request.args.get('lon', type=float)
+    radius_km = request.args.get('radius_km', type=float)
+    user_id = request.args.get('user_id', type=int)
+
+    # Radius defaults to the caller's partner preference, then to 25 km
+    if radius_km is None and user_id:
+        pref = PartnerPreference.query.filter_by(user_id=user_id).first()
+        if pref and pref.max_distance_km:
+            radius_km = float(pref.max_distance_km)
+    if radius_km is None:
+        radius_km = 25.0
+
+    center = (lat, lon) if lat is not None and lon is not None else resolve_location(location)
 
     query = User.query.filter(User.is_active == True)
+    order = [User.last_active.desc()]
     if q:
-        query = query.filter(db.or_(User.name.ilike(f"%{q}%"), User.username.ilike(f"%{q}%"), User.email.ilike(f"%{q}%")))
+        match = _user_fts_match(q)
+        if match and app.config.get('USER_FTS_ENABLED'):
+            # Prefix search on the FTS index, best bm25 match first
+            query = query.join(user_fts, user_fts.c.rowid == User.id).filter(literal_column('user_fts').op('MATCH')(match))
+            order.insert(0, func.bm25(literal_column('user_fts'), *USER_FTS_WEIGHTS))
+        else:
+            query = query.filter(db.or_(User.name.ilike(f"%{q}%"), User.username.ilike(f"%{q}%"), User.email.ilike(f"%{q}%")))
     if fitness_level:
         query = query.filter(User.fitness_level == fitness_level)
     if min_age is not None:
         query = query.filter(User.age >= min_age)
     if max_age is not None:
         query = query.filter(User.age <= max_age)
-    if location:
+    if center:
+        # Grid cell ranges use the geo_cell index; exact distance is checked below
+        query = query.filter(db.or_(*[User.geo_cell.between(first, last) for first, last in cell_ranges(center[0], center[1], radius_km)]))
+    elif location:
         query = query.filter(User.location.ilike(f"%{location}%"))
 
-    users = query.order_by(User.last_active.desc()).limit(50).all()
+    if center:
+        users = []
+        for u in query.order_by(*order).all():
+            distance = haversine_km(center[0], center[1], u.latitude, u.longitude)
+            if distance <= radius_km:
+                users.append((u, distance))
+        users = users[:50]
+    else:
+        users = [(u, None) for u in query.order_by(*order).limit(50).all()]
+
     results = []
-    for u in users:
+    for u, distance in users:
         results.append({
             'id': u.id,
             'name': u.name,
@@ -330,6 +509,7 @@ def partners_search():
             'fitness_level': u.fitness_level,
             'goals': json.loads(u.goals) if u.goals else [],
             'location': u.location,
+            'distance_km': round(distance, 1) if distance is not None else None,
             'bio': u.bio,
             'last_active': u.last_active.isoformat() if u.last_active else None,
             'avatar_url': u.avatar_url,
@@ -504,132 +684,1086 @@ def partners_decline():
         return jsonify({'success': False, 'error': str(e)}), 500
 
 # Gym endpoints
+# sort_by -> (column, descending); ties are always broken by ascending id
+GYM_SORTS = {
+    'distance': (Gym.distance, False),
+    'rating': (Gym.rating, True),
+    'price': (Gym.price_per_month, False),
+    'name': (Gym.name, False),
+}
+
+# GymFilters -> (expires_at, facet summary) for /api/gyms and /api/gyms/facets
+_gym_summaries = {}
+
+# Mirror of gym_feature: bits maps kind -> {feature name: bit or None}, loaded_at is its
+# time.monotonic(). Replaced whole under _gym_feature_lock and never mutated, so readers
+# use whichever copy they picked up without locking
+GymFeatureBits = namedtuple('GymFeatureBits', 'bits loaded_at')
+_gym_feature_bits = None
+_gym_feature_lock = threading.Lock()
+
+def _encode_gym_cursor(sort_by, value, gym_id):
+    """Opaque cursor pointing just after the gym with this sort value and id"""
+    payload = json.dumps([sort_by, value, gym_id])
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+def _gym_cursor_ranges(column, value, last_id, descending):
+    """Filters for the index ranges holding the gyms after (value, last_id) in ORDER BY column, Gym.id
+
+    NULL sorts as the lowest value, the way SQLite orders it: first ascending, last descending.
+    The ranges follow each other in that order, and each is a single seek on the sort index.
+    """
+    if value is None:
+        nulls = db.and_(column.is_(None), Gym.id > last_id)
+        return [nulls] if descending else [nulls, column.isnot(None)]
+    if descending:
+        return [db.and_(column <= value, db.or_(column < value, Gym.id > last_id)), column.is_(None)]
+    return [db.and_(column >= value, db.or_(column > value, Gym.id > last_id))]
+
+def _decode_gym_cursor(cursor, sort_by):
+    """(sort value, gym id) from a cursor; raises ValueError if it is malformed or for another sort"""
+    try:
+        payload = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        cursor_sort, value, gym_id = json.loads(payload)
+        gym_id = int(gym_id)
+    except (ValueError, TypeError):
+        raise ValueError('Invalid cursor')
+    if cursor_sort != sort_by:
+        raise ValueError('Cursor does not match sort_by')
+    return value, gym_id
+
+def _load_gym_feature_bits(session):
+    """Read gym_feature and publish it as the current GymFeatureBits"""
+    global _gym_feature_bits
+    with _gym_feature_lock:
+        bits = {kind: {} for kind in GYM_FEATURES}
+        for kind, name, bit in session.query(GymFeature.kind, GymFeature.name, GymFeature.bit):
+            bits.setdefault(kind, {})[name] = bit
+        _gym_feature_bits = GymFeatureBits(bits, time.monotonic())
+        return _gym_feature_bits
+
+def _indexed_gym_features(session):
+    """[(kind, name, bit)] for every feature that has a mask bit"""
+    state = _gym_feature_bits or _load_gym_feature_bits(session)
+    return [(kind, name, bit) for kind in GYM_FEATURES
+            for name, bit in sorted(state.bits[kind].items()) if bit is not None]
+
+def _known_gym_features(session, kind, names):
+    """{name: bit} for a feature kind. A missing name reloads the dictionary at most once
+    per GYM_FEATURE_RELOAD_SECONDS, so names no gym has are not looked up on every request"""
+    state = _gym_feature_bits
+    if state is None or (any(name not in state.bits[kind] for name in names) and
+                         time.monotonic() - state.loaded_at > app.config['GYM_FEATURE_RELOAD_SECONDS']):
+        state = _load_gym_feature_bits(session)
+    return state.bits[kind]
+
+def _intern_gym_features(session, kind, names):
+    """{name: bit} for feature names, adding unseen names to the dictionary"""
+    global _gym_feature_bits
+    state = _gym_feature_bits
+    if state is None or any(name not in state.bits[kind] for name in names):
+        # Another process may have added the name since the last load
+        state = _load_gym_feature_bits(session)
+    known = dict(state.bits[kind])  # private copy, published once the new names are in
+    for name in sorted(names):
+        if name not in known:
+            used = sum(bit is not None for bit in known.values())
+            bit = used if used < GYM_FEATURE_BITS else None
+            if bit is None:
+                logger.warning(f"No mask bit left for gym {kind} {name!r}; filtering on it uses a join")
+            session.execute(GymFeature.__table__.insert().values(kind=kind, name=name, bit=bit))
+            known[name] = bit
+    if len(known) > len(state.bits[kind]):
+        with _gym_feature_lock:
+            current = _gym_feature_bits or state
+            _gym_feature_bits = current._replace(bits={**current.bits, kind: {**current.bits[kind], **known}})
+    return {name: known[name] for name in names}
+
+def write_gym_feature_masks(session, gym_ids):
+    """Recompute the feature mask columns of the given gyms from their child rows"""
+    masks = {gym_id: dict.fromkeys(GYM_FEATURES, 0) for gym_id in gym_ids}
+    for kind, (model, _) in GYM_FEATURES.items():
+        rows = session.query(model.gym_id, model.name).filter(model.gym_id.in_(list(gym_ids))).all()
+        bits = _intern_gym_features(session, kind, {name for _, name in rows})
+        for gym_id, name in rows:
+            if bits[name] is not None:
+                masks[gym_id][kind] |= 1 << bits[name]
+
+    gym = Gym.__table__
+    session.execute(
+        gym.update().where(gym.c.id == db.bindparam('gym_id')).values(
+            amenity_mask=db.bindparam('amenity'),
+            equipment_mask=db.bindparam('equipment'),
+            class_mask=db.bindparam('class')
+        ),
+        [dict(kinds, gym_id=gym_id) for gym_id, kinds in masks.items()]
+    )
+
+def _require_gym_features(query, kind, names):
+    """Restrict a gym query to gyms having every named feature with a single bitwise test"""
+    model, mask_column = GYM_FEATURES[kind]
+    known = _known_gym_features(db.session, kind, names)
+    mask = 0
+    for name in names:
+        if name not in known:
+            return query.filter(db.false())
+        if known[name] is None:
+            query = query.filter(db.exists().where(model.gym_id == Gym.id, model.name == name))
+        else:
+            mask |= 1 << known[name]
+    if mask:
+        query = query.filter(mask_column.op('&')(mask) == mask)
+    return query
+
+def _gym_facet_rows(query, features):
+    """(price bucket, rating bucket, count, feature sums...) groups of a filtered gym query"""
+    price_bucket = db.cast(Gym.price_per_month / app.config['GYM_PRICE_BUCKET_WIDTH'], db.Integer)
+    rating_bucket = db.cast(func.coalesce(Gym.rating, 0), db.Integer)
+    # total() of mask & 2**bit is count * 2**bit: exact in a double, and it cannot overflow
+    sums = [func.total(GYM_FEATURES[kind][1].op('&')(1 << bit)) for kind, _, bit in features]
+    return query.order_by(None).with_entities(price_bucket, rating_bucket, func.count(), *sums).group_by(
+        price_bucket, rating_bucket).all()
+
+def _fold_gym_facets(rows, features):
+    """Facet summary from _gym_facet_rows() groups; groups of several queries simply add up"""
+    width = app.config['GYM_PRICE_BUCKET_WIDTH']
+    summary = {kind: {} for kind in GYM_FEATURES}
+    for kind, name, _ in features:
+        summary[kind][name] = 0
+    total = 0
+    prices = {}
+    ratings = {}
+    for price_bucket, rating_bucket, count, *sums in rows:
+        total += count
+        prices[price_bucket] = prices.get(price_bucket, 0) + count
+        ratings[rating_bucket] = ratings.get(rating_bucket, 0) + count
+        for (kind, name, bit), value in zip(features, sums):
+            summary[kind][name] += int(value) >> bit
+
+    summary['total'] = total
+    summary['price'] = [{'min': bucket * width, 'max': (bucket + 1) * width, 'count': count}
+                        for bucket, count in sorted(prices.items())]
+    summary['rating'] = [{'min': bucket, 'max': bucket + 1, 'count': count}
+                         for bucket, count in sorted(ratings.items())]
+    return summary
+
+def gym_facets(query, gym_ids=None):
+    """Total, price histogram, rating buckets and feature counts in one grouped pass.
+
+    With gym_ids (radius search survivors) the pass runs over those gyms instead of the query.
+    """
+    features = _indexed_gym_features(db.session)
+    if gym_ids is None:
+        return _fold_gym_facets(_gym_facet_rows(query, features), features)
+    rows = []
+    for start in range(0, len(gym_ids), 10000):
+        rows.extend(_gym_facet_rows(Gym.query.filter(Gym.id.in_(gym_ids[start:start + 10000])), features))
+    return _fold_gym_facets(rows, features)
+
+def _cached_gym_facets(filters, compute):
+    """Facet summary for a filter set, reused for GYM_TOTAL_TTL_SECONDS or until a gym changes"""
+    now = time.monotonic()
+    cached = _gym_summaries.get(filters)
+    if cached and cached[0] > now:
+        return cached[1]
+    summary = compute()
+    if len(_gym_summaries) >= 1000:
+        _gym_summaries.clear()
+    _gym_summaries[filters] = (now + app.config['GYM_TOTAL_TTL_SECONDS'], summary)
+    return summary
+
+# R*-tree over gym coordinates, kept in sync by triggers (see _ensure_gym_rtree). Each gym is a
+# point box; bounds are stored as float32 rounded outwards, so a box midpoint is within half a
+# metre of the gym's coordinates.
+gym_rtree = table('gym_rtree', column('id'), column('min_lat'), column('max_lat'), column('min_lon'), column('max_lon'))
+
+def _gym_box_rows(query, lat, lon, radius_km, sort_column):
+    """(gym id, latitude, longitude, sort value) for gyms in the bounding box of a circle.
+
+    An unfiltered distance search is answered from the R*-tree alone; otherwise the
+    box is joined to the filtered gym query.
+    """
+    lat_lo, lat_hi, lon_spans = bounding_box(lat, lon, radius_km)
+    value = sort_column if sort_column is not None else literal_column('NULL')
+    if not app.config.get('GYM_RTREE_ENABLED'):
+        return query.filter(
+            Gym.latitude.between(lat_lo, lat_hi),
+            db.or_(*[Gym.longitude.between(lon_lo, lon_hi) for lon_lo, lon_hi in lon_spans])
+        ).with_entities(Gym.id, Gym.latitude, Gym.longitude, value).all()
+
+    in_box = (
+        gym_rtree.c.max_lat >= lat_lo,
+        gym_rtree.c.min_lat <= lat_hi,
+        db.or_(*[db.and_(gym_rtree.c.max_lon >= lon_lo, gym_rtree.c.min_lon <= lon_hi) for lon_lo, lon_hi in lon_spans])
+    )
+    point = (
+        gym_rtree.c.id,
+        (gym_rtree.c.min_lat + gym_rtree.c.max_lat) / 2,
+        (gym_rtree.c.min_lon + gym_rtree.c.max_lon) / 2,
+        value
+    )
+    if sort_column is None and query.whereclause is None:
+        return db.session.execute(db.select(*point).where(*in_box)).all()
+    return query.join(gym_rtree, gym_rtree.c.id == Gym.id).filter(*in_box).with_entities(*point).all()
+
+def _nearby_gym_rows(query, lat, lon, radius_km, sort_by, scorer=None):
+    """[(gym_id, sort value, distance_km)] for gyms within radius_km, in page order.
+
+    The spatial index prunes candidates to the bounding box, so haversine only runs on
+    those survivors; sort_by 'distance' orders by the computed distance and 'best' by
+    the scorer's relevance, using the real distances.
+    """
+    column, descending = GYM_SORTS.get(sort_by, (None, True))
+    by_column = sort_by in GYM_SORTS and sort_by != 'distance'
+    rows = []
+    for gym_id, gym_lat, gym_lon, value in _gym_box_rows(query, lat, lon, radius_km, column if by_column else None):
+        distance = haversine_km(lat, lon, gym_lat, gym_lon)
+        if distance <= radius_km:
+            rows.append((gym_id, value if by_column else distance, distance))
+
+    if scorer is not None:
+        index = gym_rank_index()
+        positions, found = index.locate([gym_id for gym_id, _, _ in rows])
+        distances = np.array([distance for _, _, distance in rows], dtype=np.float64)[found]
+        scores = scorer(index, positions, distances)
+        rows = list(zip(index.ids[positions].tolist(), scores.tolist(), distances.tolist()))
+    rows.sort(key=lambda row: row[0])
+    # NULL sorts as the lowest value, as in the SQL listing (see _gym_cursor_ranges)
+    rows.sort(key=lambda row: (row[1] is not None, row[1]), reverse=descending)
+    return rows
+
+def _after_gym_row(row, value, last_id, descending):
+    if row[1] is None or value is None:
+        if row[1] is None and value is None:
+            return row[0] > last_id
+        return (row[1] is None) == descending
+    if descending:
+        return row[1] < value or (row[1] == value and row[0] > last_id)
+    return row[1] > value or (row[1] == value and row[0] > last_id)
+
+def _after_gym_cursor(rows, value, last_id, descending):
+    """Rows of an ordered _nearby_gym_rows() list that come after the cursor position"""
+    return [row for row in rows if _after_gym_row(row, value, last_id, descending)]
+
+def _splice_gym_document(document, fields):
+    """Append extra top-level fields to a stored gym document without parsing it"""
+    return document[:-1] + ', ' + json.dumps(fields)[1:]
+
+_gym_rank_index = GymRankIndex()
+_gym_rank_pending = set()  # gyms committed in this process since the rank index last read them
+_gym_rank_swept = None  # (time.monotonic(), datetime.utcnow()) of the last sweep for outside writes
+_gym_rank_lock = threading.Lock()  # guards the three above
+
+def gym_rank_index():
+    """The current GymRankSnapshot, loaded in full once and kept current by patching.
+
+    Gyms committed in this process are patched on the next call. Every
+    GYM_RANK_INDEX_TTL_SECONDS gyms written by other processes are swept in by updated_at,
+    and a row count that no longer matches (a delete elsewhere) forces a full reload.
+    A request should score everything against the one snapshot it got from here.
+    """
+    global _gym_rank_pending, _gym_rank_swept
+    columns = [Gym.id] + [getattr(Gym, name) for name in RANK_COLUMNS]
+    with _gym_rank_lock:
+        swept = False
+        if _gym_rank_index.loaded_at is not None and \
+                time.monotonic() - _gym_rank_swept[0] > app.config['GYM_RANK_INDEX_TTL_SECONDS']:
+            # A second of slack covers writers whose commit lands just after their updated_at
+            since = _gym_rank_swept[1] - timedelta(seconds=1)
+            _gym_rank_swept = (time.monotonic(), datetime.utcnow())
+            _gym_rank_pending.update(gym_id for (gym_id,) in db.session.execute(
+                db.select(Gym.id).where(Gym.updated_at >= since)))
+            swept = True
+
+        if _gym_rank_pending and _gym_rank_index.loaded_at is not None:
+            gym_ids, _gym_rank_pending = list(_gym_rank_pending), set()
+            rows = []
+            for start in range(0, len(gym_ids), 10000):
+                rows.extend(db.session.execute(db.select(*columns).where(Gym.id.in_(gym_ids[start:start + 10000]))))
+            _gym_rank_index.patch(gym_ids, rows)
+
+        if _gym_rank_index.loaded_at is None or (
+                swept and db.session.execute(db.select(func.count(Gym.id))).scalar() != len(_gym_rank_index)):
+            _gym_rank_pending = set()
+            _gym_rank_swept = (time.monotonic(), datetime.utcnow())
+            _gym_rank_index.load(db.session.execute(db.select(*columns)).all())
+        return _gym_rank_index.snapshot
+
+def _best_scorer(args):
+    """Relevance function (index, positions, distances=None) -> scores for sort_by=best.
+
+    target_price moves the price component from cheapness to closeness to that price, and
+    prefer_amenity names (repeated or comma separated) drive the amenity component. Raises
+    ValueError when GYM_BEST_PRIOR_REVIEWS is not positive.
+    """
+    prior_reviews = app.config['GYM_BEST_PRIOR_REVIEWS']
+    if not prior_reviews > 0:
+        raise ValueError('GYM_BEST_PRIOR_REVIEWS must be positive')
+    weights, distance_km = app.config['GYM_BEST_WEIGHTS'], app.config['GYM_BEST_DISTANCE_KM']
+    target_price = args.get('target_price', type=float)
+    preferred = {name.strip() for value in args.getlist('prefer_amenity') for name in value.split(',') if name.strip()}
+    known = _known_gym_features(db.session, 'amenity', preferred)
+    preferred_mask = 0
+    for name in preferred:
+        if known.get(name) is not None:
+            preferred_mask |= 1 << known[name]
+
+    def score(index, positions, distances=None):
+        return index.best_scores(
+            positions, weights, prior_reviews, distance_km, target_price=target_price,
+            preferred_mask=preferred_mask, distances=distances
+        )
+    return score
+
+def _required_gym_masks(features):
+    """{mask column name: required bits} for GymFilters.features, or None when some name has
+    no mask bit (unknown names included) and the filter has to run in SQL"""
+    masks = {}
+    for (kind, (_, mask_column)), names in zip(GYM_FEATURES.items(), features):
+        known = _known_gym_features(db.session, kind, names)
+        required = 0
+        for name in names:
+            if known.get(name) is None:
+                return None
+            required |= 1 << known[name]
+        masks[mask_column.key] = required
+    return masks
+
+def gym_query():
+    """Gym query that loads every child collection in one batched SELECT per table"""
+    return Gym.query.options(
+        selectinload(Gym.amenities),
+        selectinload(Gym.operating_hours),
+        selectinload(Gym.equipment),
+        selectinload(Gym.classes)
+    )
+
+def serialize_gym(gym):
+    """API representation of a gym loaded through gym_query(), without the time-dependent is_open"""
+    return {
+        'id': gym.id,
+        'name': gym.name,
+        'address': gym.address,
+        'city': gym.city,
+        'rating': gym.rating,
+        'review_count': gym.review_count,
+        'distance': gym.distance,
+        'latitude': gym.latitude,
+        'longitude': gym.longitude,
+        'price_per_month': gym.price_per_month,
+        'image_url': gym.image_url,
+        'phone': gym.phone,
+        'website': gym.website,
+        'description': gym.description,
+        'amenities': [amenity.name for amenity in gym.amenities],
+        'operating_hours': dict(
+            {'weekdays': '', 'weekends': ''},
+            **{h.day_of_week: h.open_time + ' - ' + h.close_time for h in gym.operating_hours}
+        ),
+        'equipment': [eq.name for eq in gym.equipment],
+        'classes': [cls.name for cls in gym.classes]
+    }
+
+def write_gym_documents(session, gym_ids):
+    """Regenerate the stored documents of the given gyms (deleted gyms lose theirs)"""
+    gym_ids = list(gym_ids)
+    session.execute(GymDocument.__table__.delete().where(GymDocument.gym_id.in_(gym_ids)))
+    gyms = gym_query().filter(Gym.id.in_(gym_ids)).populate_existing().all()
+    if gyms:
+        now = datetime.utcnow()
+        session.execute(GymDocument.__table__.insert(), [
+            {'gym_id': gym.id, 'document': json.dumps(serialize_gym(gym)), 'updated_at': now}
+            for gym in gyms
+        ])
+
+def write_gym_open_intervals(session, gym_ids):
+    """Recompile the open intervals of the given gyms from their operating hours"""
+    gym_ids = list(gym_ids)
+    session.execute(GymOpenInterval.__table__.delete().where(GymOpenInterval.gym_id.in_(gym_ids)))
+    schedules = {}
+    for gym_id, day_of_week, open_time, close_time in session.query(
+            GymOperatingHours.gym_id, GymOperatingHours.day_of_week,
+            GymOperatingHours.open_time, GymOperatingHours.close_time).filter(GymOperatingHours.gym_id.in_(gym_ids)):
+        schedules.setdefault(gym_id, []).append((day_of_week, open_time, close_time))
+
+    intervals = []
+    for gym_id, schedule in schedules.items():
+        try:
+            intervals.extend({'gym_id': gym_id, 'start_minute': start, 'end_minute': end}
+                             for start, end in compile_intervals(schedule))
+        except ValueError as e:
+            logger.warning(f"Skipping operating hours of gym {gym_id}: {e}")
+    if intervals:
+        session.execute(GymOpenInterval.__table__.insert(), intervals)
+
+def _open_at(minute):
+    """Filter clause: the gym has an open interval containing this minute of the week"""
+    return db.exists().where(
+        GymOpenInterval.gym_id == Gym.id,
+        GymOpenInterval.start_minute.between(day_start(minute), minute),
+        GymOpenInterval.end_minute > minute
+    )
+
+def _gyms_open_at(minute):
+    """Subquery of the ids of gyms open at this minute of the week"""
+    return db.select(GymOpenInterval.gym_id).where(
+        GymOpenInterval.start_minute.between(day_start(minute), minute),
+        GymOpenInterval.end_minute > minute
+    )
+
+def gym_open_states(gym_ids, minute):
+    """{gym_id: open at this minute of the week}; gyms without operating hours map to None"""
+    states = dict.fromkeys(gym_ids)
+    rows = db.session.query(
+        GymOpenInterval.gym_id,
+        func.max(db.and_(GymOpenInterval.start_minute <= minute, GymOpenInterval.end_minute > minute))
+    ).filter(GymOpenInterval.gym_id.in_(gym_ids)).group_by(GymOpenInterval.gym_id)
+    for gym_id, is_open in rows:
+        states[gym_id] = bool(is_open)
+    return states
+
+_gym_occupancy = OccupancyTracker(app.config['GYM_BUSY_WEEKS'])
+_gym_occupancy_persisted_at = time.monotonic()
+
+def gym_occupancy():
+    """The occupancy tracker, restored from the persisted snapshots on first use"""
+    if not _gym_occupancy.loaded:
+        _gym_occupancy.restore(
+            (gym_id, occupancy, json.loads(histogram) if histogram else None)
+            for gym_id, occupancy, histogram in db.session.query(GymOccupancy.gym_id, GymOccupancy.occupancy, GymOccupancy.histogram)
+        )
+    return _gym_occupancy
+
+def persist_gym_occupancy(session):
+    """Snapshot the gyms whose occupancy changed since the last call; gyms whose write fails
+    are queued again"""
+    rows = gym_occupancy().take_dirty()
+    try:
+        now = datetime.utcnow()
+        for start in range(0, len(rows), 1000):
+            chunk = rows[start:start + 1000]
+            session.execute(GymOccupancy.__table__.delete().where(GymOccupancy.gym_id.in_([gym_id for gym_id, _, _ in chunk])))
+            session.execute(GymOccupancy.__table__.insert(), [
+                {'gym_id': gym_id, 'occupancy': occupancy,
+                 'histogram': json.dumps(histogram) if histogram else None, 'updated_at': now}
+                for gym_id, occupancy, histogram in chunk
+            ])
+        session.commit()
+    except Exception:
+        session.rollback()
+        _gym_occupancy.requeue(gym_id for gym_id, _, _ in rows)
+        raise
+
+def _persist_gym_occupancy_if_due():
+    global _gym_occupancy_persisted_at
+    now = time.monotonic()
+    if now - _gym_occupancy_persisted_at >= app.config['GYM_OCCUPANCY_PERSIST_SECONDS']:
+        _gym_occupancy_persisted_at = now
+        persist_gym_occupancy(db.session)
+
+@atexit.register
+def _persist_gym_occupancy_on_exit():
+    if _gym_occupancy.dirty:
+        with app.app_context():
+            persist_gym_occupancy(db.session)
+
+def gym_live_fields(gym_ids, minute):
+    """{gym_id: per-request fields spliced into its document}: is_open at this minute of the
+    week, live occupancy and the typical check-ins for the current hour of the week"""
+    open_states = gym_open_states(gym_ids, minute)
+    live = gym_occupancy().current(gym_ids, hour_index(datetime.now()))
+    fields = {}
+    for gym_id in gym_ids:
+        occupancy, typical = live[gym_id]
+        fields[gym_id] = {
+            'is_open': open_states[gym_id],
+            'occupancy': occupancy,
+            'typical_checkins': round(typical, 1) if typical is not None else None
+        }
+    return fields
+
+def _parse_open_at(value):
+    """Minute of the week for an ISO timestamp or Unix seconds, on the same local wall clock
+    as datetime.now() (open_now); an ISO timestamp without an offset is taken as local time"""
+    try:
+        if value.replace('.', '', 1).isdigit():
+            return minute_of_week(datetime.fromtimestamp(float(value)))
+        moment = datetime.fromisoformat(value)
+        if moment.tzinfo is not None:
+            moment = moment.astimezone().replace(tzinfo=None)
+        return minute_of_week(moment)
+    except (ValueError, OverflowError, OSError):
+        raise ValueError('Invalid open_at timestamp')
+
+def load_gym_documents(gym_ids):
+    """{gym_id: document JSON}, serializing (without storing) any gym whose document is missing"""
+    documents = dict(db.session.query(GymDocument.gym_id, GymDocument.document).filter(GymDocument.gym_id.in_(gym_ids)))
+    missing = [gym_id for gym_id in gym_ids if gym_id not in documents]
+    if missing:
+        for gym in gym_query().filter(Gym.id.in_(missing)):
+            documents[gym.id] = json.dumps(serialize_gym(gym))
+    return documents
+
+@event.listens_for(db.session, 'after_flush')
+def _collect_changed_gyms(session, flush_context):
+    changed = session.info.setdefault('changed_gym_ids', set())
+    for instance in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(instance, Gym):
+            changed.add(instance.id)
+        elif isinstance(instance, GYM_CHILD_MODELS):
+            changed.add(instance.gym_id)
+
+@event.listens_for(db.session, 'before_commit')
+def _refresh_gym_documents(session):
+    session.flush()
+    changed = session.info.pop('changed_gym_ids', None)
+    if changed:
+        changed.discard(None)
+        with session.no_autoflush:
+            write_gym_feature_masks(session, changed)
+            write_gym_documents(session, changed)
+            write_gym_open_intervals(session, changed)
+            # Reviews and occupancy of deleted gyms go with them; SQLite leaves the FK cascade unenforced
+            deleted = changed.difference(gym_id for (gym_id,) in session.execute(db.select(Gym.id).where(Gym.id.in_(changed))))
+            if deleted:
+                session.execute(GymReview.__table__.delete().where(GymReview.gym_id.in_(deleted)))
+                session.execute(GymOccupancy.__table__.delete().where(GymOccupancy.gym_id.in_(deleted)))
+                _gym_occupancy.forget(deleted)
+        _gym_summaries.clear()
+        session.info['committed_gym_ids'] = changed
+
+@event.listens_for(db.session, 'after_commit')
+def _queue_gym_rank_patch(session):
+    # Queued only once committed, so the rank index cannot read a gym's row before its commit lands
+    changed = session.info.pop('committed_gym_ids', None)
+    if changed:
+        with _gym_rank_lock:
+            _gym_rank_pending.update(changed)
+
+@event.listens_for(db.session, 'after_rollback')
+def _forget_changed_gyms(session):
+    global _gym_feature_bits
+    session.info.pop('changed_gym_ids', None)
+    session.info.pop('committed_gym_ids', None)
+    # Names interned by the rolled back transaction are gone from gym_feature
+    _gym_feature_bits = None
+
+@event.listens_for(Gym, 'before_insert')
+@event.listens_for(Gym, 'before_update')
+def _locate_gym(mapper, connection, gym):
+    """Resolve coordinates from the city unless they were set explicitly"""
+    state = db.inspect(gym)
+    if gym.latitude is not None and gym.longitude is not None:
+        explicit = state.attrs.latitude.history.has_changes() or state.attrs.longitude.history.has_changes()
+        if explicit or not state.attrs.city.history.has_changes():
+            return
+    coords = resolve_location(gym.city)
+    gym.latitude, gym.longitude = coords if coords else (None, None)
+
+# Normalized /api/gyms filter set; features holds one sorted name tuple per GYM_FEATURES kind
+GymFilters = namedtuple('GymFilters', 'search min_price max_price min_rating features open_minute location')
+
+def _gym_filters(args):
+    """Parse the filter params shared by /api/gyms and /api/gyms/facets.
+
+    Returns (query, count_query, filters, minute, location): count_query is the form of
+    the query suited to aggregates, filters the normalized GymFilters used as cache key,
+    minute the minute of the week is_open refers to and location (lat, lon, radius_km) or
+    None. Raises ValueError for invalid params.
+    """
+    search = args.get('search', '').strip()
+    min_price = args.get('min_price', type=float)
+    max_price = args.get('max_price', type=float)
+    min_rating = args.get('min_rating', type=float)
+    features = {
+        kind: sorted({name.strip() for value in args.getlist(kind) for name in value.split(',') if name.strip()})
+        for kind in GYM_FEATURES
+    }
+    lat = args.get('lat', type=float)
+    lon = args.get('lon', type=float)
+    radius_km = args.get('radius_km', 10.0, type=float)
+    open_at = args.get('open_at')
+    open_now = args.get('open_now', '').lower() in ('1', 'true', 'yes')
+    if (lat is None) != (lon is None):
+        raise ValueError('lat and lon must be given together')
+    if lat is not None and not (-90 <= lat <= 90 and -180 <= lon <= 180 and 0 < radius_km <= 500):
+        raise ValueError('lat, lon or radius_km out of range')
+    minute = _parse_open_at(open_at) if open_at else minute_of_week(datetime.now())
+    open_filter = bool(open_at) or open_now
+
+    # Build query
+    query = Gym.query
+
+    # Apply filters
+    if search:
+        query = query.filter(
+            db.or_(
+                Gym.name.contains(search),
+                Gym.city.contains(search),
+                Gym.address.contains(search)
+            )
+        )
+
+    if min_price is not None:
+        query = query.filter(Gym.price_per_month >= min_price)
+
+    if max_price is not None:
+        query = query.filter(Gym.price_per_month <= max_price)
+
+    if min_rating is not None:
+        query = query.filter(Gym.rating >= min_rating)
+
+    for kind, names in features.items():
+        if names:
+            query = _require_gym_features(query, kind, names)
+
+    count_query = query
+    if open_filter:
+        # Pages probe each candidate's intervals; aggregates scan the interval index once
+        count_query = query.filter(Gym.id.in_(_gyms_open_at(minute)))
+        query = query.filter(_open_at(minute))
+
+    # LIKE is case-insensitive, so searches differing only in case share a cache entry
+    location = (lat, lon, radius_km) if lat is not None else None
+    filters = GymFilters(
+        search.lower(), min_price, max_price, min_rating, tuple(tuple(names) for names in features.values()),
+        minute if open_filter else None, (round(lat, 5), round(lon, 5), radius_km) if location else None
+    )
+    return query, count_query, filters, minute, location
+
 @app.route('/api/gyms', methods=['GET'])
 def get_gyms():
     try:
         # Get query parameters
-        search = request.args.get('search', '')
-        min_price = request.args.get('min_price', type=float)
-        max_price = request.args.get('max_price', type=float)
-        min_rating = request.args.get('min_rating', type=float)
-        amenity = request.args.get('amenity', '')
         sort_by = request.args.get('sort_by', 'distance')
-        limit = request.args.get('limit', 20, type=int)
+        limit = min(max(request.args.get('limit', 20, type=int), 1), 100)
         offset = request.args.get('offset', 0, type=int)
+        cursor = request.args.get('cursor')
+        include_total = request.args.get('include_total', 'true').lower() != 'false'
+        if sort_by not in GYM_SORTS and sort_by != 'best':
+            sort_by = 'distance'
+        try:
+            query, count_query, filters, minute, location = _gym_filters(request.args)
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+        scorer = _best_scorer(request.args) if sort_by == 'best' else None
+
+        if location:
+            return _nearby_gyms_response(query, location, sort_by, cursor, offset, limit, minute,
+                                         filters if include_total else None, scorer)
+
+        if sort_by == 'best':
+            return _best_gyms_response(count_query, filters, cursor, offset, limit, minute, include_total, scorer)
+
+        total = facets = None
+        if include_total:
+            summary = _cached_gym_facets(filters, lambda: gym_facets(count_query))
+            total = summary['total']
+            facets = {kind: summary[kind] for kind in GYM_FEATURES}
 
-        # Build query
-        query = Gym.query
-
-        # Apply filters
-        if search:
-            query = query.filter(
-                db.or_(
-                    Gym.name.contains(search),
-                    Gym.city.contains(search),
-                    Gym.address.contains(search)
-                )
-            )
+        # Apply sorting
+        column, descending = GYM_SORTS[sort_by]
+        query = query.order_by(column.desc() if descending else column.asc(), Gym.id.asc())
 
-        if min_price is not None:
-            query = query.filter(Gym.price_per_month >= min_price)
+        # Apply pagination: seek past the cursor so every page reads index ranges, the NULLs being one
+        if cursor:
+            try:
+                value, last_id = _decode_gym_cursor(cursor, sort_by)
+            except ValueError as e:
+                return jsonify({'success': False, 'error': str(e)}), 400
+            ranges = [query.filter(clause) for clause in _gym_cursor_ranges(column, value, last_id, descending)]
+        else:
+            ranges = [query.offset(offset) if offset else query]
+
+        page = []
+        for page_query in ranges:
+            page += page_query.with_entities(Gym.id, column).limit(limit + 1 - len(page)).all()
+            if len(page) > limit:
+                break
+        has_more = len(page) > limit
+        page = page[:limit]
+
+        # Splice the stored gym documents into the response instead of re-serializing each gym
+        gym_ids = [gym_id for gym_id, _ in page]
+        documents = load_gym_documents(gym_ids)
+        live = gym_live_fields(gym_ids, minute)
+        meta = json.dumps({
+            'total': total,
+            'facets': facets,
+            'offset': offset,
+            'limit': limit,
+            'has_more': has_more,
+            'next_cursor': _encode_gym_cursor(sort_by, page[-1][1], page[-1][0]) if has_more else None
+        })
+        gyms = ', '.join(_splice_gym_document(documents[gym_id], live[gym_id]) for gym_id in gym_ids)
+        body = '{"success": true, "gyms": [' + gyms + '], ' + meta[1:]
+        return app.response_class(body, mimetype='application/json')
 
-        if max_price is not None:
-            query = query.filter(Gym.price_per_month <= max_price)
+    except Exception as e:
+        logger.error(f"Error fetching gyms: {str(e)}")
+        return jsonify({'success': False, 'error': str(e)}), 500
 
-        if min_rating is not None:
-            query = query.filter(Gym.rating >= min_rating)
+def _nearby_gyms_response(query, location, sort_by, cursor, offset, limit, minute, filters, scorer=None):
+    """/api/gyms body for a radius search; every gym carries its distance_km from (lat, lon).
+
+    Facets are included when the filter set to cache them under is given.
+    """
+    rows = _nearby_gym_rows(query, *location, sort_by, scorer)
+    total = len(rows)
+    facets = None
+    if filters:
+        summary = _cached_gym_facets(filters, lambda: gym_facets(None, [gym_id for gym_id, _, _ in rows]))
+        facets = {kind: summary[kind] for kind in GYM_FEATURES}
+    if cursor:
+        try:
+            value, last_id = _decode_gym_cursor(cursor, sort_by)
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+        rows = _after_gym_cursor(rows, value, last_id, GYM_SORTS.get(sort_by, (None, True))[1])
+    elif offset:
+        rows = rows[offset:]
+
+    has_more = len(rows) > limit
+    page = rows[:limit]
+    gym_ids = [gym_id for gym_id, _, _ in page]
+    documents = load_gym_documents(gym_ids)
+    live = gym_live_fields(gym_ids, minute)
+    meta = json.dumps({
+        'total': total,
+        'facets': facets,
+        'offset': offset,
+        'limit': limit,
+        'has_more': has_more,
+        'next_cursor': _encode_gym_cursor(sort_by, page[-1][1], page[-1][0]) if has_more else None
+    })
+    fields = []
+    for gym_id, value, distance in page:
+        extra = dict(live[gym_id], distance_km=round(distance, 3))
+        if scorer is not None:
+            extra['score'] = round(value, 4)
+        fields.append(_splice_gym_document(documents[gym_id], extra))
+    gyms = ', '.join(fields)
+    return app.response_class('{"success": true, "gyms": [' + gyms + '], ' + meta[1:], mimetype='application/json')
+
+def _best_gyms_response(count_query, filters, cursor, offset, limit, minute, include_total, scorer):
+    """/api/gyms body for sort_by=best, scored over every candidate in the rank index.
+
+    Price, rating and feature filters are evaluated on the index arrays; a search or open
+    filter takes the candidate ids from SQL instead. Only the page is ever sorted.
+    """
+    index = gym_rank_index()
+    required = _required_gym_masks(filters.features)
+    if filters.search or filters.open_minute is not None or required is None:
+        positions, _ = index.locate([gym_id for (gym_id,) in count_query.order_by(None).with_entities(Gym.id)])
+    else:
+        positions = index.matching(filters.min_price, filters.max_price, filters.min_rating, required)
+
+    scores = scorer(index, positions)
+    ids = index.ids[positions]
+    after = None
+    if cursor:
+        try:
+            after = _decode_gym_cursor(cursor, 'best')
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+        offset = 0
+    picked = top_k(scores, ids, offset + limit + 1, after)[offset:]
+    has_more = len(picked) > limit
+    picked = picked[:limit]
+    page = list(zip(ids[picked].tolist(), scores[picked].tolist()))
+
+    facets = None
+    if include_total:
+        summary = _cached_gym_facets(filters, lambda: gym_facets(count_query))
+        facets = {kind: summary[kind] for kind in GYM_FEATURES}
+
+    gym_ids = [gym_id for gym_id, _ in page]
+    documents = load_gym_documents(gym_ids)
+    live = gym_live_fields(gym_ids, minute)
+    meta = json.dumps({
+        'total': len(positions) if include_total else None,
+        'facets': facets,
+        'offset': offset,
+        'limit': limit,
+        'has_more': has_more,
+        'next_cursor': _encode_gym_cursor('best', page[-1][1], page[-1][0]) if has_more else None
+    })
+    gyms = ', '.join(_splice_gym_document(documents[gym_id], dict(live[gym_id], score=round(score, 4)))
+                     for gym_id, score in page)
+    return app.response_class('{"success": true, "gyms": [' + gyms + '], ' + meta[1:], mimetype='application/json')
 
-        if amenity:
-            query = query.join(GymAmenity).filter(GymAmenity.name == amenity)
+@app.route('/api/gyms/facets', methods=['GET'])
+def get_gym_facets():
+    """Facet sidebar data (total, price histogram, rating buckets, feature counts) for a filter set"""
+    try:
+        try:
+            query, count_query, filters, _, location = _gym_filters(request.args)
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
 
-        # Apply sorting
-        if sort_by == 'rating':
-            query = query.order_by(Gym.rating.desc())
-        elif sort_by == 'price':
-            query = query.order_by(Gym.price_per_month.asc())
-        elif sort_by == 'name':
-            query = query.order_by(Gym.name.asc())
-        else:  # distance
-            query = query.order_by(Gym.distance.asc())
-
-        # Apply pagination
-        total = query.count()
-        gyms = query.offset(offset).limit(limit).all()
-
-        # Format response
-        gyms_data = []
-        for gym in gyms:
-            gym_data = {
-                'id': gym.id,
-                'name': gym.name,
-                'address': gym.address,
-                'city': gym.city,
-                'rating': gym.rating,
-                'review_count': gym.review_count,
-                'distance': gym.distance,
-                'price_per_month': gym.price_per_month,
-                'image_url': gym.image_url,
-                'phone': gym.phone,
-                'website': gym.website,
-                'description': gym.description,
-                'is_open': gym.is_open,
-                'amenities': [amenity.name for amenity in gym.amenities],
-                'operating_hours': {
-                    'weekdays': next((h.open_time + ' - ' + h.close_time for h in gym.operating_hours if h.day_of_week == 'weekdays'), ''),
-                    'weekends': next((h.open_time + ' - ' + h.close_time for h in gym.operating_hours if h.day_of_week == 'weekends'), '')
-                },
-                'equipment': [eq.name for eq in gym.equipment],
-                'classes': [cls.name for cls in gym.classes]
-            }
-            gyms_data.append(gym_data)
+        if location:
+            compute = lambda: gym_facets(None, [gym_id for gym_id, _, _ in _nearby_gym_rows(query, *location, 'distance')])
+        else:
+            compute = lambda: gym_facets(count_query)
+        summary = _cached_gym_facets(filters, compute)
 
         return jsonify({
             'success': True,
-            'gyms': gyms_data,
-            'total': total,
-            'offset': offset,
-            'limit': limit
+            'total': summary['total'],
+            'facets': {name: facet for name, facet in summary.items() if name != 'total'}
         })
 
     except Exception as e:
-        logger.error(f"Error fetching gyms: {str(e)}")
+        logger.error(f"Error fetching gym facets: {str(e)}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
 @app.route('/api/gyms/<int:gym_id>', methods=['GET'])
 def get_gym(gym_id):
     try:
-        gym = Gym.query.get_or_404(gym_id)
-        
-        gym_data = {
-            'id': gym.id,
-            'name': gym.name,
-            'address': gym.address,
-            'city': gym.city,
-            'rating': gym.rating,
-            'review_count': gym.review_count,
-            'distance': gym.distance,
-            'price_per_month': gym.price_per_month,
-            'image_url': gym.image_url,
-            'phone': gym.phone,
-            'website': gym.website,
-            'description': gym.description,
-            'is_open': gym.is_open,
-            'amenities': [amenity.name for amenity in gym.amenities],
-            'operating_hours': {
-                'weekdays': next((h.open_time + ' - ' + h.close_time for h in gym.operating_hours if h.day_of_week == 'weekdays'), ''),
-                'weekends': next((h.open_time + ' - ' + h.close_time for h in gym.operating_hours if h.day_of_week == 'weekends'), '')
-            },
-            'equipment': [eq.name for eq in gym.equipment],
-            'classes': [cls.name for cls in gym.classes]
-        }
+        document = load_gym_documents([gym_id]).get(gym_id)
+        if document is None:
+            return jsonify({'success': False, 'error': 'Gym not found'}), 404
+
+        fields = gym_live_fields([gym_id], minute_of_week(datetime.now()))[gym_id]
+        return app.response_class('{"success": true, "gym": ' + _splice_gym_document(document, fields) + '}',
+                                  mimetype='application/json')
+
+    except Exception as e:
+        logger.error(f"Error fetching gym {gym_id}: {str(e)}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+# Gym reviews
+_gym = Gym.__table__
+
+# Folds one gym's review delta into its aggregates in a single statement: every SET reads the
+# pre-update row, so concurrent writers serialize on the row instead of losing increments
+_apply_gym_review_delta = _gym.update().where(_gym.c.id == db.bindparam('gym_id_')).values(
+    rating_sum=_gym.c.rating_sum + db.bindparam('rating_delta'),
+    review_count=_gym.c.review_count + db.bindparam('count_delta'),
+    rating=db.case(
+        (_gym.c.review_count + db.bindparam('count_delta') > 0,
+         func.round((_gym.c.rating_sum + db.bindparam('rating_delta')) / (_gym.c.review_count + db.bindparam('count_delta')), 2)),
+        else_=0.0
+    )
+)
+
+def _fold_gym_review_deltas(session, deltas):
+    """Apply {gym_id: (rating delta, count delta)} to the gym aggregates and queue the gyms'
+    documents, facets and rank entries for refresh at commit"""
+    if deltas:
+        session.execute(_apply_gym_review_delta, [
+            {'gym_id_': gym_id, 'rating_delta': rating_delta, 'count_delta': count_delta}
+            for gym_id, (rating_delta, count_delta) in deltas.items()
+        ])
+        session.info.setdefault('changed_gym_ids', set()).update(deltas)
+
+def add_gym_reviews(session, reviews):
+    """Insert review dicts (gym_id, user_id, rating, comment, created_at) and fold them into
+    their gyms' aggregates in the same transaction"""
+    if not reviews:
+        return
+    session.execute(GymReview.__table__.insert(), reviews)
+    deltas = {}
+    for review in reviews:
+        rating_delta, count_delta = deltas.get(review['gym_id'], (0, 0))
+        deltas[review['gym_id']] = (rating_delta + review['rating'], count_delta + 1)
+    _fold_gym_review_deltas(session, deltas)
+
+def delete_gym_review(session, review_id):
+    """Delete a review and take it back out of its gym's aggregates; False if it did not exist"""
+    deleted = session.execute(GymReview.__table__.delete().where(GymReview.id == review_id)
+                              .returning(GymReview.gym_id, GymReview.rating)).first()
+    if deleted is None:
+        return False
+    _fold_gym_review_deltas(session, {deleted.gym_id: (-deleted.rating, -1)})
+    return True
+
+def _parse_gym_review(data, gym_id=None):
+    """Review insert dict from a request payload; raises ValueError for invalid fields"""
+    rating = data.get('rating')
+    if isinstance(rating, bool) or not isinstance(rating, int) or not 1 <= rating <= 5:
+        raise ValueError('rating must be an integer from 1 to 5')
+    gym_id = gym_id if gym_id is not None else data.get('gym_id')
+    if not isinstance(gym_id, int):
+        raise ValueError('gym_id is required')
+    created_at = data.get('created_at')
+    try:
+        created_at = datetime.fromisoformat(created_at) if created_at else datetime.utcnow()
+    except (TypeError, ValueError):
+        raise ValueError('created_at must be an ISO timestamp')
+    return {
+        'gym_id': gym_id,
+        'user_id': data.get('user_id'),
+        'rating': rating,
+        'comment': data.get('comment'),
+        'created_at': created_at
+    }
+
+def _gym_aggregates(gym_id):
+    row = db.session.execute(db.select(Gym.rating, Gym.review_count).where(Gym.id == gym_id)).first()
+    return {'rating': row.rating, 'review_count': row.review_count}
+
+@app.route('/api/gyms/<int:gym_id>/reviews', methods=['GET'])
+def get_gym_reviews(gym_id):
+    """Newest reviews first, paged with a (created_at, id) keyset cursor"""
+    try:
+        limit = min(max(request.args.get('limit', 20, type=int), 1), 100)
+        cursor = request.args.get('cursor')
+        if db.session.get(Gym, gym_id) is None:
+            return jsonify({'success': False, 'error': 'Gym not found'}), 404
+
+        query = db.select(
+            GymReview.id, GymReview.user_id, User.name, GymReview.rating, GymReview.comment, GymReview.created_at
+        ).outerjoin(User, User.id == GymReview.user_id).where(GymReview.gym_id == gym_id)
+        if cursor:
+            try:
+                value, last_id = _decode_gym_cursor(cursor, 'newest')
+                created_at = datetime.fromisoformat(value)
+            except (ValueError, TypeError):
+                return jsonify({'success': False, 'error': 'Invalid cursor'}), 400
+            query = query.where(GymReview.created_at <= created_at,
+                                db.or_(GymReview.created_at < created_at, GymReview.id < last_id))
+        rows = db.session.execute(
+            query.order_by(GymReview.created_at.desc(), GymReview.id.desc()).limit(limit + 1)
+        ).all()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
 
         return jsonify({
             'success': True,
-            'gym': gym_data
+            'reviews': [{
+                'id': row.id,
+                'user_id': row.user_id,
+                'user_name': row.name,
+                'rating': row.rating,
+                'comment': row.comment,
+                'created_at': row.created_at.isoformat()
+            } for row in rows],
+            **_gym_aggregates(gym_id),
+            'has_more': has_more,
+            'next_cursor': _encode_gym_cursor('newest', rows[-1].created_at.isoformat(), rows[-1].id) if has_more else None
         })
 
     except Exception as e:
-        logger.error(f"Error fetching gym {gym_id}: {str(e)}")
+        logger.error(f"Error fetching reviews of gym {gym_id}: {str(e)}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/gyms/<int:gym_id>/reviews', methods=['POST'])
+def create_gym_review(gym_id):
+    try:
+        try:
+            review = _parse_gym_review(request.get_json() or {}, gym_id)
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+        if db.session.get(Gym, gym_id) is None:
+            return jsonify({'success': False, 'error': 'Gym not found'}), 404
+
+        add_gym_reviews(db.session, [review])
+        db.session.commit()
+        return jsonify({'success': True, **_gym_aggregates(gym_id)}), 201
+
+    except Exception as e:
+        logger.error(f"Error creating review for gym {gym_id}: {str(e)}")
+        db.session.rollback()
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/gyms/reviews/bulk', methods=['POST'])
+def import_gym_reviews():
+    """Import historical reviews ({"reviews": [...]}, each with gym_id and optional created_at)
+    in one transaction"""
+    try:
+        data = request.get_json() or {}
+        items = data.get('reviews')
+        if not isinstance(items, list) or not items:
+            return jsonify({'success': False, 'error': 'reviews must be a non-empty list'}), 400
+        if len(items) > app.config['GYM_REVIEW_BULK_LIMIT']:
+            return jsonify({'success': False, 'error': f"At most {app.config['GYM_REVIEW_BULK_LIMIT']} reviews per request"}), 400
+        try:
+            reviews = [_parse_gym_review(item if isinstance(item, dict) else {}) for item in items]
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+
+        gym_ids = {review['gym_id'] for review in reviews}
+        known = {gym_id for (gym_id,) in db.session.execute(db.select(Gym.id).where(Gym.id.in_(gym_ids)))}
+        if known != gym_ids:
+            return jsonify({'success': False, 'error': f'Unknown gym ids: {sorted(gym_ids - known)}'}), 400
+
+        add_gym_reviews(db.session, reviews)
+        db.session.commit()
+        return jsonify({'success': True, 'imported': len(reviews), 'gyms': len(gym_ids)}), 201
+
+    except Exception as e:
+        logger.error(f"Error importing gym reviews: {str(e)}")
+        db.session.rollback()
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/gyms/reviews/<int:review_id>', methods=['DELETE'])
+def remove_gym_review(review_id):
+    try:
+        if not delete_gym_review(db.session, review_id):
+            return jsonify({'success': False, 'error': 'Review not found'}), 404
+        db.session.commit()
+        return jsonify({'success': True})
+
+    except Exception as e:
+        logger.error(f"Error deleting review {review_id}: {str(e)}")
+        db.session.rollback()
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+# Gym occupancy
+GYM_OCCUPANCY_EVENTS = {'checkin': 1, 'checkout': -1}
+
+def _record_gym_occupancy(events):
+    """Apply [(gym_id, delta)] events to the live tracker; returns {gym_id: occupancy}, or
+    None when some gym does not exist"""
+    tracker = gym_occupancy()
+    # Gyms already tracked are known to exist (deleting a gym drops it from the tracker)
+    gym_ids = tracker.untracked({gym_id for gym_id, _ in events})
+    if gym_ids and db.session.execute(db.select(func.count(Gym.id)).where(Gym.id.in_(gym_ids))).scalar() != len(gym_ids):
+        return None
+    occupancy = tracker.record(events, hour_index(datetime.now()))
+    try:
+        _persist_gym_occupancy_if_due()
+    except Exception as e:
+        # The events are recorded in memory and their gyms stay queued for the next snapshot
+        logger.error(f"Error persisting gym occupancy: {str(e)}")
+    return occupancy
+
+@app.route('/api/gyms/<int:gym_id>/checkin', methods=['POST'])
+@app.route('/api/gyms/<int:gym_id>/checkout', methods=['POST'])
+def record_gym_visit(gym_id):
+    try:
+        delta = GYM_OCCUPANCY_EVENTS[request.path.rsplit('/', 1)[1]]
+        occupancy = _record_gym_occupancy([(gym_id, delta)])
+        if occupancy is None:
+            return jsonify({'success': False, 'error': 'Gym not found'}), 404
+        return jsonify({'success': True, 'gym_id': gym_id, 'occupancy': occupancy[gym_id]})
+
+    except Exception as e:
+        logger.error(f"Error recording visit to gym {gym_id}: {str(e)}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/gyms/occupancy/events', methods=['POST'])
+def record_gym_occupancy_events():
+    """Batched check-ins and check-outs, e.g. from a turnstile gateway:
+    {"events": [{"gym_id": 1, "type": "checkin"}, ...]} applied in order"""
+    try:
+        items = (request.get_json() or {}).get('events')
+        if not isinstance(items, list) or not items:
+            return jsonify({'success': False, 'error': 'events must be a non-empty list'}), 400
+        events = []
+        for item in items:
+            if not isinstance(item, dict) or not isinstance(item.get('gym_id'), int) or item.get('type') not in GYM_OCCUPANCY_EVENTS:
+                return jsonify({'success': False, 'error': 'Each event needs an integer gym_id and type checkin or checkout'}), 400
+            events.append((item['gym_id'], GYM_OCCUPANCY_EVENTS[item['type']]))
+
+        occupancy = _record_gym_occupancy(events)
+        if occupancy is None:
+            return jsonify({'success': False, 'error': 'Unknown gym id'}), 400
+        return jsonify({'success': True, 'occupancy': {str(gym_id): count for gym_id, count in occupancy.items()}})
+
+    except Exception as e:
+        logger.error(f"Error recording gym occupancy events: {str(e)}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
 # Workout scheduling endpoints
@@ -812,6 +1946,79 @@ def get_exercises():
         return jsonify({'success': False, 'error': str(e)}), 500
 
 # Initialize database
+def _ensure_user_fts():
+    """Create the user_fts index and its sync triggers, building it from existing users once"""
+    columns = ', '.join(USER_FTS_COLUMNS)
+    new_columns = ', '.join(f'new.{name}' for name in USER_FTS_COLUMNS)
+    old_columns = ', '.join(f'old.{name}' for name in USER_FTS_COLUMNS)
+    try:
+        exists = db.session.execute(text("SELECT 1 FROM sqlite_master WHERE name = 'user_fts'")).first()
+        if not exists:
+            db.session.execute(text(
+                f"CREATE VIRTUAL TABLE user_fts USING fts5({columns}, content='user', content_rowid='id', prefix='2 3')"
+            ))
+            db.session.execute(text("INSERT INTO user_fts(user_fts) VALUES ('rebuild')"))
+        db.session.execute(text(f'''
+            CREATE TRIGGER IF NOT EXISTS user_fts_insert AFTER INSERT ON user BEGIN
+                INSERT INTO user_fts(rowid, {columns}) VALUES (new.id, {new_columns});
+            END
+        '''))
+        db.session.execute(text(f'''
+            CREATE TRIGGER IF NOT EXISTS user_fts_delete AFTER DELETE ON user BEGIN
+                INSERT INTO user_fts(user_fts, rowid, {columns}) VALUES ('delete', old.id, {old_columns});
+            END
+        '''))
+        db.session.execute(text(f'''
+            CREATE TRIGGER IF NOT EXISTS user_fts_update AFTER UPDATE OF {columns} ON user BEGIN
+                INSERT INTO user_fts(user_fts, rowid, {columns}) VALUES ('delete', old.id, {old_columns});
+                INSERT INTO user_fts(rowid, {columns}) VALUES (new.id, {new_columns});
+            END
+        '''))
+        db.session.commit()
+        app.config['USER_FTS_ENABLED'] = True
+    except Exception as e:
+        # SQLite builds without FTS5 keep using the LIKE search
+        db.session.rollback()
+        app.config['USER_FTS_ENABLED'] = False
+        logger.warning(f"User full-text search unavailable: {e}")
+
+def _ensure_gym_rtree():
+    """Create the gym_rtree spatial index and its sync triggers, building it from existing gyms once"""
+    try:
+        exists = db.session.execute(text("SELECT 1 FROM sqlite_master WHERE name = 'gym_rtree'")).first()
+        if not exists:
+            db.session.execute(text('CREATE VIRTUAL TABLE gym_rtree USING rtree(id, min_lat, max_lat, min_lon, max_lon)'))
+            db.session.execute(text('''
+                INSERT INTO gym_rtree
+                SELECT id, latitude, latitude, longitude, longitude FROM gym
+                WHERE latitude IS NOT NULL AND longitude IS NOT NULL
+            '''))
+        db.session.execute(text('''
+            CREATE TRIGGER IF NOT EXISTS gym_rtree_insert AFTER INSERT ON gym
+            WHEN new.latitude IS NOT NULL AND new.longitude IS NOT NULL BEGIN
+                INSERT INTO gym_rtree VALUES (new.id, new.latitude, new.latitude, new.longitude, new.longitude);
+            END
+        '''))
+        db.session.execute(text('''
+            CREATE TRIGGER IF NOT EXISTS gym_rtree_delete AFTER DELETE ON gym BEGIN
+                DELETE FROM gym_rtree WHERE id = old.id;
+            END
+        '''))
+        db.session.execute(text('''
+            CREATE TRIGGER IF NOT EXISTS gym_rtree_update AFTER UPDATE OF latitude, longitude ON gym BEGIN
+                DELETE FROM gym_rtree WHERE id = old.id;
+                INSERT INTO gym_rtree SELECT new.id, new.latitude, new.latitude, new.longitude, new.longitude
+                WHERE new.latitude IS NOT NULL AND new.longitude IS NOT NULL;
+            END
+        '''))
+        db.session.commit()
+        app.config['GYM_RTREE_ENABLED'] = True
+    except Exception as e:
+        # SQLite builds without the rtree module fall back to ix_gym_latitude_longitude
+        db.session.rollback()
+        app.config['GYM_RTREE_ENABLED'] = False
+        logger.warning(f"Gym spatial index unavailable: {e}")
+
 def init_db():
     """Initialize the database with sample data and ensure columns exist"""
     with app.app_context():
@@ -838,6 +2045,66 @@ def init_db():
         _ensure_column('user', 'gender', 'VARCHAR(20)')
         _ensure_column('user', 'height', 'FLOAT')
         _ensure_column('user', 'weight', 'FLOAT')
+        _ensure_column('user', 'latitude', 'FLOAT')
+        _ensure_column('user', 'longitude', 'FLOAT')
+        _ensure_column('user', 'geo_cell', 'INTEGER')
+        _ensure_column('gym', 'latitude', 'FLOAT')
+        _ensure_column('gym', 'longitude', 'FLOAT')
+        _ensure_column('gym', 'amenity_mask', 'INTEGER NOT NULL DEFAULT 0')
+        _ensure_column('gym', 'equipment_mask', 'INTEGER NOT NULL DEFAULT 0')
+        _ensure_column('gym', 'class_mask', 'INTEGER NOT NULL DEFAULT 0')
+        _ensure_column('gym', 'rating_sum', 'FLOAT NOT NULL DEFAULT 0')
+        db.session.execute(text('CREATE INDEX IF NOT EXISTS ix_user_geo_cell ON user (geo_cell)'))
+        for model in (Gym,) + GYM_CHILD_MODELS:
+            for index in model.__table__.indexes:
+                index.create(db.engine, checkfirst=True)
+
+        # Resolve coordinates for gyms saved before they carried any; their stored
+        # documents are dropped so the backfill below rewrites them with the new fields
+        for (city,) in db.session.query(Gym.city).filter(Gym.latitude.is_(None)).distinct().all():
+            coords = resolve_location(city)
+            if coords:
+                unlocated = db.and_(Gym.__table__.c.city == city, Gym.__table__.c.latitude.is_(None))
+                db.session.execute(GymDocument.__table__.delete().where(
+                    GymDocument.gym_id.in_(db.select(Gym.__table__.c.id).where(unlocated))))
+                db.session.execute(Gym.__table__.update().where(unlocated).values(latitude=coords[0], longitude=coords[1]))
+        db.session.commit()
+
+        # Seed the rating sum of gyms that predate it from their stored rating and review count
+        db.session.execute(Gym.__table__.update().where(Gym.__table__.c.rating_sum == 0, Gym.__table__.c.review_count > 0)
+                           .values(rating_sum=Gym.__table__.c.rating * Gym.__table__.c.review_count))
+        db.session.commit()
+
+        # Build feature masks for gyms whose amenities, equipment or classes predate them
+        unmasked = [gym_id for (gym_id,) in db.session.query(Gym.id).filter(
+            Gym.amenity_mask == 0, Gym.equipment_mask == 0, Gym.class_mask == 0,
+            db.or_(*[db.exists().where(model.gym_id == Gym.id) for model, _ in GYM_FEATURES.values()]))]
+        for start in range(0, len(unmasked), 1000):
+            write_gym_feature_masks(db.session, unmasked[start:start + 1000])
+        db.session.commit()
+
+        # Compile open intervals for gyms whose hours predate them, and drop documents that
+        # still carry the stored is_open flag so they are rewritten below
+        uncompiled = [gym_id for (gym_id,) in db.session.query(GymOperatingHours.gym_id).distinct().filter(
+            ~db.exists().where(GymOpenInterval.gym_id == GymOperatingHours.gym_id))]
+        for start in range(0, len(uncompiled), 1000):
+            write_gym_open_intervals(db.session, uncompiled[start:start + 1000])
+        db.session.execute(GymDocument.__table__.delete().where(GymDocument.document.contains('"is_open": ')))
+        db.session.commit()
+
+        # Store documents for gyms written before the document store existed
+        missing = [gym_id for (gym_id,) in db.session.query(Gym.id).outerjoin(GymDocument).filter(GymDocument.gym_id.is_(None))]
+        for start in range(0, len(missing), 1000):
+            write_gym_documents(db.session, missing[start:start + 1000])
+        db.session.commit()
+
+        # Resolve coordinates for users saved before locations were geocoded
+        for user in User.query.filter(User.location.isnot(None), User.geo_cell.is_(None)).all():
+            _set_user_location(user, user.location)
+        db.session.commit()
+
+        _ensure_user_fts()
+        _ensure_gym_rtree()
         
         # Check if data already exists
         if Gym.query.first():
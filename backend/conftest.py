@@ -0,0 +1,5 @@
+import os
+import tempfile
+
+# Point the app at a scratch database before any test imports it; never the checked-in fitness_app.db
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'fitness_app.db')
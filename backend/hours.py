@@ -0,0 +1,82 @@
+"""
+Operating-hours helpers: compile 'HH:MM' opening times into half-open
+minute-of-week intervals (Monday 00:00 is minute 0) that can be indexed and
+probed with a single range comparison.
+"""
+
+MINUTES_PER_DAY = 24 * 60
+MINUTES_PER_WEEK = 7 * MINUTES_PER_DAY
+
+DAY_NAMES = ('monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday')
+
+# Schedule keys a row may use, most general first; a more specific key overrides a general one
+DAY_GROUPS = {
+    'daily': tuple(range(7)),
+    'weekdays': tuple(range(5)),
+    'weekends': (5, 6),
+}
+DAY_GROUPS.update({name: (index,) for index, name in enumerate(DAY_NAMES)})
+
+_SPECIFICITY = {'daily': 0, 'weekdays': 1, 'weekends': 1}
+
+
+def parse_time(value):
+    """Minutes since midnight for 'HH:MM' (24:00 allowed as end of day); raises ValueError"""
+    hours, _, minutes = value.strip().partition(':')
+    hours, minutes = int(hours), int(minutes or 0)
+    if not (0 <= hours <= 24 and 0 <= minutes < 60) or (hours == 24 and minutes):
+        raise ValueError(f'Invalid time: {value!r}')
+    return hours * 60 + minutes
+
+
+def compile_intervals(schedule):
+    """Sorted, non-overlapping [(start_minute, end_minute)] for (day_key, open_time, close_time) rows.
+
+    A close time at or before the open time runs past midnight (equal times mean open
+    24 hours). Intervals are cut at every midnight, so the one containing minute m always
+    starts within m's own day. Unknown day keys raise ValueError.
+    """
+    hours_by_day = {}
+    for day_key, open_time, close_time in sorted(schedule, key=lambda row: _SPECIFICITY.get(row[0].lower(), 2)):
+        days = DAY_GROUPS.get(day_key.lower())
+        if days is None:
+            raise ValueError(f'Unknown day: {day_key!r}')
+        for day in days:
+            hours_by_day[day] = (parse_time(open_time), parse_time(close_time))
+
+    spans = []
+    for day, (opens, closes) in hours_by_day.items():
+        if closes <= opens:
+            closes += MINUTES_PER_DAY
+        start = day * MINUTES_PER_DAY + opens
+        end = day * MINUTES_PER_DAY + closes
+        if end > MINUTES_PER_WEEK:
+            spans.append((start, MINUTES_PER_WEEK))
+            spans.append((0, end - MINUTES_PER_WEEK))
+        else:
+            spans.append((start, end))
+
+    merged = []
+    for start, end in sorted(spans):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+
+    intervals = []
+    for start, end in merged:
+        while start < end:
+            midnight = day_start(start) + MINUTES_PER_DAY
+            intervals.append((start, min(end, midnight)))
+            start = midnight
+    return intervals
+
+
+def day_start(minute):
+    """First minute-of-week of the day containing minute"""
+    return minute - minute % MINUTES_PER_DAY
+
+
+def minute_of_week(moment):
+    """Minute-of-week of a datetime's wall-clock time"""
+    return moment.weekday() * MINUTES_PER_DAY + moment.hour * 60 + moment.minute
@@ -0,0 +1,159 @@
+"""
+Live gym occupancy and rolling busy-hours histograms, held in memory and
+updated in O(1) per check-in or check-out; the app persists snapshots of
+them periodically.
+"""
+
+import threading
+from datetime import date
+
+HOURS_PER_WEEK = 7 * 24
+
+_EPOCH_MONDAY = date(1970, 1, 5).toordinal()
+
+
+def hour_index(moment):
+    """Hours from Monday 1970-01-05 00:00 to a datetime's wall-clock hour; divmod by
+    HOURS_PER_WEEK gives (week, hour of the week with Monday 00:00 as 0)"""
+    return (moment.toordinal() - _EPOCH_MONDAY) * 24 + moment.hour
+
+
+class BusyHistogram:
+    """Check-ins per hour of the week over a rolling window of `weeks` weeks.
+
+    Each of the 168 hour slots owns a ring of `weeks` per-week counters and their running
+    sum. A slot's ring entries for weeks that have passed are cleared the first time the
+    slot is touched in a later week, so both updates and reads cost at most `weeks` steps.
+    """
+
+    __slots__ = ('weeks', 'counts', 'slot_weeks', 'sums', 'first_week')
+
+    def __init__(self, weeks):
+        self.weeks = weeks
+        self.counts = [0] * (HOURS_PER_WEEK * weeks)  # slot * weeks + week % weeks
+        self.slot_weeks = [-1] * HOURS_PER_WEEK  # newest week each slot's ring holds
+        self.sums = [0] * HOURS_PER_WEEK
+        self.first_week = None
+
+    def _advance(self, slot, week):
+        last = self.slot_weeks[slot]
+        if week <= last:
+            return
+        base = slot * self.weeks
+        for expired in range(max(last + 1, week - self.weeks + 1), week + 1):
+            position = base + expired % self.weeks
+            self.sums[slot] -= self.counts[position]
+            self.counts[position] = 0
+        self.slot_weeks[slot] = week
+
+    def add(self, hour, count=1):
+        week, slot = divmod(hour, HOURS_PER_WEEK)
+        self._advance(slot, week)
+        if week <= self.slot_weeks[slot] - self.weeks:
+            return  # older than the window
+        self.counts[slot * self.weeks + week % self.weeks] += count
+        self.sums[slot] += count
+        if self.first_week is None or week < self.first_week:
+            self.first_week = week
+
+    def typical(self, hour):
+        """Mean check-ins in this hour of the week over the completed weeks in the window,
+        or None before a full week has been observed"""
+        week, slot = divmod(hour, HOURS_PER_WEEK)
+        if self.first_week is None or week <= self.first_week:
+            return None
+        self._advance(slot, week)
+        current = self.counts[slot * self.weeks + week % self.weeks]
+        return (self.sums[slot] - current) / min(self.weeks - 1, week - self.first_week)
+
+    def state(self):
+        """JSON-friendly contents for persistence"""
+        return {'weeks': self.weeks, 'counts': list(self.counts), 'slot_weeks': list(self.slot_weeks),
+                'first_week': self.first_week}
+
+    @classmethod
+    def from_state(cls, state):
+        histogram = cls(state['weeks'])
+        histogram.counts = list(state['counts'])
+        histogram.slot_weeks = list(state['slot_weeks'])
+        histogram.first_week = state['first_week']
+        histogram.sums = [sum(histogram.counts[slot * histogram.weeks:(slot + 1) * histogram.weeks])
+                          for slot in range(HOURS_PER_WEEK)]
+        return histogram
+
+
+class OccupancyTracker:
+    """Per-gym live occupancy and BusyHistogram, safe to share between request threads.
+
+    Gyms changed since the last take_dirty() are tracked so persistence only writes those.
+    """
+
+    def __init__(self, weeks=5):
+        self.weeks = weeks
+        self.lock = threading.Lock()
+        self.occupancy = {}
+        self.histograms = {}
+        self.dirty = set()
+        self.loaded = False
+
+    def restore(self, rows):
+        """Load persisted (gym_id, occupancy, histogram state or None) rows, once"""
+        with self.lock:
+            if self.loaded:
+                return
+            for gym_id, occupancy, state in rows:
+                self.occupancy[gym_id] = occupancy
+                if state is not None:
+                    self.histograms[gym_id] = BusyHistogram.from_state(state)
+            self.loaded = True
+
+    def record(self, events, hour):
+        """Apply (gym_id, delta) events, delta 1 for a check-in and -1 for a check-out, in
+        the given hour_index(); returns {gym_id: occupancy after the events}"""
+        with self.lock:
+            for gym_id, delta in events:
+                occupancy = self.occupancy.get(gym_id, 0) + delta
+                # A check-out without a recorded check-in must not drive the count negative
+                self.occupancy[gym_id] = max(occupancy, 0)
+                if delta > 0:
+                    histogram = self.histograms.get(gym_id)
+                    if histogram is None:
+                        histogram = self.histograms[gym_id] = BusyHistogram(self.weeks)
+                    histogram.add(hour, delta)
+                self.dirty.add(gym_id)
+            return {gym_id: self.occupancy[gym_id] for gym_id, _ in events}
+
+    def current(self, gym_ids, hour):
+        """{gym_id: (occupancy, typical check-ins this hour of the week or None)}"""
+        with self.lock:
+            result = {}
+            for gym_id in gym_ids:
+                histogram = self.histograms.get(gym_id)
+                result[gym_id] = (self.occupancy.get(gym_id, 0), histogram.typical(hour) if histogram else None)
+            return result
+
+    def untracked(self, gym_ids):
+        """The gym ids this tracker has never recorded an event for"""
+        with self.lock:
+            return {gym_id for gym_id in gym_ids if gym_id not in self.occupancy}
+
+    def take_dirty(self):
+        """[(gym_id, occupancy, histogram state or None)] for the gyms changed since the last call"""
+        with self.lock:
+            rows = [(gym_id, self.occupancy.get(gym_id, 0), self.histograms[gym_id].state() if gym_id in self.histograms else None)
+                    for gym_id in self.dirty]
+            self.dirty.clear()
+            return rows
+
+    def requeue(self, gym_ids):
+        """Mark gyms dirty again after their snapshots failed to persist"""
+        with self.lock:
+            self.dirty.update(gym_id for gym_id in gym_ids if gym_id in self.occupancy)
+
+    def forget(self, gym_ids):
+        """Drop deleted gyms"""
+        with self.lock:
+            for gym_id in gym_ids:
+                self.occupancy.pop(gym_id, None)
+                self.histograms.pop(gym_id, None)
+                self.dirty.discard(gym_id)
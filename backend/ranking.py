@@ -0,0 +1,162 @@
+"""
+In-memory columnar copy of the gym columns used by the "best" ranking, so a
+composite relevance score can be computed with numpy over every candidate and
+the page picked with a partial partition instead of sorting the whole candidate set.
+"""
+
+import time
+
+import numpy as np
+
+# Columns held per gym, in the order rows are passed to load() and patch()
+RANK_COLUMNS = ('rating', 'review_count', 'distance', 'price_per_month', 'amenity_mask', 'equipment_mask', 'class_mask')
+
+_MASK_COLUMNS = ('amenity_mask', 'equipment_mask', 'class_mask')
+
+
+def _column_arrays(rows):
+    """(ids, {name: values}); a NULL is 0 in the integer columns and NaN (unknown) in the float ones"""
+    ids = np.array([row[0] for row in rows], dtype=np.int64)
+    columns = {}
+    for position, name in enumerate(RANK_COLUMNS, start=1):
+        if name in _MASK_COLUMNS or name == 'review_count':
+            columns[name] = np.array([row[position] or 0 for row in rows], dtype=np.int64)
+        else:
+            columns[name] = np.array([np.nan if row[position] is None else row[position] for row in rows],
+                                     dtype=np.float64)
+    return ids, columns
+
+
+def _known_mean(values):
+    known = values[~np.isnan(values)]
+    return float(known.mean()) if len(known) else 0.0
+
+
+class GymRankSnapshot:
+    """One version of the index: gym ids (ascending) with one numpy array per RANK_COLUMNS
+    entry. Never modified once built, so a request that scores against the snapshot it
+    picked up keeps consistent positions while the index moves on."""
+
+    def __init__(self, ids, columns, loaded_at):
+        for values in (ids, *columns.values()):
+            values.flags.writeable = False
+        self.ids = ids
+        self.columns = columns
+        self.loaded_at = loaded_at  # time.monotonic() of the last full load
+        self.mean_rating = _known_mean(columns['rating'])
+        self.mean_price = _known_mean(columns['price_per_month'])
+
+    def __len__(self):
+        return len(self.ids)
+
+    def locate(self, gym_ids):
+        """(positions, found): array positions of the given gym ids that are in the index, and
+        a boolean array over gym_ids telling which ones were found"""
+        gym_ids = np.asarray(gym_ids, dtype=np.int64)
+        if not len(self.ids):
+            return np.empty(0, dtype=np.int64), np.zeros(len(gym_ids), dtype=bool)
+        positions = np.minimum(np.searchsorted(self.ids, gym_ids), len(self.ids) - 1)
+        found = self.ids[positions] == gym_ids
+        return positions[found], found
+
+    def matching(self, min_price=None, max_price=None, min_rating=None, required_masks=None):
+        """Positions of the gyms passing the structured filters, evaluated on the arrays.
+        An unknown (NaN) price or rating fails its bound, as NULL does in SQL."""
+        keep = np.ones(len(self.ids), dtype=bool)
+        if min_price is not None:
+            keep &= self.columns['price_per_month'] >= min_price
+        if max_price is not None:
+            keep &= self.columns['price_per_month'] <= max_price
+        if min_rating is not None:
+            keep &= self.columns['rating'] >= min_rating
+        for name, required in (required_masks or {}).items():
+            if required:
+                keep &= (self.columns[name] & required) == required
+        return np.flatnonzero(keep)
+
+    def best_scores(self, positions, weights, prior_reviews, distance_km, target_price=None,
+                    preferred_mask=0, distances=None):
+        """Weighted composite relevance of the gyms at the given positions.
+
+        rating: Bayesian average pulling gyms with few reviews towards the mean rating
+        distance: distance_km / (distance_km + d), with d the given distances or the stored column
+        price: closeness to target_price, or cheapness relative to the mean price without one
+        amenities: share of the preferred amenity bits the gym has
+
+        Unknown values are neutral: an unknown rating scores the mean rating, an unknown price
+        the mean price, and an unknown distance adds nothing. prior_reviews must be positive.
+        """
+        rating = self.columns['rating'][positions]
+        reviews = self.columns['review_count'][positions]
+        price = self.columns['price_per_month'][positions]
+        if distances is None:
+            distances = self.columns['distance'][positions]
+
+        rated = ~np.isnan(rating)
+        reviews = np.where(rated, reviews, 0)
+        bayesian = (prior_reviews * self.mean_rating + np.where(rated, rating, 0) * reviews) / (prior_reviews + reviews)
+        score = weights.get('rating', 0) * (bayesian / 5.0)
+        located = ~np.isnan(distances)
+        closeness = distance_km / (distance_km + np.maximum(np.where(located, distances, 0), 0))
+        score += weights.get('distance', 0) * np.where(located, closeness, 0)
+        price = np.where(np.isnan(price), self.mean_price, price)
+        if target_price:
+            score += weights.get('price', 0) * np.clip(1 - np.abs(price - target_price) / target_price, 0, 1)
+        elif self.mean_price:
+            score += weights.get('price', 0) * (self.mean_price / (self.mean_price + price))
+
+        if preferred_mask:
+            amenities = self.columns['amenity_mask'][positions]
+            bits = [bit for bit in range(63) if preferred_mask >> bit & 1]
+            matched = sum((amenities >> bit) & 1 for bit in bits)
+            score += weights.get('amenities', 0) * (matched / len(bits))
+        return score
+
+
+class GymRankIndex:
+    """The current GymRankSnapshot. load() and patch() build the next snapshot in full and
+    publish it with a single assignment; callers serialize them (see gym_rank_index())."""
+
+    def __init__(self):
+        self.snapshot = GymRankSnapshot(*_column_arrays([]), loaded_at=None)
+
+    def __len__(self):
+        return len(self.snapshot)
+
+    @property
+    def loaded_at(self):
+        return self.snapshot.loaded_at
+
+    def load(self, rows):
+        """Replace the contents with (id, *RANK_COLUMNS) rows"""
+        ids, columns = _column_arrays(rows)
+        order = np.argsort(ids, kind='stable')
+        self.snapshot = GymRankSnapshot(ids[order], {name: values[order] for name, values in columns.items()},
+                                        time.monotonic())
+
+    def patch(self, gym_ids, rows):
+        """Drop the given gyms, then add back those still present as (id, *RANK_COLUMNS) rows"""
+        current = self.snapshot
+        keep = ~np.isin(current.ids, np.fromiter(gym_ids, dtype=np.int64))
+        new_ids, new_columns = _column_arrays(rows)
+        ids = np.concatenate([current.ids[keep], new_ids])
+        order = np.argsort(ids, kind='stable')
+        self.snapshot = GymRankSnapshot(ids[order], {
+            name: np.concatenate([values[keep], new_columns[name]])[order]
+            for name, values in current.columns.items()
+        }, current.loaded_at)
+
+
+def top_k(scores, ids, k, after=None):
+    """Indexes of the k best (score desc, id asc) entries, optionally only those after a
+    (score, id) keyset cursor, selected with a partition rather than a full sort"""
+    candidates = np.arange(len(scores))
+    if after is not None:
+        score, last_id = after
+        candidates = np.flatnonzero((scores < score) | ((scores == score) & (ids > last_id)))
+    if len(candidates) > k:
+        # Keep every entry tied with the k-th score so the id tie-break below stays exact
+        kth = np.partition(-scores[candidates], k - 1)[k - 1]
+        candidates = candidates[-scores[candidates] <= kth]
+    order = np.lexsort((ids[candidates], -scores[candidates]))
+    return candidates[order][:k]
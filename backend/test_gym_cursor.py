@@ -0,0 +1,76 @@
+"""
+Cursor pages of /api/gyms walk the same order as offset pages, also across gyms whose sort
+value is NULL (the lowest value: first ascending, last descending).
+
+    cd backend && python -m pytest -q test_gym_cursor.py
+"""
+
+import pytest
+
+# conftest.py points the app at a scratch database
+from app import app, db, init_db, Gym
+
+NEARBY = 'lat=40.7&lon=-74.0&radius_km=50'
+
+
+@pytest.fixture(scope='module')
+def client():
+    init_db()
+    with app.app_context():
+        if not Gym.query.filter(Gym.name.like('Cursor %')).first():
+            for number in range(30):
+                db.session.add(Gym(
+                    name=f'Cursor {number % 7:02d}', address=f'{number} Seek Street', city='New York, NY',
+                    rating=3 + number % 3 / 2, review_count=number, distance=number % 6,
+                    price_per_month=30 + number % 4, latitude=40.7 + number / 1000, longitude=-74.0))
+            db.session.flush()
+            # The columns default to 0.0, so unknown values are set the way older rows hold them
+            cursor_gyms = Gym.query.filter(Gym.name.like('Cursor %'))
+            cursor_gyms.filter(Gym.review_count % 4 == 0).update({Gym.rating: None}, synchronize_session=False)
+            cursor_gyms.filter(Gym.review_count % 5 == 0).update({Gym.distance: None}, synchronize_session=False)
+            db.session.commit()
+    return app.test_client()
+
+
+def _get(client, query):
+    response = client.get(f'/api/gyms?search=Cursor&{query}')
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()
+
+
+def _by_offset(client, query, limit):
+    ids, offset = [], 0
+    while True:
+        body = _get(client, f'{query}&limit={limit}&offset={offset}')
+        ids += [gym['id'] for gym in body['gyms']]
+        if not body['has_more']:
+            return ids
+        offset += limit
+
+
+def _by_cursor(client, query, limit):
+    ids, cursor = [], ''
+    while True:
+        body = _get(client, f'{query}&limit={limit}&cursor={cursor}' if cursor else f'{query}&limit={limit}')
+        ids += [gym['id'] for gym in body['gyms']]
+        if not body['has_more']:
+            return ids
+        cursor = body['next_cursor']
+
+
+@pytest.mark.parametrize('limit', [1, 4, 7])
+@pytest.mark.parametrize('query', [
+    'sort_by=distance', 'sort_by=rating', 'sort_by=price', 'sort_by=name',
+    f'sort_by=rating&{NEARBY}', f'sort_by=price&{NEARBY}', f'sort_by=distance&{NEARBY}',
+])
+def test_cursor_pages_match_offset_pages(client, query, limit):
+    expected = _by_offset(client, query, limit)
+    assert len(expected) == len(set(expected)) == 30
+    assert _by_cursor(client, query, limit) == expected
+
+
+def test_null_sort_values_come_lowest(client):
+    rating = [gym['rating'] for gym in _get(client, 'sort_by=rating&limit=30')['gyms']]
+    assert rating[-8:] == [None] * 8 and None not in rating[:-8]
+    distance = [gym['distance'] for gym in _get(client, 'sort_by=distance&limit=30')['gyms']]
+    assert distance[:6] == [None] * 6 and None not in distance[6:]
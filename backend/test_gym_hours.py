@@ -0,0 +1,63 @@
+"""
+open_at and open_now read the same wall clock: a Unix-seconds or offset-aware open_at for
+the current moment finds the same open gyms as open_now, also on a server that is not on UTC.
+
+    cd backend && python -m pytest -q test_gym_hours.py
+"""
+
+import time
+from datetime import datetime, timezone
+
+import pytest
+
+# conftest.py points the app at a scratch database
+import app as backend
+from app import app, db, init_db, Gym, GymOperatingHours
+
+# Monday 2026-10-19 14:30 UTC, 10:30 in New York
+MOMENT = datetime(2026, 10, 19, 14, 30, tzinfo=timezone.utc)
+
+
+@pytest.fixture
+def new_york(monkeypatch):
+    monkeypatch.setenv('TZ', 'America/New_York')
+    time.tzset()
+    yield
+    monkeypatch.undo()
+    time.tzset()
+
+
+@pytest.fixture
+def client(new_york, monkeypatch):
+    class FrozenDatetime(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return datetime.fromtimestamp(MOMENT.timestamp(), tz)
+
+    init_db()
+    with app.app_context():
+        for name, opens, closes in (('Clock Morning', '09:00', '12:00'), ('Clock Afternoon', '13:00', '16:00')):
+            if not Gym.query.filter_by(name=name).first():
+                gym = Gym(name=name, address='1 Clock Street', city='New York, NY', price_per_month=40)
+                gym.operating_hours = [GymOperatingHours(day_of_week='daily', open_time=opens, close_time=closes)]
+                db.session.add(gym)
+        db.session.commit()
+    monkeypatch.setattr(backend, 'datetime', FrozenDatetime)
+    return app.test_client()
+
+
+def _open_gyms(client, query):
+    response = client.get(f'/api/gyms?search=Clock&include_total=false&{query}')
+    assert response.status_code == 200, response.get_json()
+    return sorted(gym['name'] for gym in response.get_json()['gyms'])
+
+
+@pytest.mark.parametrize('open_at', [
+    str(int(MOMENT.timestamp())),
+    str(MOMENT.timestamp()),
+    MOMENT.isoformat(),
+    '2026-10-19T10:30:00',  # local wall clock without an offset
+])
+def test_open_at_matches_open_now(client, open_at):
+    assert _open_gyms(client, 'open_now=1') == ['Clock Morning']
+    assert _open_gyms(client, 'open_at=' + open_at.replace('+', '%2B')) == ['Clock Morning']
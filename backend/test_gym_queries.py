@@ -0,0 +1,73 @@
+"""
+Gym listings issue a fixed number of SQL statements however many gyms a page holds.
+
+    cd backend && python -m pytest -q test_gym_queries.py
+"""
+
+import pytest
+from sqlalchemy import event
+
+# conftest.py points the app at a scratch database
+from app import app, db, init_db, gym_query, serialize_gym, Gym, GymAmenity, GymOperatingHours, GymEquipment, GymClass
+
+PAGE_SIZES = (5, 20, 100)
+
+
+@pytest.fixture(scope='module')
+def client():
+    init_db()
+    with app.app_context():
+        for number in range(120):
+            gym = Gym(name=f'Gym {number:03d}', address=f'{number} Main Street', city='New York, NY',
+                      rating=3 + number % 20 / 10, review_count=number, distance=number / 10,
+                      price_per_month=30 + number % 50)
+            gym.amenities = [GymAmenity(name='Parking'), GymAmenity(name='Showers')]
+            gym.operating_hours = [GymOperatingHours(day_of_week='daily', open_time='06:00', close_time='22:00')]
+            gym.equipment = [GymEquipment(name='Squat Rack')]
+            gym.classes = [GymClass(name='Yoga')]
+            db.session.add(gym)
+        db.session.commit()
+    return app.test_client()
+
+
+class QueryCounter:
+    def __init__(self):
+        self.statements = []
+
+    def __call__(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+    def __enter__(self):
+        event.listen(db.engine, 'before_cursor_execute', self)
+        return self
+
+    def __exit__(self, *exc_info):
+        event.remove(db.engine, 'before_cursor_execute', self)
+
+
+def test_gym_query_batches_child_collections(client):
+    counts = {}
+    with app.app_context():
+        for limit in PAGE_SIZES:
+            with QueryCounter() as counter:
+                gyms = [serialize_gym(gym) for gym in gym_query().filter(Gym.name.like('Gym %')).order_by(Gym.id).limit(limit).all()]
+            assert len(gyms) == limit
+            assert all(gym['amenities'] and gym['equipment'] and gym['classes'] for gym in gyms)
+            counts[limit] = len(counter.statements)
+    # The gyms, then one selectin load per child collection
+    assert counts == {limit: 5 for limit in PAGE_SIZES}
+
+
+@pytest.mark.parametrize('sort_by', ['distance', 'rating', 'best'])
+def test_gym_listing_queries_do_not_grow_with_page_size(client, sort_by):
+    counts = {}
+    with app.app_context():
+        for limit in PAGE_SIZES:
+            url = f'/api/gyms?sort_by={sort_by}&limit={limit}'
+            client.get(url)  # totals, facets and the rank index are cached after the first page
+            with QueryCounter() as counter:
+                response = client.get(url)
+            assert response.status_code == 200
+            assert len(response.get_json()['gyms']) == limit
+            counts[limit] = len(counter.statements)
+    assert len(set(counts.values())) == 1, counts
@@ -0,0 +1,72 @@
+"""
+The "best" relevance score reads a NULL column as unknown: a gym with an unknown rating,
+price or distance scores as neutral there, never as unrated, free or next door.
+
+    cd backend && python -m pytest -q test_gym_ranking.py
+"""
+
+import numpy as np
+import pytest
+
+# conftest.py points the app at a scratch database
+from app import app, init_db
+from ranking import GymRankIndex
+
+WEIGHTS = {'rating': 0.5, 'distance': 0.25, 'price': 0.15}
+PRIOR_REVIEWS, DISTANCE_KM = 20, 5.0
+
+
+def _snapshot(rows):
+    """Snapshot of (id, rating, review_count, distance, price_per_month) rows"""
+    index = GymRankIndex()
+    index.load([row + (0, 0, 0) for row in rows])
+    return index.snapshot
+
+
+def _scores(snapshot, **options):
+    scores = snapshot.best_scores(np.arange(len(snapshot)), WEIGHTS, PRIOR_REVIEWS, DISTANCE_KM, **options)
+    return dict(zip(snapshot.ids.tolist(), scores.tolist()))
+
+
+def _expected(bayesian, distance, price_term):
+    closeness = 0 if distance is None else DISTANCE_KM / (DISTANCE_KM + distance)
+    return WEIGHTS['rating'] * bayesian / 5 + WEIGHTS['distance'] * closeness + WEIGHTS['price'] * price_term
+
+
+def test_unknown_values_are_neutral():
+    snapshot = _snapshot([(1, 4.0, 50, 2.0, 40.0), (2, 2.0, 50, 8.0, 80.0),
+                          (3, None, 50, 2.0, 40.0), (4, 4.0, 50, None, 40.0), (5, 4.0, 50, 2.0, None)])
+    # Means over the known values only
+    assert (snapshot.mean_rating, snapshot.mean_price) == (3.5, 50.0)
+    scores = _scores(snapshot)
+
+    rated = (PRIOR_REVIEWS * 3.5 + 4.0 * 50) / (PRIOR_REVIEWS + 50)
+    assert scores[1] == pytest.approx(_expected(rated, 2.0, 50 / 90))
+    # Unknown rating: the mean rating, whatever the review count
+    assert scores[3] == pytest.approx(_expected(3.5, 2.0, 50 / 90))
+    # Unknown distance: no distance term, rather than the full term of a gym 0 km away
+    assert scores[4] == pytest.approx(_expected(rated, None, 50 / 90))
+    # Unknown price: the mean price's term, rather than the maximum of a free gym
+    assert scores[5] == pytest.approx(_expected(rated, 2.0, 0.5))
+
+
+def test_unknown_price_with_target_price():
+    snapshot = _snapshot([(1, 4.0, 50, 2.0, 60.0), (2, 4.0, 50, 2.0, 30.0), (3, 4.0, 50, 2.0, None)])
+    scores = _scores(snapshot, target_price=60.0)
+    # Scored at the mean price of 45, a quarter off the target
+    assert scores[1] - scores[3] == pytest.approx(WEIGHTS['price'] * 0.25)
+
+
+def test_unknown_values_fail_structured_filters():
+    snapshot = _snapshot([(1, 4.0, 5, 1.0, 40.0), (2, None, 5, 1.0, None)])
+    assert snapshot.matching(min_rating=1).tolist() == [0]
+    assert snapshot.matching(max_price=100).tolist() == [0]
+
+
+@pytest.mark.parametrize('prior_reviews', [0, -5])
+def test_non_positive_prior_reviews_is_rejected(monkeypatch, prior_reviews):
+    init_db()
+    monkeypatch.setitem(app.config, 'GYM_BEST_PRIOR_REVIEWS', prior_reviews)
+    response = app.test_client().get('/api/gyms?sort_by=best&include_total=false')
+    assert response.status_code == 500
+    assert 'GYM_BEST_PRIOR_REVIEWS' in response.get_json()['error']
@@ -1,4 +1,4 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context
 from flask_cors import CORS
 import sqlite3
 import hashlib
@@ -9,15 +9,17 @@ from werkzeug.security import generate_password_hash, check_password_hash
 import json
 import random
 import numpy as np
-import cv2
-import mediapipe as mp
-import base64
-from io import BytesIO
-from PIL import Image
-from sklearn.metrics.pairwise import cosine_similarity
 from sklearn.preprocessing import StandardScaler
 import pandas as pd
 import logging
+import struct
+import threading
+import time
+from collections import OrderedDict
+
+import geo
+from pose_service import (POSTURE_RULES, PoseService, PoseStreamService, PoseServiceBusy, PoseServiceUnavailable,
+                          analyze_clip, analyze_landmarks, parse_landmark_clip, parse_landmarks)
 
 app = Flask(__name__)
 CORS(app)
@@ -36,10 +38,300 @@ def get_db_connection():
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Initialize MediaPipe
-mp_pose = mp.solutions.pose
-mp_drawing = mp.solutions.drawing_utils
-pose = mp_pose.Pose(min_detection_confidence=0.5, min_tracking_confidence=0.5)
+# Pose inference runs in worker processes that each own a MediaPipe Pose (see pose_service.py);
+# 0 workers / pending means one per core / four per worker; large JPEGs are decoded at a
+# reduced scale keeping the shorter side >= POSE_DECODE_MIN_SIDE (0 decodes at full size)
+POSE_DECODE_MIN_SIDE = int(os.environ.get('POSE_DECODE_MIN_SIDE', 360)) or None
+pose_service = PoseService(
+    workers=int(os.environ.get('POSE_WORKERS', 0)) or None,
+    max_pending=int(os.environ.get('POSE_MAX_PENDING', 0)) or None,
+    timeout=float(os.environ.get('POSE_TIMEOUT_SECONDS', 2.0)),
+    decode_min_side=POSE_DECODE_MIN_SIDE,
+)
+
+# Live camera sessions get their own workers, each tracking the sessions pinned to it
+pose_stream = PoseStreamService(
+    workers=int(os.environ.get('POSE_STREAM_WORKERS', 0)) or None,
+    sessions_per_worker=int(os.environ.get('POSE_STREAM_SESSIONS_PER_WORKER', 4)),
+    timeout=float(os.environ.get('POSE_TIMEOUT_SECONDS', 2.0)),
+    idle_timeout=float(os.environ.get('POSE_STREAM_IDLE_SECONDS', 60)),
+    decode_min_side=POSE_DECODE_MIN_SIDE,
+)
+POSE_STREAM_MAX_FRAME_BYTES = 8 * 1024 * 1024
+POSE_CLIP_MAX_FRAMES = 10000
+
+def _ensure_column(conn, table, column, type_sql):
+    """Add a column to an existing SQLite table if it is missing"""
+    columns = [row[1] for row in conn.execute(f'PRAGMA table_info({table})').fetchall()]
+    if column not in columns:
+        conn.execute(f'ALTER TABLE {table} ADD COLUMN {column} {type_sql}')
+        logger.info(f"Added column {table}.{column}")
+
+def _location_columns(location):
+    """(latitude, longitude, geo_cell) for a free-text location, resolved once at write time"""
+    coords = geo.resolve_location(location)
+    if not coords:
+        return None, None, None
+    return coords[0], coords[1], geo.grid_cell(*coords)
+
+# Weekly availability is stored as a 168-bit hour-of-week bitmap (bit 0 = Monday 00:00-01:00)
+HOURS_PER_WEEK = 168
+AVAILABILITY_BYTES = HOURS_PER_WEEK // 8
+WEEKDAYS = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
+DAY_PERIODS = {
+    'morning': (6, 12),
+    'afternoon': (12, 17),
+    'evening': (17, 22),
+    'night': (22, 24),
+    'all day': (0, 24),
+    'flexible': (0, 24)
+}
+_POPCOUNT = np.array([bin(value).count('1') for value in range(256)], dtype=np.int64)
+
+def _parse_hour(value):
+    """Hour of day as a float from '06:30', '6' or 6.5"""
+    if isinstance(value, str) and ':' in value:
+        hours, minutes = value.strip().split(':', 1)
+        hour = int(hours) + int(minutes) / 60
+    else:
+        hour = float(value)
+    if not 0 <= hour <= 24:
+        raise ValueError(f"Invalid hour: {value}")
+    return hour
+
+def _day_ranges(value):
+    """(start_hour, end_hour) pairs for one day of an availability schedule"""
+    if value is True:
+        return [DAY_PERIODS['all day']]
+    if not value:
+        return []
+    
+    ranges = []
+    for item in value if isinstance(value, list) else [value]:
+        if isinstance(item, str) and item.strip().lower() in DAY_PERIODS:
+            ranges.append(DAY_PERIODS[item.strip().lower()])
+        elif isinstance(item, str) and '-' in item:
+            start, end = item.split('-', 1)
+            ranges.append((_parse_hour(start), _parse_hour(end)))
+        elif isinstance(item, (list, tuple)) and len(item) == 2:
+            ranges.append((_parse_hour(item[0]), _parse_hour(item[1])))
+        else:
+            raise ValueError(f"Invalid availability entry: {item}")
+    return ranges
+
+def _availability_bits(schedule):
+    """Compile an availability_schedule into the 21-byte hour-of-week bitmap.
+
+    Accepts {"monday": ["06:00-08:00", "evening"], "saturday": true}, a list of
+    day names (whole days) or "flexible" (the whole week). Returns None for an
+    empty schedule and raises ValueError for one that cannot be parsed.
+    """
+    if not schedule:
+        return None
+    if isinstance(schedule, str):
+        schedule = [schedule]
+    if isinstance(schedule, list):
+        if any(str(day).strip().lower() == 'flexible' for day in schedule):
+            schedule = {day: True for day in WEEKDAYS}
+        else:
+            schedule = {day: True for day in schedule}
+    if not isinstance(schedule, dict):
+        raise ValueError("availability_schedule must be an object, a list of days or 'flexible'")
+    
+    hours = np.zeros(HOURS_PER_WEEK, dtype=bool)
+    for day, value in schedule.items():
+        day_name = str(day).strip().lower()
+        matches = [index for index, name in enumerate(WEEKDAYS) if len(day_name) >= 3 and name.startswith(day_name)]
+        if not matches:
+            raise ValueError(f"Invalid day: {day}")
+        for start, end in _day_ranges(value):
+            if end <= start:
+                end += 24  # runs past midnight into the next day
+            first = matches[0] * 24 + int(np.floor(start))
+            last = matches[0] * 24 + int(np.ceil(end))
+            hours[np.arange(first, last) % HOURS_PER_WEEK] = True
+    
+    if not hours.any():
+        return None
+    return np.packbits(hours, bitorder='little').tobytes()
+
+def _availability_array(bits=None, schedule=None):
+    """Bitmap as uint8[21] from a stored blob, else compiled from the schedule; zeros if unknown"""
+    if bits is None and schedule:
+        try:
+            bits = _availability_bits(schedule)
+        except ValueError:
+            bits = None
+    if not bits:
+        return np.zeros(AVAILABILITY_BYTES, dtype=np.uint8)
+    return np.frombuffer(bits, dtype=np.uint8)
+
+def _popcount_rows(matrix):
+    """Number of set bits in each row of a uint8 matrix"""
+    return _POPCOUNT[matrix].sum(axis=-1)
+
+def _overlap_hours(value):
+    """The min_overlap_hours search filter as a whole number of hours in 1-168 (default 1)"""
+    if value is None:
+        return 1
+    try:
+        hours = None if isinstance(value, bool) else float(value)
+    except (TypeError, ValueError):
+        hours = None
+    if hours is None or not hours.is_integer() or not 1 <= hours <= HOURS_PER_WEEK:
+        raise ValueError(f"min_overlap_hours must be a whole number of hours from 1 to {HOURS_PER_WEEK}")
+    return int(hours)
+
+def backfill_availability_bits(conn):
+    """Compile availability_bits for users that have a schedule but no bitmap yet"""
+    rows = conn.execute('''
+        SELECT id, availability_schedule FROM users
+        WHERE availability_schedule IS NOT NULL AND availability_bits IS NULL
+    ''').fetchall()
+    updates = []
+    for user_id, schedule in rows:
+        try:
+            bits = _availability_bits(json.loads(schedule))
+        except ValueError:
+            logger.warning(f"Skipping unparseable availability_schedule for user {user_id}")
+            continue
+        if bits:
+            updates.append((bits, user_id))
+    conn.executemany('UPDATE users SET availability_bits = ? WHERE id = ?', updates)
+
+# Partner preference arrays and the junction tables they are normalized into
+PREFERENCE_LISTS = {
+    'preferred_fitness_levels': ('partner_preference_fitness_levels', 'fitness_level'),
+    'preferred_workout_times': ('partner_preference_workout_times', 'workout_time'),
+    'preferred_goals': ('partner_preference_goals', 'goal')
+}
+
+def _normalize_goal(goal):
+    return str(goal).strip().lower().replace(' ', '_')
+
+def _normalize_preference(name, value):
+    return _normalize_goal(value) if name == 'preferred_goals' else str(value).strip().lower()
+
+def _sync_user_goals(conn, user_id, goals):
+    """Rewrite a user's rows in user_goals"""
+    conn.execute('DELETE FROM user_goals WHERE user_id = ?', (user_id,))
+    conn.executemany('INSERT OR IGNORE INTO user_goals (user_id, goal) VALUES (?, ?)',
+                     [(user_id, _normalize_goal(goal)) for goal in goals or []])
+
+def _sync_preference_lists(conn, user_id, preferences):
+    """Rewrite a user's junction rows from a dict of preference arrays"""
+    for name, (table, column) in PREFERENCE_LISTS.items():
+        conn.execute(f'DELETE FROM {table} WHERE user_id = ?', (user_id,))
+        conn.executemany(f'INSERT OR IGNORE INTO {table} (user_id, {column}) VALUES (?, ?)',
+                         [(user_id, _normalize_preference(name, value)) for value in preferences.get(name) or []])
+
+def backfill_preference_tables(conn):
+    """Populate user_goals and the preference junction tables from JSON columns when empty"""
+    if not conn.execute('SELECT 1 FROM user_goals LIMIT 1').fetchone():
+        for user_id, goals in conn.execute('SELECT id, goals FROM users WHERE goals IS NOT NULL').fetchall():
+            try:
+                _sync_user_goals(conn, user_id, json.loads(goals))
+            except ValueError:
+                continue
+    
+    tables = [table for table, _ in PREFERENCE_LISTS.values()]
+    if any(conn.execute(f'SELECT 1 FROM {table} LIMIT 1').fetchone() for table in tables):
+        return
+    rows = conn.execute('''
+        SELECT user_id, preferred_fitness_levels, preferred_workout_times, preferred_goals
+        FROM partner_preferences
+    ''').fetchall()
+    for user_id, *values in rows:
+        try:
+            preferences = {name: json.loads(value) if value else [] for name, value in zip(PREFERENCE_LISTS, values)}
+        except ValueError:
+            continue
+        _sync_preference_lists(conn, user_id, preferences)
+
+def _placeholders(values):
+    return ', '.join('?' for _ in values)
+
+def build_mutual_candidate_query(user, preferences, exclude_ids=(), active_within_days=None):
+    """SQL for ids of users that pass `user`'s partner preferences and whose own preferences accept `user`.
+
+    `preferences` is the dict from MLRecommendationSystem._get_partner_preferences.
+    A preference excludes candidates whose value for it is unknown. Returns (sql, params).
+    """
+    where = ['c.is_active = TRUE']
+    params = []
+    
+    if active_within_days is not None:
+        where.append("c.last_active >= datetime('now', ?)")
+        params.append(f'-{int(active_within_days)} days')
+    if exclude_ids:
+        where.append(f'c.id NOT IN ({_placeholders(exclude_ids)})')
+        params.extend(exclude_ids)
+    
+    # My preferences about the candidate: plain predicates on indexed users columns. Preference
+    # values are lowercased but users columns keep the case they were entered in, hence NOCASE.
+    if preferences.get('min_age') is not None:
+        where.append('c.age >= ?')
+        params.append(preferences['min_age'])
+    if preferences.get('max_age') is not None:
+        where.append('c.age <= ?')
+        params.append(preferences['max_age'])
+    levels = preferences.get('preferred_fitness_levels')
+    if levels:
+        where.append(f'c.fitness_level COLLATE NOCASE IN ({_placeholders(levels)})')
+        params.extend(levels)
+    times = preferences.get('preferred_workout_times')
+    if times and 'flexible' not in times:
+        times = list(times) + ['flexible']
+        where.append(f'c.preferred_workout_time COLLATE NOCASE IN ({_placeholders(times)})')
+        params.extend(times)
+    goals = preferences.get('preferred_goals')
+    if goals:
+        where.append(f'EXISTS (SELECT 1 FROM user_goals g WHERE g.user_id = c.id AND g.goal IN ({_placeholders(goals)}))')
+        params.extend(goals)
+    has_coords = user.get('latitude') is not None and user.get('longitude') is not None
+    if preferences.get('max_distance_km') and has_coords:
+        # Grid cells narrow the search through idx_users_geo_cell; exact distance is checked in Python
+        ranges = geo.cell_ranges(user['latitude'], user['longitude'], preferences['max_distance_km'])
+        where.append('(' + ' OR '.join('c.geo_cell BETWEEN ? AND ?' for _ in ranges) + ')')
+        params.extend(cell for cell_range in ranges for cell in cell_range)
+    
+    # The candidate's preferences about me: every check is a primary key lookup per candidate
+    where.append('(cp.min_age IS NULL OR cp.min_age <= ?)')
+    where.append('(cp.max_age IS NULL OR cp.max_age >= ?)')
+    params.extend([user.get('age'), user.get('age')])
+    
+    my_level = (user.get('fitness_level') or '').lower()
+    where.append('''(NOT EXISTS (SELECT 1 FROM partner_preference_fitness_levels pl WHERE pl.user_id = c.id)
+         OR EXISTS (SELECT 1 FROM partner_preference_fitness_levels pl WHERE pl.user_id = c.id AND pl.fitness_level = ?))''')
+    params.append(my_level)
+    
+    my_time = (user.get('preferred_workout_time') or '').lower()
+    if my_time != 'flexible':
+        where.append('''(NOT EXISTS (SELECT 1 FROM partner_preference_workout_times pt WHERE pt.user_id = c.id)
+         OR EXISTS (SELECT 1 FROM partner_preference_workout_times pt WHERE pt.user_id = c.id AND pt.workout_time IN (?, 'flexible')))''')
+        params.append(my_time)
+    
+    my_goals = sorted({_normalize_goal(goal) for goal in user.get('goals') or []})
+    goal_match = f'''
+         OR EXISTS (SELECT 1 FROM partner_preference_goals pg WHERE pg.user_id = c.id AND pg.goal IN ({_placeholders(my_goals)}))''' if my_goals else ''
+    where.append(f'''(NOT EXISTS (SELECT 1 FROM partner_preference_goals pg WHERE pg.user_id = c.id){goal_match})''')
+    params.extend(my_goals)
+    
+    if has_coords:
+        # Equirectangular distance is accurate to well under 1% at partner-search ranges
+        km_per_degree_lon = geo.KM_PER_DEGREE_LAT * np.cos(np.radians(user['latitude']))
+        where.append('''(cp.max_distance_km IS NULL
+         OR ((c.latitude - ?) * ?) * ((c.latitude - ?) * ?) + ((c.longitude - ?) * ?) * ((c.longitude - ?) * ?)
+            <= cp.max_distance_km * cp.max_distance_km)''')
+        params.extend([user['latitude'], geo.KM_PER_DEGREE_LAT] * 2 + [user['longitude'], float(km_per_degree_lon)] * 2)
+    else:
+        where.append('cp.max_distance_km IS NULL')
+    
+    sql = '''
+        SELECT c.id FROM users c
+        LEFT JOIN partner_preferences cp ON cp.user_id = c.id
+        WHERE ''' + '\n          AND '.join(where)
+    return sql, params
 
 # Enhanced Database initialization
 def init_db():
@@ -61,6 +353,11 @@ def init_db():
             fitness_level TEXT,
             goals TEXT,
             location TEXT,
+            latitude REAL, -- resolved from location with the bundled gazetteer
+            longitude REAL,
+            geo_cell INTEGER, -- geo.grid_cell(latitude, longitude)
+            availability_schedule TEXT,
+            availability_bits BLOB, -- hour-of-week bitmap compiled from availability_schedule
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
             is_active BOOLEAN DEFAULT TRUE,
             last_active TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
@@ -136,6 +433,26 @@ def init_db():
         )
     ''')
     
+    # Normalized copies of the JSON preference arrays (and user goals) for SQL filtering
+    for table, column in PREFERENCE_LISTS.values():
+        conn.execute(f'''
+            CREATE TABLE IF NOT EXISTS {table} (
+                user_id INTEGER NOT NULL,
+                {column} TEXT NOT NULL,
+                PRIMARY KEY (user_id, {column}),
+                FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
+            ) WITHOUT ROWID
+        ''')
+    
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS user_goals (
+            user_id INTEGER NOT NULL,
+            goal TEXT NOT NULL,
+            PRIMARY KEY (user_id, goal),
+            FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
+        ) WITHOUT ROWID
+    ''')
+    
     # Enhanced Messages table with message types and status
     conn.execute('''
         CREATE TABLE IF NOT EXISTS messages (
@@ -166,6 +483,17 @@ def init_db():
         )
     ''')
     
+    # Per-pair rollup of user_interactions; score is decayed to last_at (epoch seconds)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS interaction_aggregates (
+            user_id INTEGER NOT NULL,
+            target_user_id INTEGER NOT NULL,
+            score REAL NOT NULL DEFAULT 0,
+            last_at REAL NOT NULL,
+            PRIMARY KEY (user_id, target_user_id)
+        ) WITHOUT ROWID
+    ''')
+    
     # Workout sessions for partner compatibility
     conn.execute('''
         CREATE TABLE IF NOT EXISTS workout_sessions (
@@ -210,19 +538,103 @@ def init_db():
         )
     ''')
     
+    # Batch-materialized recommendations (written by materialize_recommendations.py)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS recommendation_generations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            top_n INTEGER NOT NULL,
+            shard_count INTEGER NOT NULL,
+            status TEXT CHECK(status IN ('running', 'complete')) DEFAULT 'running',
+            started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            finished_at TIMESTAMP
+        )
+    ''')
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS recommendation_shards (
+            generation_id INTEGER NOT NULL,
+            shard INTEGER NOT NULL,
+            status TEXT CHECK(status IN ('pending', 'complete')) DEFAULT 'pending',
+            users_processed INTEGER DEFAULT 0,
+            seconds REAL,
+            finished_at TIMESTAMP,
+            PRIMARY KEY (generation_id, shard),
+            FOREIGN KEY (generation_id) REFERENCES recommendation_generations (id) ON DELETE CASCADE
+        )
+    ''')
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS recommendations (
+            user_id INTEGER NOT NULL,
+            generation_id INTEGER NOT NULL,
+            rank INTEGER NOT NULL,
+            candidate_id INTEGER NOT NULL,
+            compatibility_score REAL,
+            payload TEXT NOT NULL, -- JSON recommendation as served by the API
+            PRIMARY KEY (user_id, generation_id, rank),
+            FOREIGN KEY (generation_id) REFERENCES recommendation_generations (id) ON DELETE CASCADE
+        )
+    ''')
+
+    # Columns added after the first release
+    _ensure_column(conn, 'users', 'latitude', 'REAL')
+    _ensure_column(conn, 'users', 'longitude', 'REAL')
+    _ensure_column(conn, 'users', 'geo_cell', 'INTEGER')
+    _ensure_column(conn, 'users', 'availability_schedule', 'TEXT')
+    _ensure_column(conn, 'users', 'availability_bits', 'BLOB')
+    _ensure_column(conn, 'users', 'preferred_workout_time', 'TEXT')
+    _ensure_column(conn, 'users', 'name', 'TEXT')
+    _ensure_column(conn, 'users', 'bio', 'TEXT')
+    
     # Add indexes for better performance
     conn.execute('CREATE INDEX IF NOT EXISTS idx_users_location ON users(location)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_users_geo_cell ON users(geo_cell)')
     conn.execute('CREATE INDEX IF NOT EXISTS idx_users_fitness_level ON users(fitness_level)')
     conn.execute('CREATE INDEX IF NOT EXISTS idx_users_active ON users(is_active, last_active)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_users_updated_at ON users(updated_at)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_users_last_active ON users(last_active)')
+    # Shapes used by build_mutual_candidate_query, which matches these columns case-insensitively
+    conn.execute('DROP INDEX IF EXISTS idx_users_active_level_age')
+    conn.execute('DROP INDEX IF EXISTS idx_users_active_time_age')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_users_active_level_nocase_age ON users(is_active, fitness_level COLLATE NOCASE, age)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_users_active_time_nocase_age ON users(is_active, preferred_workout_time COLLATE NOCASE, age)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_users_active_age ON users(is_active, age)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_partner_preferences_user ON partner_preferences(user_id)')
     conn.execute('CREATE INDEX IF NOT EXISTS idx_partners_user_id ON partners(user_id)')
     conn.execute('CREATE INDEX IF NOT EXISTS idx_partners_status ON partners(status)')
     conn.execute('CREATE INDEX IF NOT EXISTS idx_interactions_user_id ON user_interactions(user_id)')
     conn.execute('CREATE INDEX IF NOT EXISTS idx_messages_participants ON messages(sender_id, receiver_id)')
     
+    backfill_interaction_aggregates(conn)
+    backfill_availability_bits(conn)
+    backfill_preference_tables(conn)
+    
     conn.commit()
     conn.close()
     logger.info("Database initialized successfully")
 
+def _haversine_km(lat1, lon1, lat2, lon2):
+    """Vectorized great-circle distance in km (see geo.haversine_km for the scalar version)"""
+    phi1 = np.radians(lat1)
+    phi2 = np.radians(lat2)
+    d_phi = phi2 - phi1
+    d_lambda = np.radians(lon2 - lon1)
+    a = np.sin(d_phi / 2) ** 2 + np.cos(phi1) * np.cos(phi2) * np.sin(d_lambda / 2) ** 2
+    return 2 * geo.EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(1.0, a)))
+
+def _cosine_rows(matrix, vector):
+    """Cosine similarity of every row of `matrix` against `vector`.
+
+    Zero-length vectors get a similarity of 0, like sklearn's cosine_similarity.
+    The scalar and batch scoring paths both go through here so they agree bit for bit.
+    """
+    row_norms = np.sqrt((matrix * matrix).sum(axis=1))
+    row_norms[row_norms == 0] = 1.0
+    vector_norm = np.sqrt((vector * vector).sum())
+    if vector_norm == 0:
+        vector_norm = 1.0
+    return ((matrix / row_norms[:, None]) * (vector / vector_norm)).sum(axis=1)
+
 # Advanced Partner Matching Algorithm
 class PartnerMatcher:
     def __init__(self):
@@ -234,7 +646,15 @@ class PartnerMatcher:
             'strength': [0, 0, 0, 1, 0],
             'general_fitness': [0, 0, 0, 0, 1]
         }
-    
+        # Same weights (and order) as calculate_compatibility_score
+        self.score_weights = [
+            ('age', 0.20),
+            ('fitness_level', 0.25),
+            ('goals', 0.30),
+            ('schedule', 0.15),
+            ('location', 0.10)
+        ]
+
     def calculate_compatibility_score(self, user1, user2):
         """Calculate comprehensive compatibility score between two users"""
         scores = {}
@@ -274,7 +694,9 @@ class PartnerMatcher:
         
         # Location proximity (10% weight)
         location_score = self._calculate_location_compatibility(
-            user1.get('location'), user2.get('location')
+            user1.get('location'), user2.get('location'),
+            (user1.get('latitude'), user1.get('longitude')),
+            (user2.get('latitude'), user2.get('longitude'))
         )
         scores['location'] = location_score
         weighted_score += location_score * 0.10
@@ -332,7 +754,7 @@ class PartnerMatcher:
         vector2 = self._goals_to_vector(goals2)
         
         # Calculate cosine similarity
-        similarity = cosine_similarity([vector1], [vector2])[0][0]
+        similarity = float(_cosine_rows(np.array([vector1], dtype=float), np.array(vector2, dtype=float))[0])
         return max(0, similarity * 100)
     
     def _goals_to_vector(self, goals):
@@ -350,6 +772,15 @@ class PartnerMatcher:
     
     def _calculate_schedule_compatibility(self, time1, time2, schedule1, schedule2):
         """Calculate schedule compatibility"""
+        # Hours free at the same time, relative to the smaller of the two schedules
+        availability1 = _availability_array(schedule=schedule1)
+        availability2 = _availability_array(schedule=schedule2)
+        hours1 = int(_popcount_rows(availability1))
+        hours2 = int(_popcount_rows(availability2))
+        if hours1 and hours2:
+            overlap = int(_popcount_rows(availability1 & availability2))
+            return 100 * overlap // min(hours1, hours2)
+        
         if not time1 or not time2:
             return 50
         
@@ -361,21 +792,33 @@ class PartnerMatcher:
         else:
             base_score = 40
         
-        # TODO: Add detailed schedule analysis if available
         return base_score
     
-    def _calculate_location_compatibility(self, loc1, loc2):
-        """Calculate location compatibility (simplified)"""
+    def _calculate_location_compatibility(self, loc1, loc2, coords1=None, coords2=None):
+        """Calculate location compatibility from real distance, or text when coordinates are unknown"""
+        if coords1 and coords2 and None not in coords1 and None not in coords2:
+            distance = _haversine_km(np.array([coords1[0]]), np.array([coords1[1]]),
+                                     np.array([coords2[0]]), np.array([coords2[1]]))[0]
+            return int(self._distance_scores(distance))
+
         if not loc1 or not loc2:
             return 50
         
-        # Simple string matching (in real app, use geocoding)
+        # Simple string matching for locations the gazetteer could not resolve
         if loc1.lower() == loc2.lower():
             return 100
         elif any(word in loc2.lower() for word in loc1.lower().split()):
             return 75
         else:
             return 30
+
+    def _distance_scores(self, distance_km):
+        """Location score for a distance in km (array or scalar)"""
+        return np.select(
+            [distance_km <= 10, distance_km <= 50, distance_km <= 150],
+            [100, 75, 50],
+            30
+        )
     
     def _generate_match_factors(self, scores):
         """Generate human-readable match factors"""
@@ -391,67 +834,858 @@ class PartnerMatcher:
             factors.append("Compatible schedules")
         if scores.get('location', 0) >= 70:
             factors.append("Close location")
-        
+
         return factors
 
+    def score_many(self, user, candidates):
+        """Score one user against many candidates in a single vectorized pass.
+
+        Returns the same dicts as calculate_compatibility_score, in candidate order.
+        """
+        if not candidates:
+            return []
+
+        scores = self.score_encoded(user, self.encode_candidates(candidates))
+        return [self.build_score_result(scores, row) for row in range(len(candidates))]
+
+    def encode_candidates(self, candidates):
+        """Encode candidate profiles into column arrays for score_encoded"""
+        count = len(candidates)
+        ages = np.full(count, np.nan)
+        fitness_levels = np.zeros(count, dtype=np.int64)  # 0 means unknown
+        goals = np.zeros((count, 5))
+        has_goals = np.zeros(count, dtype=bool)
+        times = []
+        locations = []
+        latitudes = np.full(count, np.nan)
+        longitudes = np.full(count, np.nan)
+        availability = np.zeros((count, AVAILABILITY_BYTES), dtype=np.uint8)
+
+        for row, candidate in enumerate(candidates):
+            if candidate.get('age'):
+                ages[row] = candidate['age']
+            if candidate.get('fitness_level'):
+                fitness_levels[row] = self.fitness_level_weights.get(candidate['fitness_level'].lower(), 2)
+            candidate_goals = candidate.get('goals', [])
+            if candidate_goals:
+                has_goals[row] = True
+                goals[row] = self._goals_to_vector(candidate_goals)
+            # Empty string stands for "unknown", matching the `not value` checks above
+            times.append((candidate.get('preferred_workout_time') or '').lower())
+            locations.append((candidate.get('location') or '').lower())
+            if candidate.get('latitude') is not None and candidate.get('longitude') is not None:
+                latitudes[row] = candidate['latitude']
+                longitudes[row] = candidate['longitude']
+            # Snapshot rows carry the precompiled bitmap; plain profiles are compiled here
+            availability[row] = _availability_array(candidate.get('availability_bits'),
+                                                    candidate.get('availability_schedule'))
+
+        return {
+            'age': ages,
+            'fitness_level': fitness_levels,
+            'goals': goals,
+            'has_goals': has_goals,
+            'preferred_workout_time': np.array(times, dtype=str),
+            'location': np.array(locations, dtype=str),
+            'latitude': latitudes,
+            'longitude': longitudes,
+            'availability': availability,
+            'availability_hours': _popcount_rows(availability)
+        }
+
+    def score_encoded(self, user, features):
+        """Compute all sub-scores and the weighted total for encoded candidates.
+
+        Mirrors the scalar _calculate_* helpers rule for rule; returns a dict of arrays
+        keyed like detailed_scores plus 'overall' (unrounded).
+        """
+        count = len(features['age'])
+        scores = {}
+
+        # Age compatibility
+        user_age = user.get('age')
+        if not user_age:
+            scores['age'] = np.full(count, 50)
+        else:
+            ages = features['age']
+            age_diff = np.abs(ages - user_age)
+            scores['age'] = np.select(
+                [np.isnan(ages), age_diff <= 2, age_diff <= 5, age_diff <= 10, age_diff <= 15],
+                [50, 100, 85, 70, 50],
+                25
+            )
+
+        # Fitness level compatibility
+        user_level = user.get('fitness_level')
+        if not user_level:
+            scores['fitness_level'] = np.full(count, 50)
+        else:
+            levels = features['fitness_level']
+            level_diff = np.abs(levels - self.fitness_level_weights.get(user_level.lower(), 2))
+            scores['fitness_level'] = np.select(
+                [levels == 0, level_diff == 0, level_diff == 1],
+                [50, 100, 80],
+                60
+            )
+
+        # Goals compatibility
+        user_goals = user.get('goals', [])
+        if not user_goals:
+            scores['goals'] = np.full(count, 50.0)
+        else:
+            similarity = _cosine_rows(features['goals'], np.array(self._goals_to_vector(user_goals), dtype=float))
+            scores['goals'] = np.where(features['has_goals'], np.maximum(0, similarity * 100), 50.0)
+
+        # Schedule compatibility
+        user_time = user.get('preferred_workout_time')
+        if not user_time:
+            scores['schedule'] = np.full(count, 50)
+        else:
+            user_time = user_time.lower()
+            times = features['preferred_workout_time']
+            flexible = (times == 'flexible') | (user_time == 'flexible')
+            scores['schedule'] = np.select(
+                [times == '', times == user_time, flexible],
+                [50, 100, 85],
+                40
+            )
+        # Where both sides have availability, the hour-of-week overlap replaces the time rule
+        user_availability = _availability_array(user.get('availability_bits'), user.get('availability_schedule'))
+        user_hours = int(_popcount_rows(user_availability))
+        if user_hours:
+            both = features['availability_hours'] > 0
+            overlap = _popcount_rows(features['availability'][both] & user_availability)
+            scores['schedule'][both] = 100 * overlap // np.minimum(features['availability_hours'][both], user_hours)
+
+        # Location compatibility: real distance where both sides have coordinates, text otherwise
+        user_location = user.get('location')
+        if not user_location:
+            scores['location'] = np.full(count, 50)
+        else:
+            user_location = user_location.lower()
+            locations = features['location']
+            partial = np.zeros(count, dtype=bool)
+            for word in user_location.split():
+                partial |= np.char.find(locations, word) >= 0
+            scores['location'] = np.select(
+                [locations == '', locations == user_location, partial],
+                [50, 100, 75],
+                30
+            )
+        if user.get('latitude') is not None and user.get('longitude') is not None:
+            known = ~np.isnan(features['latitude'])
+            candidates = np.count_nonzero(known)
+            distances = _haversine_km(np.full(candidates, user['latitude']), np.full(candidates, user['longitude']),
+                                      features['latitude'][known], features['longitude'][known])
+            scores['location'][known] = self._distance_scores(distances)
+
+        # Weighted total, accumulated in the same order as the scalar path
+        weighted_score = np.zeros(count)
+        total_weight = 0
+        for name, weight in self.score_weights:
+            weighted_score = weighted_score + scores[name] * weight
+            total_weight += weight
+        scores['overall'] = (weighted_score / total_weight) * 100
+
+        return scores
+
+    def build_score_result(self, scores, row):
+        """Turn one row of score_encoded output into a calculate_compatibility_score dict"""
+        detailed_scores = {
+            'age': int(scores['age'][row]),
+            'fitness_level': int(scores['fitness_level'][row]),
+            'goals': float(scores['goals'][row]),
+            'schedule': int(scores['schedule'][row]),
+            'location': int(scores['location'][row])
+        }
+
+        return {
+            'overall_score': round(float(scores['overall'][row]), 1),
+            'detailed_scores': detailed_scores,
+            'match_factors': self._generate_match_factors(detailed_scores)
+        }
+
+def _resize_column(column, size, values):
+    """Grow `column` to `size` rows, widening its dtype (e.g. string length) to fit `values`"""
+    dtype = np.result_type(column, values)
+    if column.shape[0] == size and column.dtype == dtype:
+        return column
+    resized = np.zeros((size,) + column.shape[1:], dtype=dtype)
+    resized[:column.shape[0]] = column
+    return resized
+
+def _timestamp_to_epoch(value):
+    """Convert a SQLite CURRENT_TIMESTAMP string (UTC) to epoch seconds"""
+    if not value:
+        return np.nan
+    try:
+        parsed = datetime.datetime.fromisoformat(str(value))
+    except ValueError:
+        return np.nan
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=datetime.timezone.utc)
+    return parsed.timestamp()
+
+# Interaction weights for the ML adjustment and how quickly they fade
+INTERACTION_WEIGHTS = {
+    'like': 5,
+    'message': 3,
+    'workout_together': 10,
+    'block': -20,
+    # Connection requests and responses, weighted like the interaction_value they record
+    'connection_request': 1,
+    'accepted': 2,
+    'declined': -1
+}
+INTERACTION_HALF_LIFE_DAYS = 30
+
+def _decay(score, last_at, now):
+    """Decay an aggregate score from last_at to now (epoch seconds)"""
+    return score * 0.5 ** (max(0.0, now - last_at) / (INTERACTION_HALF_LIFE_DAYS * 86400))
+
+def _fold_interaction(aggregate, weight, at):
+    """Add one interaction to a (score, last_at) aggregate"""
+    if aggregate is None:
+        return weight, at
+    score, last_at = aggregate
+    return _decay(score, last_at, at) + weight, max(last_at, at)
+
+def record_interaction(cursor, user_id, target_user_id, interaction_type, interaction_value=1.0):
+    """Insert a user_interactions row and fold it into the pair's aggregate"""
+    cursor.execute('''
+        INSERT INTO user_interactions (user_id, target_user_id, interaction_type, interaction_value)
+        VALUES (?, ?, ?, ?)
+    ''', (user_id, target_user_id, interaction_type, interaction_value))
+    
+    weight = INTERACTION_WEIGHTS.get(interaction_type, 0)
+    if not weight:
+        return
+    
+    cursor.execute('''
+        SELECT score, last_at FROM interaction_aggregates
+        WHERE user_id = ? AND target_user_id = ?
+    ''', (user_id, target_user_id))
+    score, last_at = _fold_interaction(cursor.fetchone(), weight, time.time())
+    cursor.execute('''
+        INSERT OR REPLACE INTO interaction_aggregates (user_id, target_user_id, score, last_at)
+        VALUES (?, ?, ?, ?)
+    ''', (user_id, target_user_id, score, last_at))
+
+def backfill_interaction_aggregates(conn):
+    """Build interaction_aggregates from the full user_interactions history if it is empty"""
+    if conn.execute('SELECT 1 FROM interaction_aggregates LIMIT 1').fetchone():
+        return
+    
+    aggregates = {}
+    cursor = conn.execute('''
+        SELECT user_id, target_user_id, interaction_type, created_at
+        FROM user_interactions
+        ORDER BY created_at, id
+    ''')
+    for user_id, target_user_id, interaction_type, created_at in cursor:
+        weight = INTERACTION_WEIGHTS.get(interaction_type, 0)
+        at = _timestamp_to_epoch(created_at)
+        if not weight or np.isnan(at):
+            continue
+        key = (user_id, target_user_id)
+        aggregates[key] = _fold_interaction(aggregates.get(key), weight, at)
+    
+    conn.executemany('''
+        INSERT INTO interaction_aggregates (user_id, target_user_id, score, last_at)
+        VALUES (?, ?, ?, ?)
+    ''', [key + value for key, value in aggregates.items()])
+    if aggregates:
+        logger.info(f"Backfilled {len(aggregates)} interaction aggregates")
+
+# Process-wide columnar snapshot of users
+class CandidateSnapshot:
+    """Columnar in-memory copy of the users table used for partner retrieval.
+
+    Numeric and encoded fields are NumPy arrays aligned with `ids`; `row_index`
+    maps a user id to its row. Rows are never removed, so row numbers stay
+    stable and deactivated users are simply masked out via `is_active`.
+    """
+
+    columns = ['id', 'name', 'age', 'fitness_level', 'goals', 'location',
+               'latitude', 'longitude', 'preferred_workout_time', 'availability_schedule', 'availability_bits', 'bio',
+               'last_active', 'is_active', 'updated_at']
+    # Users created through /api/auth/register only have first and last names
+    column_sql = {'name': "COALESCE(name, TRIM(COALESCE(first_name, '') || ' ' || COALESCE(last_name, '')))"}
+
+    def __init__(self, matcher, min_refresh_interval=5):
+        self.matcher = matcher
+        self.min_refresh_interval = min_refresh_interval
+        self.lock = threading.RLock()
+        self.row_index = {}
+        self.profiles = []
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.is_active = np.zeros(0, dtype=bool)
+        self.last_active = np.zeros(0)
+        self.fitness_level_names = np.zeros(0, dtype=str)
+        self.features = matcher.encode_candidates([])
+        self.updated_watermark = None
+        self.active_watermark = None
+        self.last_refresh = None
+        self.index = PartnerIndex(self)
+        self.geo_index = geo.GeoGridIndex()
+        # Callables notified with the decoded profiles after every refresh
+        self.listeners = []
+
+    def refresh(self, conn, force=False):
+        """Load users changed since the last sync and return their decoded profiles.
+
+        The first call loads the whole table; later calls only fetch rows whose
+        updated_at or last_active reached the previous high-water marks, and of
+        those only rows that differ from the stored profile are applied and returned.
+        """
+        with self.lock:
+            now = time.monotonic()
+            if not force and self.last_refresh is not None and now - self.last_refresh < self.min_refresh_interval:
+                return []
+            self.last_refresh = now
+
+            query = 'SELECT {} FROM users'.format(', '.join(self.column_sql.get(c, c) for c in self.columns))
+            params = ()
+            if self.updated_watermark is not None or self.active_watermark is not None:
+                # >= so rows sharing the watermark second are not missed
+                query += ' WHERE updated_at >= ? OR last_active >= ?'
+                params = (self.updated_watermark or '', self.active_watermark or '')
+
+            cursor = conn.cursor()
+            cursor.execute(query, params)
+            rows = cursor.fetchall()
+            if not rows:
+                return []
+
+            profiles = [self._decode_row(row) for row in rows]
+            # Rows at the watermark second come back on every refresh; skip the unchanged ones
+            # so they are not re-indexed and their cached recommendations stay valid
+            profiles = [p for p in profiles if p['id'] not in self.row_index
+                        or self.profiles[self.row_index[p['id']]] != p]
+            if not profiles:
+                return []
+            self._apply(profiles)
+
+            updated = [p['updated_at'] for p in profiles if p['updated_at']]
+            active = [p['last_active'] for p in profiles if p['last_active']]
+            if updated:
+                self.updated_watermark = max([self.updated_watermark or ''] + updated)
+            if active:
+                self.active_watermark = max([self.active_watermark or ''] + active)
+
+            for listener in self.listeners:
+                listener(profiles)
+
+            return profiles
+
+    def _decode_row(self, row):
+        profile = dict(zip(self.columns, row))
+        profile['goals'] = json.loads(profile['goals']) if profile['goals'] else []
+        profile['availability_schedule'] = json.loads(profile['availability_schedule']) if profile['availability_schedule'] else {}
+        profile['is_active'] = bool(profile['is_active'])
+        return profile
+
+    def _apply(self, profiles):
+        """Write decoded profiles into their rows, appending rows for new users"""
+        target_rows = []
+        size = len(self.profiles)
+        for profile in profiles:
+            row = self.row_index.get(profile['id'])
+            if row is None:
+                row = size
+                size += 1
+                self.row_index[profile['id']] = row
+                self.profiles.append(profile)
+            else:
+                self.profiles[row] = profile
+            target_rows.append(row)
+        target_rows = np.array(target_rows, dtype=np.int64)
+
+        encoded = self.matcher.encode_candidates(profiles)
+        for key, values in encoded.items():
+            self.features[key] = _resize_column(self.features[key], size, values)
+            self.features[key][target_rows] = values
+
+        columns = {
+            'ids': np.array([p['id'] for p in profiles], dtype=np.int64),
+            'is_active': np.array([p['is_active'] for p in profiles], dtype=bool),
+            'last_active': np.array([_timestamp_to_epoch(p['last_active']) for p in profiles]),
+            'fitness_level_names': np.array([(p['fitness_level'] or '').lower() for p in profiles], dtype=str)
+        }
+        for name, values in columns.items():
+            column = _resize_column(getattr(self, name), size, values)
+            column[target_rows] = values
+            setattr(self, name, column)
+
+        # Keep the retrieval and location indexes in step with the rows that just changed
+        for row, profile in zip(target_rows, profiles):
+            if self.is_active[row]:
+                self.index.upsert(row)
+            else:
+                self.index.remove(row)
+            if self.is_active[row] and profile['latitude'] is not None and profile['longitude'] is not None:
+                self.geo_index.upsert(row, profile['latitude'], profile['longitude'])
+            else:
+                self.geo_index.remove(row)
+
+    def candidate_mask(self, exclude_ids=(), active_within_days=None):
+        """Boolean row mask of active users, optionally only those active in the last N days"""
+        with self.lock:
+            mask = self.is_active.copy()
+            if active_within_days is not None:
+                mask &= self.last_active >= time.time() - active_within_days * 86400
+            if len(exclude_ids):
+                mask &= ~np.isin(self.ids, np.fromiter(exclude_ids, dtype=np.int64))
+            return mask
+
+    def id_mask(self, user_ids):
+        """Boolean row mask of the given user ids"""
+        with self.lock:
+            mask = np.zeros(len(self.ids), dtype=bool)
+            rows = [self.row_index[user_id] for user_id in user_ids if user_id in self.row_index]
+            mask[np.array(rows, dtype=np.int64)] = True
+            return mask
+
+    def candidate_rows(self, exclude_ids=(), active_within_days=None):
+        """Rows of active users, optionally only those active in the last N days"""
+        return np.flatnonzero(self.candidate_mask(exclude_ids, active_within_days))
+
+    def radius_mask(self, latitude, longitude, radius_km):
+        """Boolean row mask of users within radius_km, using the grid index to avoid a full scan"""
+        with self.lock:
+            mask = np.zeros(len(self.ids), dtype=bool)
+            rows = np.array(self.geo_index.candidates(latitude, longitude, radius_km), dtype=np.int64)
+            if len(rows):
+                distances = _haversine_km(np.full(len(rows), latitude), np.full(len(rows), longitude),
+                                          self.features['latitude'][rows], self.features['longitude'][rows])
+                mask[rows[distances <= radius_km]] = True
+            return mask
+
+    def search_rows(self, exclude_ids=(), filters=None, limit=20, row_mask=None):
+        """Apply /api/partners/search filters and return the most recently active rows"""
+        filters = filters or {}
+        with self.lock:
+            rows = self.candidate_rows(exclude_ids)
+            if row_mask is not None:
+                rows = rows[row_mask[rows]]
+            if filters.get('location'):
+                coords = geo.resolve_location(filters['location'])
+                if coords:
+                    radius_km = filters.get('radius_km') or 25
+                    rows = rows[self.radius_mask(coords[0], coords[1], radius_km)[rows]]
+                else:
+                    locations = self.features['location'][rows]
+                    rows = rows[np.char.find(locations, filters['location'].lower()) >= 0]
+            if filters.get('fitness_level'):
+                rows = rows[self.fitness_level_names[rows] == filters['fitness_level'].lower()]
+            if filters.get('min_age'):
+                rows = rows[self.features['age'][rows] >= filters['min_age']]
+            if filters.get('max_age'):
+                rows = rows[self.features['age'][rows] <= filters['max_age']]
+            if filters.get('preferred_workout_time'):
+                times = self.features['preferred_workout_time'][rows]
+                rows = rows[(times == filters['preferred_workout_time'].lower()) | (times == 'flexible')]
+            if filters.get('available_with') is not None:
+                # Users free for at least min_overlap_hours of the same hours as the given user
+                own_row = self.row_index.get(filters['available_with'])
+                if own_row is None or not self.features['availability_hours'][own_row]:
+                    rows = rows[:0]
+                else:
+                    overlap = _popcount_rows(self.features['availability'][rows] & self.features['availability'][own_row])
+                    rows = rows[overlap >= (filters.get('min_overlap_hours') or 1)]
+
+            order = np.argsort(-self.last_active[rows], kind='stable')
+            return rows[order[:limit]]
+
+    def take(self, rows):
+        """Encoded feature columns for the given rows, ready for score_encoded"""
+        with self.lock:
+            return {key: values[rows] for key, values in self.features.items()}
+
+    def profile(self, row):
+        return self.profiles[row]
+
+# Top-k candidate retrieval over the snapshot
+class PartnerIndex:
+    """Best-first top-k retrieval of compatible candidates from a CandidateSnapshot.
+
+    Every user is embedded as (goal vector, fitness level, age bucket, workout
+    time, location known, availability known) and users with the same embedding share a bucket.
+    For a query, one score_encoded call over the bucket representatives gives
+    an upper bound of the compatibility score per bucket; buckets are then
+    scored exactly in descending bound order until the k-th best exact score
+    is at least the next bucket's bound. The result matches a brute-force scan
+    while typically scoring only a small part of the population.
+    """
+
+    age_bucket_years = 5
+    batch_size = 1024
+
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+        self.buckets = {}
+        self.row_keys = {}
+        self.table = None
+
+    def embed(self, row):
+        """Bucket key (the discretized feature embedding) for a snapshot row"""
+        features = self.snapshot.features
+        age = features['age'][row]
+        return (
+            tuple(features['goals'][row]),
+            bool(features['has_goals'][row]),
+            int(features['fitness_level'][row]),
+            -1 if np.isnan(age) else int(age // self.age_bucket_years),
+            str(features['preferred_workout_time'][row]),
+            bool(features['location'][row]) or not np.isnan(features['latitude'][row]),
+            bool(features['availability_hours'][row])
+        )
+
+    def upsert(self, row):
+        key = self.embed(row)
+        old_key = self.row_keys.get(row)
+        if old_key == key:
+            return
+        if old_key is not None:
+            self.remove(row)
+        if key not in self.buckets:
+            self.buckets[key] = set()
+            self.table = None
+        self.buckets[key].add(row)
+        self.row_keys[row] = key
+
+    def remove(self, row):
+        key = self.row_keys.pop(row, None)
+        if key is None:
+            return
+        bucket = self.buckets[key]
+        bucket.discard(row)
+        if not bucket:
+            del self.buckets[key]
+            self.table = None
+
+    def _bucket_table(self):
+        """Bucket keys and their embeddings as columns, rebuilt only when buckets come or go"""
+        if self.table is None:
+            keys = list(self.buckets)
+            self.table = (keys, {
+                'goals': np.array([key[0] for key in keys], dtype=float).reshape(len(keys), 5),
+                'has_goals': np.array([key[1] for key in keys], dtype=bool),
+                'fitness_level': np.array([key[2] for key in keys], dtype=np.int64),
+                'age_bucket': np.array([key[3] for key in keys], dtype=np.int64),
+                'preferred_workout_time': np.array([key[4] for key in keys], dtype=str),
+                'location_known': np.array([key[5] for key in keys], dtype=bool),
+                'availability_known': np.array([key[6] for key in keys], dtype=bool)
+            })
+        return self.table
+
+    def _bucket_bounds(self, user, table):
+        """Upper bound of the compatibility score for each bucket"""
+        bound_features = dict(table)
+
+        # The closest age inside the bucket's range gives the best possible age score
+        user_age = user.get('age') or 0
+        lowest_age = table['age_bucket'] * self.age_bucket_years
+        bound_features['age'] = np.where(
+            table['age_bucket'] < 0,
+            np.nan,
+            np.clip(user_age, lowest_age, lowest_age + self.age_bucket_years)
+        )
+
+        # Known locations may be right next to the user or match their text exactly, so bound
+        # them with the user's own coordinates (distance 0) or, without those, the user's own
+        # location text; a user with neither scores every candidate's location the same
+        user_location = (user.get('location') or '').lower()
+        has_coords = user.get('latitude') is not None and user.get('longitude') is not None
+        bound_features['location'] = np.where(table['location_known'], user_location, '')
+        bound_features['latitude'] = np.where(table['location_known'] & has_coords,
+                                              user['latitude'] if has_coords else np.nan, np.nan)
+        bound_features['longitude'] = np.where(table['location_known'] & has_coords,
+                                               user['longitude'] if has_coords else np.nan, np.nan)
+
+        # A bucket member free all week overlaps every hour the user is free
+        bound_features['availability'] = np.where(table['availability_known'][:, None],
+                                                  np.full(AVAILABILITY_BYTES, 0xFF, dtype=np.uint8), np.uint8(0))
+        bound_features['availability_hours'] = np.where(table['availability_known'], HOURS_PER_WEEK, 0)
+
+        return self.snapshot.matcher.score_encoded(user, bound_features)['overall']
+
+    def top_k(self, user, k, row_mask=None):
+        """Rows of the k most compatible candidates, best first.
+
+        `row_mask` (from CandidateSnapshot.candidate_mask) removes inactive,
+        excluded or already-connected users before they are scored.
+        """
+        with self.snapshot.lock:
+            keys, table = self._bucket_table()
+            if not keys or k <= 0:
+                return np.zeros(0, dtype=np.int64)
+
+            bounds = self._bucket_bounds(user, table)
+            best_rows = np.zeros(0, dtype=np.int64)
+            best_scores = np.zeros(0)
+            pending = []
+            pending_count = 0
+
+            def score_pending():
+                nonlocal best_rows, best_scores, pending, pending_count
+                rows = np.concatenate(pending)
+                pending, pending_count = [], 0
+                scores = self.snapshot.matcher.score_encoded(user, self.snapshot.take(rows))['overall']
+                best_rows = np.concatenate([best_rows, rows])
+                best_scores = np.concatenate([best_scores, scores])
+                if len(best_scores) > k:
+                    keep = np.argpartition(-best_scores, k - 1)[:k]
+                    best_rows, best_scores = best_rows[keep], best_scores[keep]
+
+            for bucket in np.argsort(-bounds, kind='stable'):
+                if len(best_scores) >= k and best_scores.min() >= bounds[bucket]:
+                    break
+                rows = np.fromiter(self.buckets[keys[bucket]], dtype=np.int64)
+                if row_mask is not None:
+                    rows = rows[row_mask[rows]]
+                if not len(rows):
+                    continue
+                pending.append(rows)
+                pending_count += len(rows)
+                if pending_count >= self.batch_size:
+                    score_pending()
+
+            if pending:
+                score_pending()
+
+            return best_rows[np.argsort(-best_scores, kind='stable')]
+
+# Bounded cache of recommendation results
+class RecommendationCache:
+    """LRU cache with a TTL for get_ml_recommendations results, keyed by (user_id, limit).
+
+    Entries are invalidated when the user's profile changes, when partners or
+    user_interactions rows involving the user change, or when one of the cached
+    candidates becomes inactive. stats() exposes the counters used for sizing.
+    """
+
+    def __init__(self, max_entries=2000, ttl_seconds=300):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.keys_by_user = {}
+        self.keys_by_candidate = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, user_id, limit):
+        key = (user_id, limit)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry[0] < time.monotonic():
+                self._drop(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, user_id, limit, recommendations):
+        key = (user_id, limit)
+        with self.lock:
+            if key in self.entries:
+                self._drop(key)
+            self.entries[key] = (time.monotonic() + self.ttl_seconds, recommendations)
+            self.keys_by_user.setdefault(user_id, set()).add(key)
+            for recommendation in recommendations:
+                self.keys_by_candidate.setdefault(recommendation['user_id'], set()).add(key)
+            while len(self.entries) > self.max_entries:
+                self._drop(next(iter(self.entries)))
+                self.evictions += 1
+
+    def invalidate_user(self, user_id):
+        """Drop every cached result computed for this user"""
+        with self.lock:
+            for key in list(self.keys_by_user.get(user_id, ())):
+                self._drop(key)
+                self.invalidations += 1
+
+    def invalidate_candidate(self, candidate_id):
+        """Drop every cached result that recommends this candidate"""
+        with self.lock:
+            for key in list(self.keys_by_candidate.get(candidate_id, ())):
+                self._drop(key)
+                self.invalidations += 1
+
+    def on_profiles_changed(self, profiles):
+        """CandidateSnapshot listener: react to changed or deactivated users"""
+        for profile in profiles:
+            self.invalidate_user(profile['id'])
+            if not profile['is_active']:
+                self.invalidate_candidate(profile['id'])
+
+    def _drop(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return
+        user_keys = self.keys_by_user.get(key[0])
+        if user_keys is not None:
+            user_keys.discard(key)
+            if not user_keys:
+                del self.keys_by_user[key[0]]
+        for recommendation in entry[1]:
+            candidate_keys = self.keys_by_candidate.get(recommendation['user_id'])
+            if candidate_keys is not None:
+                candidate_keys.discard(key)
+                if not candidate_keys:
+                    del self.keys_by_candidate[recommendation['user_id']]
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self.entries),
+                'max_entries': self.max_entries,
+                'ttl_seconds': self.ttl_seconds,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations
+            }
+
 # Machine Learning Recommendation System
 class MLRecommendationSystem:
     def __init__(self):
         self.matcher = PartnerMatcher()
+        self.snapshot = CandidateSnapshot(self.matcher)
+        self.cache = RecommendationCache()
+        self.snapshot.listeners.append(self.cache.on_profiles_changed)
+        # How many candidates to retrieve per recommendation slot before ML re-ranking
+        self.retrieval_factor = 4
+        self.min_retrieval = 100
     
     def get_ml_recommendations(self, user_id, limit=10):
         """Get ML-based partner recommendations"""
         conn = sqlite3.connect('fitness_app.db')
         
         try:
-            # Get user data
-            user_data = self._get_user_data(conn, user_id)
-            if not user_data:
-                return []
-            
-            # Get interaction history
-            interactions = self._get_user_interactions(conn, user_id)
-            
-            # Get potential partners (excluding already connected)
-            potential_partners = self._get_potential_partners(conn, user_id)
-            
-            # Calculate scores for each potential partner
-            recommendations = []
-            for partner in potential_partners:
-                # Base compatibility score
-                compatibility = self.matcher.calculate_compatibility_score(user_data, partner)
-                
-                # Adjust score based on ML factors
-                ml_score = self._calculate_ml_adjustment(interactions, partner, compatibility['overall_score'])
-                
-                recommendations.append({
-                    'user_id': partner['id'],
-                    'name': partner['name'],
-                    'age': partner['age'],
-                    'location': partner['location'],
-                    'fitness_level': partner['fitness_level'],
-                    'goals': json.loads(partner['goals']) if partner['goals'] else [],
-                    'bio': partner['bio'],
-                    'compatibility_score': ml_score,
-                    'match_factors': compatibility['match_factors'],
-                    'detailed_scores': compatibility['detailed_scores'],
-                    'last_active': partner['last_active']
-                })
-            
-            # Sort by ML-adjusted score
-            recommendations.sort(key=lambda x: x['compatibility_score'], reverse=True)
+            # Pick up profile changes since the last request (this also invalidates the cache)
+            self.snapshot.refresh(conn)
+
+            cached = self.cache.get(user_id, limit)
+            if cached is not None:
+                return cached
+
+            # Serve the batch-materialized results; users missing from them are scored live
+            recommendations = self._get_materialized_recommendations(conn, user_id, limit)
+            if recommendations is None:
+                recommendations = self.compute_recommendations(conn, user_id, limit)
             
-            return recommendations[:limit]
+            self.cache.put(user_id, limit, recommendations)
+            return recommendations
             
         finally:
             conn.close()
     
+    def sync_user_writes(self, conn):
+        """Apply users rows this process just committed to the snapshot, its retrieval index
+        and the cache now instead of at the next throttled refresh. A snapshot that has not
+        loaded yet is left alone; its first load reads them anyway."""
+        if self.snapshot.last_refresh is not None:
+            self.snapshot.refresh(conn, force=True)
+    
+    def compute_recommendations(self, conn, user_id, limit):
+        """Score and rank candidates for one user against the current snapshot"""
+        # Get user data
+        user_data = self._get_user_data(conn, user_id)
+        if not user_data:
+            return []
+        
+        # Decayed interaction score per target user
+        interactions = self._get_interaction_scores(conn, user_id)
+        
+        # Get potential partners (excluding already connected)
+        rows = self._get_potential_partners(conn, user_data, interactions, limit)
+        if not len(rows):
+            return []
+        
+        # Base compatibility scores for the retrieved candidates in one pass
+        scores = self.matcher.score_encoded(user_data, self.snapshot.take(rows))
+        adjustments = self._calculate_ml_adjustments(interactions, rows)
+        ml_scores = np.clip(np.round(scores['overall'], 1) + adjustments, 0, 100)
+
+        # Sort by ML-adjusted score, most recently active first on ties
+        order = np.lexsort((-self.snapshot.last_active[rows], -ml_scores))[:limit]
+
+        recommendations = []
+        for index in order:
+            partner = self.snapshot.profile(rows[index])
+            compatibility = self.matcher.build_score_result(scores, index)
+            
+            recommendations.append({
+                'user_id': partner['id'],
+                'name': partner['name'],
+                'age': partner['age'],
+                'location': partner['location'],
+                'fitness_level': partner['fitness_level'],
+                'goals': partner['goals'],
+                'bio': partner['bio'],
+                'compatibility_score': min(100, max(0, compatibility['overall_score'] + float(adjustments[index]))),
+                'match_factors': compatibility['match_factors'],
+                'detailed_scores': compatibility['detailed_scores'],
+                'last_active': partner['last_active']
+            })
+        
+        return recommendations
+    
+    def _get_materialized_recommendations(self, conn, user_id, limit):
+        """Recommendations from the latest complete batch run, or None if the user is not in it"""
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT id, top_n FROM recommendation_generations
+            WHERE status = 'complete'
+            ORDER BY id DESC LIMIT 1
+        ''')
+        generation = cursor.fetchone()
+        if not generation or generation[1] < limit:
+            return None
+        
+        cursor.execute('''
+            SELECT payload FROM recommendations
+            WHERE user_id = ? AND generation_id = ?
+            ORDER BY rank
+        ''', (user_id, generation[0]))
+        rows = cursor.fetchall()
+        if not rows:
+            return None
+        
+        # Drop candidates connected to or deactivated since the batch ran
+        excluded = set(self._get_excluded_partner_ids(conn, user_id))
+        recommendations = []
+        for (payload,) in rows:
+            recommendation = json.loads(payload)
+            if recommendation['user_id'] in excluded:
+                continue
+            row = self.snapshot.row_index.get(recommendation['user_id'])
+            if row is None or not self.snapshot.is_active[row]:
+                continue
+            recommendations.append(recommendation)
+        
+        return recommendations[:limit]
+    
     def _get_user_data(self, conn, user_id):
         """Get user data for matching"""
         cursor = conn.cursor()
         cursor.execute('''
             SELECT id, name, age, fitness_level, goals, location, 
-                   preferred_workout_time, availability_schedule, bio
+                   preferred_workout_time, availability_schedule, bio,
+                   latitude, longitude, availability_bits
             FROM users WHERE id = ? AND is_active = TRUE
         ''', (user_id,))
         
@@ -468,74 +1702,98 @@ class MLRecommendationSystem:
             'location': row[5],
             'preferred_workout_time': row[6],
             'availability_schedule': json.loads(row[7]) if row[7] else {},
-            'bio': row[8]
+            'bio': row[8],
+            'latitude': row[9],
+            'longitude': row[10],
+            'availability_bits': row[11]
         }
     
-    def _get_user_interactions(self, conn, user_id):
-        """Get user interaction history for ML"""
+    def _get_interaction_scores(self, conn, user_id):
+        """Interaction score per target user over the full history, decayed to now"""
         cursor = conn.cursor()
         cursor.execute('''
-            SELECT target_user_id, interaction_type, interaction_value, created_at
-            FROM user_interactions 
+            SELECT target_user_id, score, last_at
+            FROM interaction_aggregates
             WHERE user_id = ?
-            ORDER BY created_at DESC
-            LIMIT 100
         ''', (user_id,))
         
-        return cursor.fetchall()
+        now = time.time()
+        return {target_id: _decay(score, last_at, now) for target_id, score, last_at in cursor.fetchall()}
     
-    def _get_potential_partners(self, conn, user_id):
-        """Get potential partners excluding already connected users"""
+    def _get_excluded_partner_ids(self, conn, user_id):
+        """Users already connected to, pending with, or blocked by this user"""
         cursor = conn.cursor()
         cursor.execute('''
-            SELECT u.id, u.name, u.age, u.fitness_level, u.goals, u.location,
-                   u.preferred_workout_time, u.availability_schedule, u.bio, u.last_active
-            FROM users u
-            WHERE u.id != ? 
-            AND u.is_active = TRUE
-            AND u.id NOT IN (
-                SELECT partner_id FROM partners 
-                WHERE user_id = ? AND status IN ('accepted', 'pending', 'blocked')
-            )
-            AND u.last_active >= datetime('now', '-30 days')
-            ORDER BY u.last_active DESC
-            LIMIT 50
-        ''', (user_id, user_id))
-        
-        columns = ['id', 'name', 'age', 'fitness_level', 'goals', 'location',
-                  'preferred_workout_time', 'availability_schedule', 'bio', 'last_active']
-        
-        return [dict(zip(columns, row)) for row in cursor.fetchall()]
-    
-    def _calculate_ml_adjustment(self, interactions, partner, base_score):
-        """Adjust compatibility score based on ML factors"""
-        adjustment = 0
-        
-        # Analyze interaction patterns
-        partner_interactions = [i for i in interactions if i[0] == partner['id']]
-        
-        if partner_interactions:
-            # User has interacted with similar profiles
-            for interaction in partner_interactions:
-                interaction_type = interaction[1]
-                if interaction_type == 'like':
-                    adjustment += 5
-                elif interaction_type == 'message':
-                    adjustment += 3
-                elif interaction_type == 'workout_together':
-                    adjustment += 10
-                elif interaction_type == 'block':
-                    adjustment -= 20
+            SELECT partner_id FROM partners 
+            WHERE user_id = ? AND status IN ('accepted', 'pending', 'blocked')
+        ''', (user_id,))
+        
+        return [row[0] for row in cursor.fetchall()]
+    
+    def _get_partner_preferences(self, conn, user_id):
+        """The user's partner preferences with the list preferences read from the junction tables"""
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT min_age, max_age, max_distance_km FROM partner_preferences
+            WHERE user_id = ?
+        ''', (user_id,))
+        row = cursor.fetchone()
+        preferences = {
+            'min_age': row[0] if row else None,
+            'max_age': row[1] if row else None,
+            'max_distance_km': row[2] if row else None
+        }
+        for name, (table, column) in PREFERENCE_LISTS.items():
+            cursor.execute(f'SELECT {column} FROM {table} WHERE user_id = ? ORDER BY {column}', (user_id,))
+            preferences[name] = [value for (value,) in cursor.fetchall()]
+        return preferences
+    
+    def _mutual_candidate_mask(self, conn, user_data, exclude_ids=(), active_within_days=None):
+        """Snapshot row mask of users passing the mutual preference filter in SQL"""
+        preferences = self._get_partner_preferences(conn, user_data['id'])
+        sql, params = build_mutual_candidate_query(user_data, preferences, exclude_ids, active_within_days)
+        mask = self.snapshot.id_mask(row[0] for row in conn.execute(sql, params))
+        
+        # Exact distance for the grid cells matched in SQL
+        if preferences['max_distance_km'] and user_data['latitude'] is not None and user_data['longitude'] is not None:
+            mask &= self.snapshot.radius_mask(user_data['latitude'], user_data['longitude'], preferences['max_distance_km'])
+        return mask
+    
+    def _get_potential_partners(self, conn, user_data, interactions, limit):
+        """Get sorted snapshot rows of potential partners excluding already connected users.
+
+        The most compatible candidates come from the retrieval index; candidates the user
+        has interacted with are always added since their ML adjustment can lift them.
+        """
+        excluded = [user_data['id']] + self._get_excluded_partner_ids(conn, user_data['id'])
+        mask = self.snapshot.candidate_mask(exclude_ids=excluded, active_within_days=30)
+
+        # Both sides' partner preferences are applied in SQL before anything is scored
+        mask &= self._mutual_candidate_mask(conn, user_data, excluded, active_within_days=30)
+        retrieved = self.snapshot.index.top_k(user_data, max(limit * self.retrieval_factor, self.min_retrieval), mask)
+
+        interacted = [self.snapshot.row_index.get(target_id) for target_id in interactions]
+        interacted = np.array([row for row in interacted if row is not None and mask[row]], dtype=np.int64)
+        return np.union1d(retrieved, interacted)
+    
+    def _calculate_ml_adjustments(self, interactions, rows):
+        """Adjust compatibility scores based on ML factors, for all candidate rows at once"""
+        adjustments = np.zeros(len(rows))
+        
+        # Interaction history (rows are sorted, so each target is a binary search)
+        for target_id, weight in interactions.items():
+            row = self.snapshot.row_index.get(target_id)
+            if row is None:
+                continue
+            index = np.searchsorted(rows, row)
+            if index < len(rows) and rows[index] == row:
+                adjustments[index] += weight
         
         # Activity bonus
-        if partner.get('last_active'):
-            days_since_active = (datetime.now() - datetime.fromisoformat(partner['last_active'])).days
-            if days_since_active <= 1:
-                adjustment += 5
-            elif days_since_active <= 7:
-                adjustment += 2
+        days_since_active = np.floor((time.time() - self.snapshot.last_active[rows]) / 86400)
+        adjustments += np.select([days_since_active <= 1, days_since_active <= 7], [5, 2], 0)
         
-        return min(100, max(0, base_score + adjustment))
+        return adjustments
 
 # Initialize ML system
 ml_system = MLRecommendationSystem()
@@ -568,10 +1826,18 @@ def register():
         # Hash password
         password_hash = generate_password_hash(data['password'])
         
+        schedule = data.get('availability_schedule')
+        try:
+            availability_bits = _availability_bits(schedule)
+        except ValueError as e:
+            return jsonify({'success': False, 'message': str(e)}), 400
+        
         # Insert new user
+        latitude, longitude, geo_cell = _location_columns(data.get('location'))
         cursor = conn.execute('''
-            INSERT INTO users (username, email, password_hash, first_name, last_name, age, height, weight, fitness_level, goals, location)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            INSERT INTO users (username, email, password_hash, first_name, last_name, age, height, weight, fitness_level, goals, location,
+                               latitude, longitude, geo_cell, availability_schedule, availability_bits)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
         ''', (
             data['username'],
             data['email'],
@@ -583,11 +1849,18 @@ def register():
             data.get('weight'),
             data.get('fitness_level', 'beginner'),
             json.dumps(data.get('goals', [])),
-            data.get('location')
+            data.get('location'),
+            latitude,
+            longitude,
+            geo_cell,
+            json.dumps(schedule) if schedule else None,
+            availability_bits
         ))
         
         user_id = cursor.lastrowid
+        _sync_user_goals(conn, user_id, data.get('goals', []))
         conn.commit()
+        ml_system.sync_user_writes(conn)
         conn.close()
         
         # Generate JWT token
@@ -675,6 +1948,40 @@ def create_user():
     finally:
         conn.close()
 
+@app.route('/api/users/<int:user_id>/availability', methods=['PUT'])
+def update_availability(user_id):
+    """Replace a user's weekly availability and its compiled hour-of-week bitmap"""
+    try:
+        schedule = (request.json or {}).get('availability_schedule')
+        try:
+            availability_bits = _availability_bits(schedule)
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+        
+        conn = sqlite3.connect('fitness_app.db')
+        cursor = conn.cursor()
+        cursor.execute('''
+            UPDATE users
+            SET availability_schedule = ?, availability_bits = ?, updated_at = CURRENT_TIMESTAMP
+            WHERE id = ?
+        ''', (json.dumps(schedule) if schedule else None, availability_bits, user_id))
+        updated = cursor.rowcount
+        conn.commit()
+        if updated:
+            ml_system.sync_user_writes(conn)
+        conn.close()
+        
+        if not updated:
+            return jsonify({'success': False, 'error': 'User not found'}), 404
+        
+        ml_system.cache.invalidate_user(user_id)
+        
+        return jsonify({'success': True, 'hours_per_week': int(_popcount_rows(_availability_array(availability_bits)))})
+    
+    except Exception as e:
+        logger.error(f"Error updating availability: {str(e)}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
 # Workout routes
 @app.route('/api/workouts', methods=['GET'])
 def get_workouts():
@@ -872,63 +2179,27 @@ def generate_exercises_for_type(workout_type, fitness_level):
 @app.route('/api/posture/analyze', methods=['POST'])
 def analyze_posture():
     try:
-        data = request.get_json()
+        data, landmarks, error = posture_request()
+        if error:
+            return error
         user_id = data.get('user_id')
         image_data = data.get('image_data')  # Base64 encoded image
         
-        if not user_id or not image_data:
+        if not user_id or (not image_data and landmarks is None):
             return jsonify({'success': False, 'message': 'User ID and image data required'}), 400
         
-        # Mock posture analysis
-        # In a real implementation, this would use computer vision and ML models
-        
-        # Generate mock analysis results
-        score = random.randint(60, 95)
-        
-        issues = []
-        recommendations = []
-        
-        if score < 70:
-            issues = [
-                "Forward head posture detected",
-                "Rounded shoulders observed",
-                "Slight spinal curvature"
-            ]
-            recommendations = [
-                "Perform neck stretches every hour",
-                "Strengthen upper back muscles",
-                "Adjust monitor height to eye level",
-                "Use ergonomic chair support"
-            ]
-        elif score < 85:
-            issues = [
-                "Minor shoulder imbalance",
-                "Slight forward head position"
-            ]
-            recommendations = [
-                "Focus on shoulder blade squeezes",
-                "Practice chin tucks throughout the day",
-                "Take regular posture breaks"
-            ]
-        else:
-            recommendations = [
-                "Maintain current posture habits",
-                "Continue regular exercise routine",
-                "Stay mindful of posture throughout the day"
-            ]
+        result, error = run_pose_analysis(image_data, data.get('exercise_type', 'general'), landmarks,
+                                          _posture_image_size(data))
+        if error:
+            return error
+        score, issues, recommendations = result['score'], result['issues'], result['recommendations']
         
         analysis_result = {
             'score': score,
             'issues': issues,
             'recommendations': recommendations,
-            'key_points': {
-                'head': {'x': 320, 'y': 100, 'confidence': 0.95},
-                'shoulders': {
-                    'left': {'x': 280, 'y': 180},
-                    'right': {'x': 360, 'y': 185}
-                },
-                'spine': {'alignment': score / 100}
-            }
+            'angles': result['angles'],
+            'key_points': result['key_points']
         }
         
         # Save analysis to database
@@ -954,62 +2225,110 @@ def analyze_posture():
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
 
+def posture_request():
+    """(fields, landmarks, error response) of a posture request.
+
+    The body is JSON whose optional 'landmarks' (see parse_landmarks) replaces 'image', or
+    application/octet-stream packed float32 landmarks with the other fields in the query
+    string. landmarks is None when the client sent an image instead.
+    """
+    if request.mimetype == 'application/octet-stream':
+        data, landmarks = request.args.to_dict(), request.get_data(cache=False)
+    else:
+        data = request.get_json(silent=True) or {}
+        landmarks = data.get('landmarks')
+    error = _posture_name_error(data)
+    if error:
+        return data, None, error
+    if landmarks is None:
+        return data, None, None
+    try:
+        return data, parse_landmarks(landmarks), None
+    except ValueError as e:
+        return data, None, (jsonify({'success': False, 'message': str(e)}), 400)
+
+def _posture_name_error(data):
+    """400 response when an exercise or machine name field is not a string, else None"""
+    for field in ('exercise_type', 'exercise_name', 'machine_name'):
+        if data.get(field) is not None and not isinstance(data[field], str):
+            return jsonify({'success': False, 'message': f'{field} must be a string'}), 400
+    return None
+
+def _posture_image_size(data):
+    """(width, height) from 'image_size': [w, h] or 'width'/'height' fields, for pixel key
+    points from client landmarks; None keeps them normalized"""
+    try:
+        width, height = (float(value) for value in data.get('image_size') or (data['width'], data['height']))
+    except (KeyError, TypeError, ValueError):
+        return None
+    return (width, height) if width > 0 and height > 0 else None
+
+def run_pose_analysis(image_data, exercise_type, landmarks=None, image_size=None, machine=None):
+    """(result, error response) for one image through the pose service, or for client-side
+    landmarks analyzed right here without decode or inference; exactly one is None"""
+    if landmarks is not None:
+        return analyze_landmarks(landmarks, exercise_type, image_size, machine), None
+    if not image_data:
+        return None, (jsonify({'success': False, 'message': 'image is required'}), 400)
+    try:
+        result = pose_service.analyze(image_data, exercise_type, machine=machine)
+    except PoseServiceBusy as e:
+        return None, (jsonify({'success': False, 'message': str(e)}), 429, {'Retry-After': '1'})
+    except PoseServiceUnavailable as e:
+        return None, (jsonify({'success': False, 'message': str(e)}), 503, {'Retry-After': '1'})
+    if not result.get('success'):
+        return None, (jsonify(result), 400)
+    return result, None
+
 @app.route('/api/posture-analysis', methods=['POST'])
 def posture_analysis():
-    """Analyze posture from webcam image"""
-    data = request.json
+    """Analyze posture from webcam image or client-side landmarks"""
+    data, landmarks, error = posture_request()
+    if error:
+        return error
     image_data = data.get('image')
     exercise_type = data.get('exercise_type', 'push-ups')
     
-    result = analyze_posture(image_data, exercise_type)
+    result, error = run_pose_analysis(image_data, exercise_type, landmarks, _posture_image_size(data))
+    if error:
+        return error
     return jsonify(result)
 
 @app.route('/api/machine-posture-analysis', methods=['POST'])
 def machine_posture_analysis():
     """Analyze posture for specific gym machine exercises"""
-    data = request.json
+    data, landmarks, error = posture_request()
+    if error:
+        return error
     image_data = data.get('image')
     machine_name = data.get('machine_name', 'treadmill')
     exercise_type = data.get('exercise_type', 'general')
     
-    # Machine-specific posture analysis
-    machine_specific_analysis = {
-        'treadmill': {
-            'key_points': ['upright_posture', 'arm_swing', 'foot_strike'],
-            'common_mistakes': ['leaning_forward', 'overstriding', 'heel_striking']
-        },
-        'bench_press': {
-            'key_points': ['back_arch', 'shoulder_blade_position', 'bar_path'],
-            'common_mistakes': ['excessive_arch', 'bouncing_bar', 'uneven_grip']
-        },
-        'lat_pulldown': {
-            'key_points': ['upright_torso', 'shoulder_blade_squeeze', 'controlled_movement'],
-            'common_mistakes': ['leaning_back', 'using_momentum', 'partial_range']
-        }
-    }
-    
-    result = analyze_posture(image_data, exercise_type)
+    # Machine rules (posture_rules.json) are checked along with the exercise's
+    machine = POSTURE_RULES.machine(machine_name)
+    result, error = run_pose_analysis(image_data, exercise_type, landmarks, _posture_image_size(data), machine)
+    if error:
+        return error
     
-    # Add machine-specific feedback
-    if machine_name.lower().replace(' ', '_') in machine_specific_analysis:
-        machine_data = machine_specific_analysis[machine_name.lower().replace(' ', '_')]
-        result['machine_specific'] = {
-            'key_points': machine_data['key_points'],
-            'common_mistakes': machine_data['common_mistakes'],
-            'machine_name': machine_name
-        }
+    if machine:
+        result['machine_specific'] = dict(POSTURE_RULES.machine_info[machine], machine_name=machine_name)
     
     return jsonify(result)
 
 @app.route('/api/workout-exercise-analysis', methods=['POST'])
 def workout_exercise_analysis():
     """Analyze posture for workout plan exercises"""
-    data = request.json
+    data, landmarks, error = posture_request()
+    if error:
+        return error
     image_data = data.get('image')
     exercise_name = data.get('exercise_name', 'push-ups')
     workout_context = data.get('workout_context', {})
     
-    result = analyze_posture(image_data, exercise_name.lower().replace('-', '_'))
+    result, error = run_pose_analysis(image_data, exercise_name.lower().replace('-', '_'), landmarks,
+                                      _posture_image_size(data))
+    if error:
+        return error
     
     # Add workout-specific context
     result['workout_context'] = {
@@ -1021,123 +2340,6 @@ def workout_exercise_analysis():
     
     return jsonify(result)
 
-# Partner Finding
-@app.route('/api/partners/recommendations/<user_id>', methods=['GET'])
-def get_partner_recommendations(user_id):
-    try:
-        limit = request.args.get('limit', 10)
-        
-        # Mock partner recommendations
-        # In a real implementation, this would use ML algorithms for matching
-        
-        mock_partners = [
-            {
-                'id': 1,
-                'name': 'Sarah Johnson',
-                'age': 28,
-                'location': 'New York, NY',
-                'fitness_level': 'Intermediate',
-                'goals': ['Weight Loss', 'Strength Training'],
-                'compatibility': 92,
-                'avatar': '/placeholder.svg?height=60&width=60'
-            },
-            {
-                'id': 2,
-                'name': 'Mike Chen',
-                'age': 32,
-                'location': 'San Francisco, CA',
-                'fitness_level': 'Advanced',
-                'goals': ['Muscle Gain', 'Powerlifting'],
-                'compatibility': 87,
-                'avatar': '/placeholder.svg?height=60&width=60'
-            }
-        ]
-        
-        return jsonify({
-            'success': True,
-            'recommendations': mock_partners[:int(limit)]
-        }), 200
-        
-    except Exception as e:
-        return jsonify({'success': False, 'message': str(e)}), 500
-
-@app.route('/api/partners/search', methods=['POST'])
-def search_partners():
-    try:
-        data = request.get_json()
-        user_id = data.get('user_id')
-        filters = data.get('filters', {})
-        
-        # Mock partner search with filters
-        # In a real implementation, this would query the database with filters
-        
-        mock_results = [
-            {
-                'id': 3,
-                'name': 'Emma Rodriguez',
-                'age': 25,
-                'location': 'Los Angeles, CA',
-                'fitness_level': 'Beginner',
-                'goals': ['General Fitness', 'Flexibility'],
-                'compatibility': 78,
-                'avatar': '/placeholder.svg?height=60&width=60'
-            }
-        ]
-        
-        return jsonify({
-            'success': True,
-            'partners': mock_results
-        }), 200
-        
-    except Exception as e:
-        return jsonify({'success': False, 'message': str(e)}), 500
-
-@app.route('/api/partners/connect', methods=['POST'])
-def connect_with_partner():
-    try:
-        data = request.get_json()
-        user_id = data.get('user_id')
-        partner_id = data.get('partner_id')
-        message = data.get('message', '')
-        
-        if not user_id or not partner_id:
-            return jsonify({'success': False, 'message': 'User ID and Partner ID required'}), 400
-        
-        conn = get_db_connection()
-        
-        # Check if connection already exists
-        existing = conn.execute(
-            'SELECT id FROM fitness_partners WHERE user_id = ? AND partner_id = ?',
-            (user_id, partner_id)
-        ).fetchone()
-        
-        if existing:
-            return jsonify({'success': False, 'message': 'Connection request already sent'}), 400
-        
-        # Create connection request
-        conn.execute('''
-            INSERT INTO fitness_partners (user_id, partner_id, status)
-            VALUES (?, ?, 'pending')
-        ''', (user_id, partner_id))
-        
-        # Send initial message if provided
-        if message:
-            conn.execute('''
-                INSERT INTO messages (sender_id, receiver_id, message)
-                VALUES (?, ?, ?)
-            ''', (user_id, partner_id, message))
-        
-        conn.commit()
-        conn.close()
-        
-        return jsonify({
-            'success': True,
-            'message': 'Connection request sent successfully'
-        }), 200
-        
-    except Exception as e:
-        return jsonify({'success': False, 'message': str(e)}), 500
-
 @app.route('/api/fitness-tracking', methods=['POST'])
 def save_fitness_data():
     """Save daily fitness tracking data"""
@@ -1208,70 +2410,212 @@ def get_partner_recommendations(user_id):
         logger.error(f"Error getting recommendations for user {user_id}: {str(e)}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
-@app.route('/api/partners/search', methods=['POST'])
-def search_partners():
-    """Advanced partner search with filters"""
+@app.route('/api/partners/preferences/<int:user_id>', methods=['PUT'])
+def update_partner_preferences(user_id):
+    """Replace a user's partner preferences"""
     try:
-        data = request.json
-        user_id = data.get('user_id')
-        filters = data.get('filters', {})
+        data = request.json or {}
+        preferences = {name: [_normalize_preference(name, value) for value in data.get(name) or []]
+                       for name in PREFERENCE_LISTS}
         
         conn = sqlite3.connect('fitness_app.db')
         cursor = conn.cursor()
         
-        # Build dynamic query based on filters
-        query = '''
-            SELECT u.id, u.name, u.age, u.fitness_level, u.goals, u.location,
-                   u.preferred_workout_time, u.bio, u.last_active
-            FROM users u
-            WHERE u.id != ? AND u.is_active = TRUE
-        '''
-        params = [user_id]
+        if not cursor.execute('SELECT 1 FROM users WHERE id = ?', (user_id,)).fetchone():
+            conn.close()
+            return jsonify({'success': False, 'error': 'User not found'}), 404
+        
+        # The JSON columns are kept for backend/app.py; matching reads the junction tables
+        cursor.execute('DELETE FROM partner_preferences WHERE user_id = ?', (user_id,))
+        cursor.execute('''
+            INSERT INTO partner_preferences (user_id, min_age, max_age, max_distance_km,
+                                             preferred_fitness_levels, preferred_workout_times, preferred_goals)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', (user_id, data.get('min_age'), data.get('max_age'), data.get('max_distance_km'),
+              *[json.dumps(preferences[name]) for name in PREFERENCE_LISTS]))
+        _sync_preference_lists(cursor, user_id, preferences)
         
-        # Apply filters
-        if filters.get('location'):
-            query += ' AND u.location LIKE ?'
-            params.append(f"%{filters['location']}%")
+        # Materialized results were filtered with the old preferences
+        cursor.execute('DELETE FROM recommendations WHERE user_id = ?', (user_id,))
         
-        if filters.get('fitness_level'):
-            query += ' AND u.fitness_level = ?'
-            params.append(filters['fitness_level'])
+        conn.commit()
+        conn.close()
         
-        if filters.get('min_age'):
-            query += ' AND u.age >= ?'
-            params.append(filters['min_age'])
+        ml_system.cache.invalidate_user(user_id)
+        ml_system.cache.invalidate_candidate(user_id)
         
-        if filters.get('max_age'):
-            query += ' AND u.age <= ?'
-            params.append(filters['max_age'])
+        return jsonify({'success': True, 'message': 'Partner preferences updated'})
+    
+    except Exception as e:
+        logger.error(f"Error updating partner preferences: {str(e)}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/posture/stats', methods=['GET'])
+def get_pose_service_stats():
+    """In-flight slots and completed/rejected/expired counters for the pose service"""
+    return jsonify({'success': True, 'stats': pose_service.stats(),
+                    'stream': pose_stream.stats()})
+
+@app.route('/api/posture/clip-analysis', methods=['POST'])
+def clip_posture_analysis():
+    """Score a buffered clip of client-side landmarks in one pass: JSON 'frames' (N x 33 x
+    [x, y, z] or [x, y, z, visibility]) or an application/octet-stream body of N packed
+    float32 frames with exercise_type/machine_name in the query string"""
+    if request.mimetype == 'application/octet-stream':
+        data, frames = request.args.to_dict(), request.get_data(cache=False)
+    else:
+        data = request.get_json(silent=True) or {}
+        frames = data.get('frames')
+    error = _posture_name_error(data)
+    if error:
+        return error
+    try:
+        frames = parse_landmark_clip(frames, POSE_CLIP_MAX_FRAMES)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    machine_name = data.get('machine_name')
+    machine = POSTURE_RULES.machine(machine_name)
+    result = analyze_clip(frames, data.get('exercise_type', 'general'), machine)
+    if machine:
+        result['machine_specific'] = dict(POSTURE_RULES.machine_info[machine], machine_name=machine_name)
+    return jsonify(result)
+
+@app.route('/api/posture/sessions', methods=['POST'])
+def open_posture_session():
+    """Start a streaming posture session pinned to one pose worker"""
+    data = request.get_json(silent=True) or {}
+    error = _posture_name_error(data)
+    if error:
+        return error
+    exercise_type = (data.get('exercise_type') or 'general').lower().replace('-', '_')
+    try:
+        session_id = pose_stream.open(exercise_type)
+    except PoseServiceBusy as e:
+        return jsonify({'success': False, 'message': str(e)}), 429, {'Retry-After': '5'}
+    except PoseServiceUnavailable as e:
+        return jsonify({'success': False, 'message': str(e)}), 503, {'Retry-After': '1'}
+    return jsonify({'success': True, 'session_id': session_id, 'exercise_type': exercise_type}), 201
+
+@app.route('/api/posture/sessions/<session_id>/frames', methods=['POST'])
+def post_posture_frame(session_id):
+    """Analyze one raw JPEG/PNG frame (the request body) of a session; the response lists
+    the issues that appeared or were resolved since the session's previous frame"""
+    frame_data = request.get_data(cache=False)
+    if not frame_data:
+        return jsonify({'success': False, 'message': 'frame body is required'}), 400
+    try:
+        feedback = pose_stream.frame(session_id, frame_data)
+    except KeyError:
+        return jsonify({'success': False, 'message': 'Session not found or expired'}), 404
+    except PoseServiceBusy as e:
+        # The client is sending faster than the worker keeps up; this frame is skipped
+        return jsonify({'success': False, 'dropped': True, 'message': str(e)}), 429
+    except PoseServiceUnavailable as e:
+        return jsonify({'success': False, 'message': str(e)}), 503, {'Retry-After': '1'}
+    if not feedback.get('success'):
+        return jsonify(feedback), 400
+    return jsonify(feedback)
+
+def _read_exact(stream, size):
+    """Exactly `size` bytes from a request stream, or None if it ends first"""
+    chunks = []
+    while size:
+        chunk = stream.read(size)
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+@app.route('/api/posture/sessions/<session_id>/stream', methods=['POST'])
+def stream_posture_frames(session_id):
+    """Analyze a chunked upload of frames, each a 4-byte big-endian length followed by the
+    encoded image, answering with one JSON feedback line per frame as it is analyzed"""
+    if session_id not in pose_stream:
+        return jsonify({'success': False, 'message': 'Session not found or expired'}), 404
+
+    def feedback_lines():
+        while True:
+            header = _read_exact(request.stream, 4)
+            if header is None:
+                return
+            size, = struct.unpack('>I', header)
+            if size > POSE_STREAM_MAX_FRAME_BYTES:
+                yield json.dumps({'success': False, 'message': 'Frame too large'}) + '\n'
+                return
+            frame_data = _read_exact(request.stream, size)
+            if frame_data is None:
+                return
+            try:
+                feedback = pose_stream.frame(session_id, frame_data)
+            except KeyError:
+                yield json.dumps({'success': False, 'message': 'Session not found or expired'}) + '\n'
+                return
+            except (PoseServiceBusy, PoseServiceUnavailable) as e:
+                feedback = {'success': False, 'message': str(e)}
+            yield json.dumps(feedback) + '\n'
+
+    return Response(stream_with_context(feedback_lines()), mimetype='application/x-ndjson')
+
+@app.route('/api/posture/sessions/<session_id>', methods=['DELETE'])
+def close_posture_session(session_id):
+    """End a streaming posture session and free its worker slot"""
+    if not pose_stream.close(session_id):
+        return jsonify({'success': False, 'message': 'Session not found or expired'}), 404
+    return jsonify({'success': True})
+
+@app.route('/api/partners/cache/stats', methods=['GET'])
+def get_recommendation_cache_stats():
+    """Hit/miss/eviction counters for the recommendation cache"""
+    return jsonify({'success': True, 'cache': ml_system.cache.stats()})
+
+@app.route('/api/partners/search', methods=['POST'])
+def search_partners():
+    """Advanced partner search with filters"""
+    try:
+        data = request.get_json(silent=True) or {}
+        user_id = data.get('user_id')
+        if isinstance(user_id, bool) or not isinstance(user_id, int):
+            return jsonify({'success': False, 'message': 'user_id must be an integer'}), 400
+        filters = data.get('filters') or {}
+        if not isinstance(filters, dict):
+            return jsonify({'success': False, 'message': 'filters must be an object'}), 400
+        if filters.get('free_with_me'):
+            filters = dict(filters, available_with=user_id)
+        try:
+            filters = dict(filters, min_overlap_hours=_overlap_hours(filters.get('min_overlap_hours')))
+        except ValueError as e:
+            return jsonify({'success': False, 'message': str(e)}), 400
         
-        if filters.get('preferred_workout_time'):
-            query += ' AND (u.preferred_workout_time = ? OR u.preferred_workout_time = "flexible")'
-            params.append(filters['preferred_workout_time'])
+        conn = sqlite3.connect('fitness_app.db')
         
-        query += ' ORDER BY u.last_active DESC LIMIT 20'
+        # Filter the in-memory snapshot instead of querying users directly
+        ml_system.snapshot.refresh(conn)
+        user_data = ml_system._get_user_data(conn, user_id) or {}
         
-        cursor.execute(query, params)
-        results = cursor.fetchall()
+        # Only users passing both sides' partner preferences are searched and scored
+        row_mask = ml_system._mutual_candidate_mask(conn, user_data, [user_data['id']]) if user_data else None
+        rows = ml_system.snapshot.search_rows(exclude_ids=[user_id], filters=filters, limit=20, row_mask=row_mask)
         
         # Calculate compatibility scores
-        user_data = ml_system._get_user_data(conn, user_id)
+        scores = ml_system.matcher.score_encoded(user_data, ml_system.snapshot.take(rows))
         partners = []
         
-        for row in results:
+        for index, row in enumerate(rows):
+            profile = ml_system.snapshot.profile(row)
             partner_data = {
-                'id': row[0],
-                'name': row[1],
-                'age': row[2],
-                'fitness_level': row[3],
-                'goals': json.loads(row[4]) if row[4] else [],
-                'location': row[5],
-                'preferred_workout_time': row[6],
-                'bio': row[7],
-                'last_active': row[8]
+                'id': profile['id'],
+                'name': profile['name'],
+                'age': profile['age'],
+                'fitness_level': profile['fitness_level'],
+                'goals': profile['goals'],
+                'location': profile['location'],
+                'preferred_workout_time': profile['preferred_workout_time'],
+                'bio': profile['bio'],
+                'last_active': profile['last_active']
             }
             
-            compatibility = ml_system.matcher.calculate_compatibility_score(user_data, partner_data)
+            compatibility = ml_system.matcher.build_score_result(scores, index)
             
             partners.append({
                 **partner_data,
@@ -1303,6 +2647,9 @@ def send_connection_request():
         partner_id = data.get('partner_id')
         message = data.get('message', '')
         
+        if not user_id or not partner_id:
+            return jsonify({'success': False, 'error': 'User ID and Partner ID required'}), 400
+        
         conn = sqlite3.connect('fitness_app.db')
         cursor = conn.cursor()
         
@@ -1343,14 +2690,14 @@ def send_connection_request():
             ''', (user_id, partner_id, message))
         
         # Record interaction
-        cursor.execute('''
-            INSERT INTO user_interactions (user_id, target_user_id, interaction_type, interaction_value)
-            VALUES (?, ?, 'connection_request', 1.0)
-        ''', (user_id, partner_id))
+        record_interaction(cursor, user_id, partner_id, 'connection_request', 1.0)
         
         conn.commit()
         conn.close()
         
+        ml_system.cache.invalidate_user(int(user_id))
+        ml_system.cache.invalidate_user(int(partner_id))
+        
         return jsonify({'success': True, 'message': 'Connection request sent successfully'})
     
     except Exception as e:
@@ -1391,14 +2738,14 @@ def respond_to_connection():
             ''', (user_id, partner_id, partner_id, user_id))
         
         # Record interaction
-        cursor.execute('''
-            INSERT INTO user_interactions (user_id, target_user_id, interaction_type, interaction_value)
-            VALUES (?, ?, ?, ?)
-        ''', (user_id, partner_id, response, 2.0 if response == 'accepted' else -1.0))
+        record_interaction(cursor, user_id, partner_id, response, 2.0 if response == 'accepted' else -1.0)
         
         conn.commit()
         conn.close()
         
+        ml_system.cache.invalidate_user(int(user_id))
+        ml_system.cache.invalidate_user(int(partner_id))
+        
         return jsonify({'success': True, 'message': f'Connection {response} successfully'})
     
     except Exception as e:
@@ -0,0 +1,193 @@
+"""
+Frame ingest for the pose workers: encoded image bytes to the RGB array MediaPipe takes,
+with as few full-frame copies as possible.
+
+Base64 text is decoded once into bytes and cv2.imdecode reads those through a zero-copy
+numpy view of a memoryview. JPEGs larger than the pose model needs are decoded at 1/2,
+1/4 or 1/8 scale by libjpeg itself, which skips most of the IDCT and colour conversion
+work, and the BGR -> RGB conversion is written into a buffer the worker reuses for every
+frame of that size. Landmarks come back normalized, so the smaller frame only changes
+pixel key points, and those are scaled with the original size read from the JPEG header.
+
+Micro-benchmark (decode time and peak RSS per frame at 720p and 1080p):
+    python frame_ingest.py --frames 100
+"""
+
+import argparse
+import base64
+import binascii
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+# Shorter side the reduced decode keeps at least; MediaPipe Pose crops and resizes the
+# person to 256x256 for its landmark model, so this leaves headroom for a partial-frame crop
+POSE_DECODE_MIN_SIDE = 360
+
+_REDUCED_FLAGS = ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2))
+
+# JPEG start-of-frame markers, which carry the image size (SOF0-SOF15 minus DHT, JPG, DAC)
+_SOF_MARKERS = frozenset(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+
+def encoded_bytes(image_data):
+    """memoryview of the encoded image in base64 text (optionally a data: URL) or raw
+    bytes-like data, without copying raw input; None if the base64 is invalid"""
+    if isinstance(image_data, str):
+        start = image_data.find(',') + 1 if image_data.startswith('data:') else 0
+        text = memoryview(image_data.encode('ascii', 'ignore'))[start:]
+        try:
+            return memoryview(binascii.a2b_base64(text))
+        except binascii.Error:
+            return None
+    return memoryview(image_data)
+
+
+def jpeg_size(buffer):
+    """(width, height) from a JPEG's start-of-frame header, or None if buffer is not a JPEG"""
+    if len(buffer) < 4 or buffer[0] != 0xFF or buffer[1] != 0xD8:
+        return None
+    position = 2
+    while position + 9 <= len(buffer):
+        if buffer[position] != 0xFF:
+            return None
+        marker = buffer[position + 1]
+        if marker == 0xFF:  # fill byte
+            position += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD7:  # standalone markers carry no length
+            position += 2
+            continue
+        if marker in _SOF_MARKERS:
+            height = buffer[position + 5] << 8 | buffer[position + 6]
+            width = buffer[position + 7] << 8 | buffer[position + 8]
+            return width, height
+        position += 2 + (buffer[position + 2] << 8 | buffer[position + 3])
+    return None
+
+
+def reduced_decode_flag(size, min_side=POSE_DECODE_MIN_SIDE):
+    """The IMREAD flag for the largest 1/2, 1/4 or 1/8 reduction whose shorter side stays at
+    least min_side, or IMREAD_COLOR for full size"""
+    if size and min_side:
+        shorter = min(size)
+        for factor, flag in _REDUCED_FLAGS:
+            if shorter // factor >= min_side:
+                return flag
+    return cv2.IMREAD_COLOR
+
+
+class FrameDecoder:
+    """Decoder owned by one worker, reusing an RGB output buffer per decoded shape.
+
+    The array decode() returns is overwritten by the next frame of the same shape, so it
+    must be consumed (e.g. by Pose.process) before decoding again.
+    """
+
+    def __init__(self, min_side=POSE_DECODE_MIN_SIDE, max_buffers=4):
+        self.min_side = min_side
+        self.max_buffers = max_buffers
+        self.buffers = OrderedDict()  # (height, width) -> uint8 RGB array, least recently used first
+
+    def _buffer(self, shape):
+        buffer = self.buffers.pop(shape, None)
+        if buffer is None:
+            buffer = np.empty(shape + (3,), dtype=np.uint8)
+            if len(self.buffers) >= self.max_buffers:
+                self.buffers.popitem(last=False)
+        self.buffers[shape] = buffer
+        return buffer
+
+    def decode(self, image_data):
+        """(rgb frame, (width, height) of the encoded image), or (None, None) if undecodable"""
+        buffer = encoded_bytes(image_data)
+        if buffer is None or not len(buffer):
+            return None, None
+        size = jpeg_size(buffer)
+        bgr = cv2.imdecode(np.frombuffer(buffer, dtype=np.uint8), reduced_decode_flag(size, self.min_side))
+        if bgr is None:
+            return None, None
+        rgb = cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB, dst=self._buffer(bgr.shape[:2]))
+        return rgb, size or (bgr.shape[1], bgr.shape[0])
+
+
+def _legacy_decode(image_data):
+    """The base64 -> BytesIO -> PIL -> numpy -> BGR -> RGB chain the endpoints used to run"""
+    from io import BytesIO
+    from PIL import Image
+    image = Image.open(BytesIO(base64.b64decode(image_data)))
+    frame = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
+    return cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+
+
+def _sample_jpeg(width, height):
+    """A webcam-like JPEG (smooth shading, shapes, sensor noise) at the browser's quality 0.8"""
+    rng = np.random.default_rng(0)
+    y, x = np.mgrid[0:height, 0:width]
+    frame = np.dstack([(x * 255 // width), (y * 255 // height), ((x + y) * 127 // (width + height)) + 64]).astype(np.uint8)
+    for _ in range(12):
+        center = (int(rng.integers(width)), int(rng.integers(height)))
+        color = tuple(int(value) for value in rng.integers(0, 256, 3))
+        cv2.circle(frame, center, int(rng.integers(height // 20, height // 5)), color, -1)
+    frame = cv2.add(frame, rng.integers(0, 8, frame.shape, dtype=np.uint8))
+    return cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 80])[1].tobytes()
+
+
+def _rss_kib(field):
+    with open('/proc/self/status') as handle:
+        for line in handle:
+            if line.startswith(field + ':'):
+                return int(line.split()[1])
+
+
+def _run_variant(variant, path, frames):
+    """Mean decode ms and peak RSS growth (MiB) over the resident size before decoding, for
+    one variant (Linux: the peak is reset through /proc/self/clear_refs)"""
+    with open(path, 'rb') as handle:
+        encoded = base64.b64encode(handle.read()).decode()
+    decoder = FrameDecoder(min_side=POSE_DECODE_MIN_SIDE if variant == 'reduced' else None)
+    decode = _legacy_decode if variant == 'legacy' else decoder.decode
+    with open('/proc/self/clear_refs', 'w') as handle:
+        handle.write('5')  # reset VmHWM, which imports have already raised
+    baseline = _rss_kib('VmRSS')
+    decode(encoded)
+    started = time.perf_counter()
+    for _ in range(frames):
+        decode(encoded)
+    elapsed = (time.perf_counter() - started) / frames
+    peak = _rss_kib('VmHWM') - baseline
+    print(f'{elapsed * 1000:.2f} {peak / 1024:.1f}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Frame decode micro-benchmark')
+    parser.add_argument('--frames', type=int, default=100)
+    parser.add_argument('--variant', help=argparse.SUPPRESS)
+    parser.add_argument('--image', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.variant:
+        _run_variant(args.variant, args.image, args.frames)
+        return
+
+    with tempfile.TemporaryDirectory() as directory:
+        for width, height in ((1280, 720), (1920, 1080)):
+            path = os.path.join(directory, f'{height}.jpg')
+            with open(path, 'wb') as handle:
+                handle.write(_sample_jpeg(width, height))
+            for variant in ('legacy', 'full', 'reduced'):
+                # Peak RSS only grows, so every variant is measured in a fresh process
+                output = subprocess.run(
+                    [sys.executable, __file__, '--variant', variant, '--image', path, '--frames', str(args.frames)],
+                    check=True, capture_output=True, text=True,
+                ).stdout.split()
+                print(f'{height}p {variant:8} {float(output[0]):7.2f} ms/frame  peak RSS +{float(output[1]):.1f} MiB')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,191 @@
+"""
+Offline location helpers: gazetteer lookup, great-circle distance and a
+fixed 0.1 degree grid used to answer radius queries without scanning every row.
+
+The scripts backend runs on its own, so it carries this copy of backend/geo.py and its
+gazetteer; change both together.
+"""
+
+import csv
+import math
+import os
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE_LAT = 111.32
+
+# Grid cells are GRID_DEGREES x GRID_DEGREES; a cell id is lat_index * LON_CELLS + lon_index,
+# so every latitude row of cells is a contiguous integer range (index friendly).
+GRID_DEGREES = 0.1
+LAT_CELLS = int(round(180 / GRID_DEGREES))
+LON_CELLS = int(round(360 / GRID_DEGREES))
+
+GAZETTEER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'gazetteer.csv')
+
+_gazetteer = None
+
+
+def _load_gazetteer():
+    global _gazetteer
+    if _gazetteer is None:
+        places = {}
+        with open(GAZETTEER_PATH, newline='', encoding='utf-8') as handle:
+            for row in csv.DictReader(handle):
+                places[row['name'].strip().lower()] = (float(row['latitude']), float(row['longitude']))
+        _gazetteer = places
+    return _gazetteer
+
+
+def resolve_location(location):
+    """Resolve free-text like 'New York, NY' to (lat, lon) using the bundled gazetteer.
+
+    Tries the whole string first, then each comma separated part from the left.
+    Returns None when nothing matches.
+    """
+    if not location:
+        return None
+
+    places = _load_gazetteer()
+    text = ' '.join(location.lower().split())
+    if text in places:
+        return places[text]
+
+    for part in text.split(','):
+        part = part.strip()
+        if part in places:
+            return places[part]
+    return None
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Great-circle distance in kilometres"""
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    d_phi = phi2 - phi1
+    d_lambda = math.radians(lon2 - lon1)
+    a = math.sin(d_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(min(1.0, a)))
+
+
+def _lat_index(lat):
+    return min(LAT_CELLS - 1, max(0, int(math.floor((lat + 90) / GRID_DEGREES))))
+
+
+def _lon_index(lon):
+    return int(math.floor((lon + 180) / GRID_DEGREES)) % LON_CELLS
+
+
+def grid_cell(lat, lon):
+    """Integer grid cell id for a coordinate"""
+    return _lat_index(lat) * LON_CELLS + _lon_index(lon)
+
+
+def bounding_box(lat, lon, radius_km):
+    """(lat_lo, lat_hi, lon_spans) in degrees covering a circle.
+
+    lon_spans holds one (lon_lo, lon_hi) pair, or two where the box crosses
+    the antimeridian, suitable for range predicates on raw coordinates.
+    """
+    lat_delta = radius_km / KM_PER_DEGREE_LAT
+    lat_lo = max(-90.0, lat - lat_delta)
+    lat_hi = min(90.0, lat + lat_delta)
+
+    extreme_lat = min(89.9, max(abs(lat_lo), abs(lat_hi)))
+    lon_delta = radius_km / (KM_PER_DEGREE_LAT * math.cos(math.radians(extreme_lat)))
+
+    if lon_delta >= 180:
+        lon_spans = [(-180.0, 180.0)]
+    elif lon - lon_delta < -180:
+        lon_spans = [(lon - lon_delta + 360, 180.0), (-180.0, lon + lon_delta)]
+    elif lon + lon_delta > 180:
+        lon_spans = [(lon - lon_delta, 180.0), (-180.0, lon + lon_delta - 360)]
+    else:
+        lon_spans = [(lon - lon_delta, lon + lon_delta)]
+    return lat_lo, lat_hi, lon_spans
+
+
+def cell_ranges(lat, lon, radius_km):
+    """Inclusive (first_cell, last_cell) ranges covering a circle's bounding box.
+
+    One range per latitude row of cells (two where the box crosses the
+    antimeridian), suitable for `geo_cell BETWEEN ? AND ?` predicates.
+    """
+    lat_delta = radius_km / KM_PER_DEGREE_LAT
+    lat_lo = _lat_index(max(-90.0, lat - lat_delta))
+    lat_hi = _lat_index(min(90.0, lat + lat_delta))
+
+    # Widest longitude span is at the box edge closest to a pole
+    extreme_lat = min(89.9, max(abs(lat - lat_delta), abs(lat + lat_delta)))
+    lon_delta = radius_km / (KM_PER_DEGREE_LAT * math.cos(math.radians(extreme_lat)))
+
+    if lon_delta >= 180:
+        lon_spans = [(0, LON_CELLS - 1)]
+    else:
+        lon_lo = _lon_index(lon - lon_delta)
+        lon_hi = _lon_index(lon + lon_delta)
+        if lon_lo <= lon_hi:
+            lon_spans = [(lon_lo, lon_hi)]
+        else:
+            lon_spans = [(lon_lo, LON_CELLS - 1), (0, lon_hi)]
+
+    ranges = []
+    for lat_index in range(lat_lo, lat_hi + 1):
+        base = lat_index * LON_CELLS
+        for lon_lo, lon_hi in lon_spans:
+            ranges.append((base + lon_lo, base + lon_hi))
+    return ranges
+
+
+class GeoGridIndex:
+    """In-memory grid index mapping cells to keys (user ids, snapshot rows, ...)"""
+
+    def __init__(self):
+        self.cells = {}
+        self.positions = {}
+
+    def __len__(self):
+        return len(self.positions)
+
+    def upsert(self, key, lat, lon):
+        cell = grid_cell(lat, lon)
+        previous = self.positions.get(key)
+        if previous is not None and previous[2] != cell:
+            self._discard(key, previous[2])
+        self.positions[key] = (lat, lon, cell)
+        self.cells.setdefault(cell, set()).add(key)
+
+    def remove(self, key):
+        previous = self.positions.pop(key, None)
+        if previous is not None:
+            self._discard(key, previous[2])
+
+    def _discard(self, key, cell):
+        members = self.cells.get(cell)
+        if members is not None:
+            members.discard(key)
+            if not members:
+                del self.cells[cell]
+
+    def candidates(self, lat, lon, radius_km):
+        """Keys in the cells covering the circle (a superset of the exact answer)"""
+        found = []
+        for first, last in cell_ranges(lat, lon, radius_km):
+            if last - first + 1 > len(self.cells):
+                # Sparse index: walking the occupied cells is cheaper than the range
+                found.extend(key for cell, members in self.cells.items() if first <= cell <= last for key in members)
+                continue
+            for cell in range(first, last + 1):
+                members = self.cells.get(cell)
+                if members:
+                    found.extend(members)
+        return found
+
+    def radius_query(self, lat, lon, radius_km):
+        """(key, distance_km) pairs within radius_km, nearest first"""
+        results = []
+        for key in self.candidates(lat, lon, radius_km):
+            key_lat, key_lon, _ = self.positions[key]
+            distance = haversine_km(lat, lon, key_lat, key_lon)
+            if distance <= radius_km:
+                results.append((key, distance))
+        results.sort(key=lambda item: item[1])
+        return results
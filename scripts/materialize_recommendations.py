@@ -0,0 +1,172 @@
+"""
+Offline job that precomputes top-N partner recommendations for every active user.
+
+Users are split into shards by `user_id % shards`; each shard runs in its own worker
+process with its own candidate snapshot and writes its results in batches. Progress is
+recorded per shard, so an interrupted run can be continued with --resume. The API serves
+the latest complete generation and falls back to live scoring for users missing from it.
+
+Usage:
+    python materialize_recommendations.py --top-n 50 --shards 8 --workers 4
+    python materialize_recommendations.py --resume
+"""
+
+import argparse
+import json
+import logging
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import flask_backend
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+logger = logging.getLogger('materialize_recommendations')
+
+INSERT_BATCH_SIZE = 500
+
+
+def _connect():
+    # Shards write concurrently; wait on the database lock instead of failing
+    return sqlite3.connect(flask_backend.DATABASE, timeout=60)
+
+
+def _start_generation(conn, top_n, shard_count):
+    cursor = conn.cursor()
+    cursor.execute('INSERT INTO recommendation_generations (top_n, shard_count) VALUES (?, ?)',
+                   (top_n, shard_count))
+    generation_id = cursor.lastrowid
+    cursor.executemany('INSERT INTO recommendation_shards (generation_id, shard) VALUES (?, ?)',
+                       [(generation_id, shard) for shard in range(shard_count)])
+    conn.commit()
+    return generation_id, top_n, shard_count
+
+
+def _resume_generation(conn):
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT id, top_n, shard_count FROM recommendation_generations
+        WHERE status = 'running'
+        ORDER BY id DESC LIMIT 1
+    ''')
+    return cursor.fetchone()
+
+
+def _pending_shards(conn, generation_id):
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT shard FROM recommendation_shards
+        WHERE generation_id = ? AND status != 'complete'
+        ORDER BY shard
+    ''', (generation_id,))
+    return [row[0] for row in cursor.fetchall()]
+
+
+def run_shard(generation_id, shard, shard_count, top_n):
+    """Compute and store recommendations for every active user in one shard"""
+    started = time.time()
+    ml_system = flask_backend.MLRecommendationSystem()
+    conn = _connect()
+
+    try:
+        ml_system.snapshot.refresh(conn, force=True)
+
+        # A previous attempt at this shard may have written part of its users
+        conn.execute('''
+            DELETE FROM recommendations
+            WHERE generation_id = ? AND user_id % ? = ?
+        ''', (generation_id, shard_count, shard))
+        conn.commit()
+
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT id FROM users
+            WHERE is_active = 1 AND id % ? = ?
+            ORDER BY id
+        ''', (shard_count, shard))
+        user_ids = [row[0] for row in cursor.fetchall()]
+
+        batch = []
+        for user_id in user_ids:
+            recommendations = ml_system.compute_recommendations(conn, user_id, top_n)
+            for rank, recommendation in enumerate(recommendations):
+                batch.append((user_id, generation_id, rank, recommendation['user_id'],
+                              recommendation['compatibility_score'], json.dumps(recommendation)))
+
+            if len(batch) >= INSERT_BATCH_SIZE:
+                conn.executemany('INSERT INTO recommendations VALUES (?, ?, ?, ?, ?, ?)', batch)
+                conn.commit()
+                batch = []
+
+        if batch:
+            conn.executemany('INSERT INTO recommendations VALUES (?, ?, ?, ?, ?, ?)', batch)
+
+        seconds = time.time() - started
+        conn.execute('''
+            UPDATE recommendation_shards
+            SET status = 'complete', users_processed = ?, seconds = ?, finished_at = CURRENT_TIMESTAMP
+            WHERE generation_id = ? AND shard = ?
+        ''', (len(user_ids), seconds, generation_id, shard))
+        conn.commit()
+        return shard, len(user_ids), seconds
+
+    finally:
+        conn.close()
+
+
+def _finish_generation(conn, generation_id):
+    """Mark the generation complete and drop the rows of older generations"""
+    conn.execute('''
+        UPDATE recommendation_generations
+        SET status = 'complete', finished_at = CURRENT_TIMESTAMP
+        WHERE id = ?
+    ''', (generation_id,))
+    conn.execute('DELETE FROM recommendations WHERE generation_id < ?', (generation_id,))
+    conn.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Precompute partner recommendations')
+    parser.add_argument('--top-n', type=int, default=50, help='recommendations stored per user')
+    parser.add_argument('--shards', type=int, default=8, help='number of user shards')
+    parser.add_argument('--workers', type=int, default=4, help='worker processes')
+    parser.add_argument('--resume', action='store_true', help='continue the last unfinished generation')
+    args = parser.parse_args()
+
+    flask_backend.init_db()
+    conn = _connect()
+
+    try:
+        generation = _resume_generation(conn) if args.resume else None
+        if generation is None:
+            if args.resume:
+                logger.info("No unfinished generation to resume, starting a new one")
+            generation = _start_generation(conn, args.top_n, args.shards)
+        generation_id, top_n, shard_count = generation
+
+        shards = _pending_shards(conn, generation_id)
+        logger.info(f"Generation {generation_id}: {len(shards)}/{shard_count} shards to run, top {top_n}")
+
+        started = time.time()
+        total_users = 0
+        with ProcessPoolExecutor(max_workers=args.workers) as executor:
+            futures = [executor.submit(run_shard, generation_id, shard, shard_count, top_n)
+                       for shard in shards]
+            for future in as_completed(futures):
+                shard, users, seconds = future.result()
+                total_users += users
+                rate = users / seconds if seconds else 0.0
+                logger.info(f"Shard {shard}: {users} users in {seconds:.1f}s ({rate:.1f} users/sec)")
+
+        elapsed = time.time() - started
+        rate = total_users / elapsed if elapsed else 0.0
+        logger.info(f"Generation {generation_id}: {total_users} users in {elapsed:.1f}s ({rate:.1f} users/sec)")
+
+        _finish_generation(conn, generation_id)
+
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,719 @@
+"""
+Pose-inference service for the posture endpoints.
+
+MediaPipe graphs are neither thread-safe nor parallel, so instead of one Pose shared by
+every Flask thread each worker process owns its own. Requests are admitted only while
+fewer than `max_pending` are in flight, carry a deadline, and fail fast otherwise:
+PoseServiceBusy (HTTP 429) when the pool is saturated, PoseServiceUnavailable (HTTP 503)
+when the deadline passes or a worker dies.
+
+Live camera feeds use PoseStreamService instead: each session is pinned to one worker
+process holding a tracking Pose (static_image_mode=False) for that session, so after the
+first frame MediaPipe follows the person from the previous landmarks rather than running
+the detector again, and feedback is reported as changes from the session's last frame.
+
+Benchmark (frames per second per worker count):
+    python pose_service.py --image person.jpg --frames 200 --workers 1 2 4
+Benchmark (per-request base64 JSON path vs. a streaming session, one client):
+    python pose_service.py --image person.jpg --frames 200 --stream
+"""
+
+import argparse
+import base64
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
+
+import cv2
+import numpy as np
+
+from frame_ingest import POSE_DECODE_MIN_SIDE, FrameDecoder
+from posture_rules import load_rules
+
+POSE_OPTIONS = {
+    'static_image_mode': True,  # requests are unrelated stills, so no tracking between them
+    'model_complexity': 1,
+    'min_detection_confidence': 0.5,
+}
+
+STREAM_POSE_OPTIONS = dict(
+    POSE_OPTIONS,
+    static_image_mode=False,  # consecutive frames of one session: track instead of re-detecting
+    min_tracking_confidence=0.5,
+)
+
+LANDMARK_COUNT = 33
+LANDMARK_FIELDS = ('x', 'y', 'z', 'visibility')
+# Packed binary landmarks: 33 x (x, y, z, visibility) little-endian float32
+LANDMARK_DTYPE = np.dtype('<f4')
+LANDMARK_BYTES = LANDMARK_COUNT * len(LANDMARK_FIELDS) * LANDMARK_DTYPE.itemsize
+
+# MediaPipe Pose landmark indexes used for the key points
+NOSE = 0
+LEFT_SHOULDER, RIGHT_SHOULDER = 11, 12
+LEFT_HIP, RIGHT_HIP = 23, 24
+
+# Exercise and machine rule tables (posture_rules.json), compiled once per process
+POSTURE_RULES = load_rules()
+
+
+class PoseServiceBusy(Exception):
+    """Every slot is taken; the caller should retry later (HTTP 429)"""
+
+
+class PoseServiceUnavailable(Exception):
+    """The request missed its deadline or the pool failed (HTTP 503)"""
+
+
+def parse_landmarks(payload):
+    """(33, 4) float array of client-side keypoints, for analysis without an image.
+
+    payload is the packed binary form (LANDMARK_BYTES bytes), or decoded JSON: 33 rows of
+    [x, y, z, visibility], the same 132 numbers flat, or 33 {x, y, z, visibility} objects as
+    MediaPipe's JavaScript solutions emit. An empty list means no person was found and gives
+    an empty array. Raises ValueError for anything else.
+    """
+    if isinstance(payload, (bytes, bytearray, memoryview)):
+        if len(payload) != LANDMARK_BYTES:
+            raise ValueError(f'Packed landmarks must be {LANDMARK_BYTES} bytes, got {len(payload)}')
+        points = np.frombuffer(payload, dtype=LANDMARK_DTYPE).reshape(LANDMARK_COUNT, len(LANDMARK_FIELDS))
+    elif isinstance(payload, list):
+        if not payload:
+            return np.empty((0, len(LANDMARK_FIELDS)))
+        if isinstance(payload[0], dict):
+            try:
+                payload = [[point.get(field, 1.0 if field == 'visibility' else 0.0) for field in LANDMARK_FIELDS]
+                           for point in payload]
+            except AttributeError:
+                raise ValueError('Landmarks must all be objects or all be lists')
+        try:
+            points = np.asarray(payload, dtype=np.float64)
+        except (TypeError, ValueError):
+            raise ValueError('Landmarks must be numbers')
+        if points.size != LANDMARK_COUNT * len(LANDMARK_FIELDS):
+            raise ValueError(f'Expected {LANDMARK_COUNT} landmarks of {len(LANDMARK_FIELDS)} values')
+        points = points.reshape(LANDMARK_COUNT, len(LANDMARK_FIELDS))
+    else:
+        raise ValueError('Landmarks must be a list or packed float32 bytes')
+    if not np.isfinite(points).all():
+        raise ValueError('Landmarks must be finite numbers')
+    return points
+
+
+def parse_landmark_clip(payload, max_frames=None):
+    """(N, 33, 3 or 4) float array of a buffered clip's keypoints: packed float32 bytes (a
+    multiple of LANDMARK_BYTES), or decoded JSON with N frames of 33 [x, y, z] or
+    [x, y, z, visibility] rows. Raises ValueError for anything else or more than max_frames."""
+    if isinstance(payload, (bytes, bytearray, memoryview)):
+        if not len(payload) or len(payload) % LANDMARK_BYTES:
+            raise ValueError(f'Packed landmarks must be a multiple of {LANDMARK_BYTES} bytes, got {len(payload)}')
+        frames = np.frombuffer(payload, dtype=LANDMARK_DTYPE).reshape(-1, LANDMARK_COUNT, len(LANDMARK_FIELDS))
+    elif isinstance(payload, list) and payload:
+        try:
+            frames = np.asarray(payload, dtype=np.float64)
+        except (TypeError, ValueError):
+            raise ValueError('Frames must be equally sized lists of numbers')
+        if frames.ndim != 3 or frames.shape[1] != LANDMARK_COUNT or frames.shape[2] not in (3, 4):
+            raise ValueError(f'Expected frames of {LANDMARK_COUNT} landmarks of 3 or 4 values')
+    else:
+        raise ValueError('Frames must be a non-empty list or packed float32 bytes')
+    if max_frames and len(frames) > max_frames:
+        raise ValueError(f'At most {max_frames} frames per clip')
+    if not np.isfinite(frames).all():
+        raise ValueError('Landmarks must be finite numbers')
+    return frames
+
+
+def analyze_landmarks(landmarks, exercise_type='general', image_size=None, machine=None):
+    """Posture analysis of one frame's 33 pose landmarks.
+
+    landmarks is a (33, 4) array-like of normalized (x, y, z, visibility), or None (or empty)
+    when no person was found. The exercise's rules, and the machine's when one is given,
+    come from POSTURE_RULES. Returns the posture response body: score, issues,
+    recommendations, joint angles (mean of the visible sides) and key points, in pixels
+    when image_size (width, height) is given and normalized otherwise.
+    """
+    exercise = POSTURE_RULES.exercise(exercise_type)
+    if landmarks is None or len(landmarks) == 0:
+        return {
+            'success': True,
+            'pose_detected': False,
+            'exercise_type': exercise,
+            'score': 0,
+            'issues': ['No person detected in the image'],
+            'recommendations': ['Make sure your whole body is visible and well lit'],
+            'angles': {},
+            'key_points': None,
+        }
+
+    points = np.asarray(landmarks, dtype=np.float64).reshape(LANDMARK_COUNT, len(LANDMARK_FIELDS))
+    evaluation = POSTURE_RULES.evaluate(points, exercise, machine)
+    angles = {name: round(float(values[0]), 1) for name, values in evaluation.angles.items() if not np.isnan(values[0])}
+    issues, recommendations = evaluation.frame_issues(0)
+    if not evaluation.checks[0]:
+        issues.append('Key joints are not visible')
+        recommendations.append('Step back so your shoulders, hips and knees are in frame')
+
+    width, height = image_size or (1, 1)
+
+    def key_point(index):
+        return {'x': round(points[index, 0] * width, 3), 'y': round(points[index, 1] * height, 3),
+                'confidence': round(points[index, 3], 3)}
+
+    mid_shoulder = (points[LEFT_SHOULDER, :2] + points[RIGHT_SHOULDER, :2]) / 2
+    mid_hip = (points[LEFT_HIP, :2] + points[RIGHT_HIP, :2]) / 2
+    spine = mid_shoulder - mid_hip
+    spine_alignment = abs(spine[1]) / (np.linalg.norm(spine) or 1.0)  # 1.0 is an upright spine
+
+    return {
+        'success': True,
+        'pose_detected': True,
+        'exercise_type': exercise,
+        'score': int(evaluation.scores[0]),
+        'issues': issues,
+        'recommendations': recommendations or ['Good form, keep it up'],
+        'angles': angles,
+        'key_points': {
+            'head': key_point(NOSE),
+            'shoulders': {'left': key_point(LEFT_SHOULDER), 'right': key_point(RIGHT_SHOULDER)},
+            'spine': {'alignment': round(float(spine_alignment), 3)},
+        },
+    }
+
+
+def analyze_clip(frames, exercise_type='general', machine=None):
+    """Posture analysis of a buffered clip, an (N, 33, 3|4) array, in one rule evaluation:
+    per-frame scores, how often each rule failed, and mean joint angles"""
+    evaluation = POSTURE_RULES.evaluate(frames, exercise_type, machine)
+    checked = evaluation.checked.sum(axis=0)
+    failed = evaluation.failed.sum(axis=0)
+    scored = evaluation.checks > 0
+    issues = [
+        {'issue': evaluation.group.issues[rule], 'recommendation': evaluation.group.recommendations[rule],
+         'frames': int(failed[rule]), 'share': round(float(failed[rule] / checked[rule]), 3)}
+        for rule in np.argsort(-failed, kind='stable') if failed[rule]
+    ]
+    angles = {}
+    for name, values in evaluation.angles.items():
+        seen = values[~np.isnan(values)]
+        if len(seen):
+            angles[name] = round(float(seen.mean()), 1)
+    return {
+        'success': True,
+        'exercise_type': POSTURE_RULES.exercise(exercise_type),
+        'frames': len(evaluation),
+        'scores': evaluation.scores.tolist(),
+        'mean_score': round(float(evaluation.scores[scored].mean()), 1) if scored.any() else 0,
+        'scored_frames': int(scored.sum()),
+        'issues': issues,
+        'angles': angles,
+    }
+
+
+# Worker process state: each process builds its own Pose graph and frame decoder once
+_pose = None
+_decoder = None
+
+
+def _init_worker(options, decode_min_side=POSE_DECODE_MIN_SIDE):
+    global _pose, _decoder
+    import mediapipe as mp  # only workers build graphs, so the server process never loads MediaPipe
+    _pose = mp.solutions.pose.Pose(**options)
+    _decoder = FrameDecoder(decode_min_side)
+
+
+def _detect(pose, rgb):
+    """Landmarks of the person Pose finds in an RGB frame as (x, y, z, visibility) rows, or None"""
+    results = pose.process(rgb)
+    if not results.pose_landmarks:
+        return None
+    return [(lm.x, lm.y, lm.z, lm.visibility) for lm in results.pose_landmarks.landmark]
+
+
+def _infer(image_data, exercise_type, deadline, machine=None):
+    """Runs in a worker: decode, detect, analyze. Work whose caller has already given up is skipped."""
+    if time.time() > deadline:
+        return None
+    rgb, image_size = _decoder.decode(image_data)
+    if rgb is None:
+        return {'success': False, 'message': 'Could not decode image'}
+    return analyze_landmarks(_detect(_pose, rgb), exercise_type, image_size=image_size, machine=machine)
+
+
+class PoseService:
+    """Process pool of Pose workers with admission control and per-request deadlines.
+
+    At most `max_pending` requests are in flight (queued or running); further submissions
+    raise PoseServiceBusy at once rather than queueing behind them. The pool starts on
+    first use, so importing the backend (e.g. from a batch job) spawns nothing.
+    """
+
+    def __init__(self, workers=None, max_pending=None, timeout=2.0, pose_options=None,
+                 decode_min_side=POSE_DECODE_MIN_SIDE):
+        self.workers = workers or os.cpu_count() or 1
+        self.max_pending = max_pending or self.workers * 4
+        self.timeout = timeout
+        self.pose_options = dict(POSE_OPTIONS, **(pose_options or {}))
+        self.decode_min_side = decode_min_side  # None decodes every frame at full size
+        self.lock = threading.Lock()
+        self.start_lock = threading.Lock()
+        self.pending = 0
+        self.executor = None
+        self.rejected = 0
+        self.expired = 0
+        self.completed = 0
+
+    def _pool(self):
+        with self.start_lock:
+            if self.executor is None:
+                # spawn: workers must not inherit the server's threads or a half-built graph
+                executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_init_worker,
+                    initargs=(self.pose_options, self.decode_min_side),
+                )
+                # Start every worker and build its graph before any request deadline is running
+                try:
+                    for future in [executor.submit(os.getpid) for _ in range(self.workers)]:
+                        future.result()
+                except BrokenProcessPool:
+                    executor.shutdown(wait=False, cancel_futures=True)
+                    raise PoseServiceUnavailable('Pose workers failed to start')
+                self.executor = executor
+            return self.executor
+
+    def start(self):
+        """Start the workers now instead of on the first request"""
+        self._pool()
+
+    def _reset(self, executor):
+        with self.start_lock:
+            if self.executor is executor:
+                self.executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def analyze(self, image_data, exercise_type='general', timeout=None, machine=None):
+        """Posture analysis of one encoded image, waiting at most `timeout` seconds"""
+        with self.lock:
+            if self.pending >= self.max_pending:
+                self.rejected += 1
+                raise PoseServiceBusy('Pose service is at capacity')
+            self.pending += 1
+        try:
+            executor = self._pool()
+            timeout = self.timeout if timeout is None else timeout
+            try:
+                future = executor.submit(_infer, image_data, exercise_type, time.time() + timeout, machine)
+                result = future.result(timeout=timeout)
+            except FutureTimeoutError:
+                future.cancel()
+                with self.lock:
+                    self.expired += 1
+                raise PoseServiceUnavailable('Pose analysis timed out')
+            except (BrokenProcessPool, RuntimeError):
+                # RuntimeError: submitted to a pool another thread just reset
+                self._reset(executor)
+                raise PoseServiceUnavailable('Pose worker failed')
+            if result is None:
+                with self.lock:
+                    self.expired += 1
+                raise PoseServiceUnavailable('Pose analysis timed out')
+            with self.lock:
+                self.completed += 1
+            return result
+        finally:
+            with self.lock:
+                self.pending -= 1
+
+    def stats(self):
+        with self.lock:
+            return {'workers': self.workers, 'max_pending': self.max_pending, 'pending': self.pending,
+                    'completed': self.completed, 'rejected': self.rejected, 'expired': self.expired}
+
+    def shutdown(self):
+        with self.start_lock:
+            executor, self.executor = self.executor, None
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+
+def _stream_frame(session, decoder, frame_data, deadline):
+    """Runs in a stream worker: one frame of a session, as changes from the session's last frame"""
+    if time.time() > deadline:
+        return None
+    rgb, image_size = decoder.decode(frame_data)
+    if rgb is None:
+        return {'success': False, 'message': 'Could not decode image'}
+    analysis = analyze_landmarks(_detect(session['pose'], rgb), session['exercise_type'], image_size=image_size)
+
+    previous = session['issues']
+    advice = dict(zip(analysis['issues'], analysis['recommendations']))
+    new_issues = [issue for issue in analysis['issues'] if issue not in previous]
+    session['issues'] = analysis['issues']
+    session['frames'] += 1
+    score_change = analysis['score'] - session['score'] if session['score'] is not None else 0
+    session['score'] = analysis['score']
+    return {
+        'success': True,
+        'frame': session['frames'],
+        'pose_detected': analysis['pose_detected'],
+        'score': analysis['score'],
+        'score_change': score_change,
+        'issues': analysis['issues'],
+        'new_issues': new_issues,
+        'resolved_issues': [issue for issue in previous if issue not in analysis['issues']],
+        'recommendations': [advice[issue] for issue in new_issues],
+        'angles': analysis['angles'],
+        'key_points': analysis['key_points'],
+    }
+
+
+def _stream_worker(conn, options, decode_min_side):
+    """Stream worker process: serves (seq, command, session_id, *args) requests from its pipe,
+    keeping one tracking Pose per session, until the pipe closes"""
+    import mediapipe as mp
+    decoder = FrameDecoder(decode_min_side)
+    sessions = {}
+    while True:
+        try:
+            seq, command, session_id, *args = conn.recv()
+        except EOFError:
+            break
+        if command == 'open':
+            sessions[session_id] = {'pose': mp.solutions.pose.Pose(**options), 'exercise_type': args[0],
+                                    'frames': 0, 'issues': [], 'score': None}
+            reply = True
+        elif command == 'frame':
+            session = sessions.get(session_id)
+            reply = _stream_frame(session, decoder, *args) if session else False
+        elif command == 'close':
+            session = sessions.pop(session_id, None)
+            if session:
+                session['pose'].close()
+            reply = session is not None
+        else:  # 'ping'
+            reply = os.getpid()
+        conn.send((seq, reply))
+    for session in sessions.values():
+        session['pose'].close()
+
+
+class _StreamWorker:
+    """One stream worker process and the parent's end of its pipe, used by one caller at a time"""
+
+    def __init__(self, context, options, decode_min_side):
+        self.conn, child_conn = context.Pipe()
+        # daemon: an abandoned worker must not keep the server from exiting
+        self.process = context.Process(target=_stream_worker, args=(child_conn, options, decode_min_side),
+                                       daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.lock = threading.Lock()
+        self.seq = 0
+        self.sessions = set()
+
+    def call(self, timeout, command, session_id=None, *args):
+        """Reply to one request, or PoseServiceUnavailable after `timeout` seconds. A reply that
+        arrives after its caller gave up is skipped by the next call. EOFError/OSError mean
+        the process died."""
+        deadline = time.monotonic() + timeout
+        if not self.lock.acquire(timeout=timeout):
+            raise PoseServiceUnavailable('Pose analysis timed out')
+        try:
+            self.seq += 1
+            self.conn.send((self.seq, command, session_id) + args)
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self.conn.poll(remaining):
+                    raise PoseServiceUnavailable('Pose analysis timed out')
+                seq, reply = self.conn.recv()
+                if seq == self.seq:
+                    return reply
+        finally:
+            self.lock.release()
+
+    def stop(self):
+        self.conn.close()
+        self.process.join(timeout=1)
+        if self.process.is_alive():
+            self.process.terminate()
+
+
+class PoseStreamService:
+    """Streaming posture sessions, each pinned to one of `workers` dedicated processes.
+
+    A worker holds at most `sessions_per_worker` sessions and runs their frames one at a
+    time; a frame sent while the session's previous one is still being analyzed is dropped
+    with PoseServiceBusy, which keeps a fast camera from queueing stale frames. Sessions
+    idle for `idle_timeout` seconds are closed when the next session opens. If a worker
+    dies it is replaced and its sessions are lost (KeyError afterwards), since their
+    tracking state died with it.
+    """
+
+    def __init__(self, workers=None, sessions_per_worker=4, timeout=2.0, idle_timeout=60.0,
+                 open_timeout=10.0, pose_options=None, decode_min_side=POSE_DECODE_MIN_SIDE):
+        self.workers = workers or os.cpu_count() or 1
+        self.sessions_per_worker = sessions_per_worker
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self.open_timeout = open_timeout  # first use of a worker includes importing MediaPipe
+        self.pose_options = dict(STREAM_POSE_OPTIONS, **(pose_options or {}))
+        self.decode_min_side = decode_min_side
+        self.context = multiprocessing.get_context('spawn')
+        self.lock = threading.Lock()
+        self.pool = []
+        self.sessions = {}  # session_id -> {'worker', 'exercise_type', 'last_seen', 'busy'}
+        self.opened = 0
+        self.rejected = 0
+        self.dropped = 0
+        self.expired = 0
+        self.completed = 0
+        self.lost = 0
+
+    def __contains__(self, session_id):
+        with self.lock:
+            return session_id in self.sessions
+
+    def _workers(self):
+        with self.lock:
+            if not self.pool:
+                self.pool = [_StreamWorker(self.context, self.pose_options, self.decode_min_side) for _ in range(self.workers)]
+            return list(self.pool)
+
+    def start(self):
+        """Start the workers and wait until each has loaded MediaPipe"""
+        for worker in self._workers():
+            try:
+                worker.call(self.open_timeout, 'ping')
+            except (EOFError, OSError):
+                self._replace(worker)
+                raise PoseServiceUnavailable('Pose stream worker failed to start')
+
+    def _replace(self, worker):
+        """Swap a dead worker for a new process, dropping the sessions it held"""
+        with self.lock:
+            if worker in self.pool:
+                self.pool[self.pool.index(worker)] = _StreamWorker(self.context, self.pose_options, self.decode_min_side)
+                for session_id in worker.sessions:
+                    self.sessions.pop(session_id, None)
+                self.lost += len(worker.sessions)
+                worker.sessions.clear()
+        worker.process.terminate()
+
+    def _close_idle(self):
+        cutoff = time.monotonic() - self.idle_timeout
+        with self.lock:
+            idle = [session_id for session_id, session in self.sessions.items()
+                    if not session['busy'] and session['last_seen'] < cutoff]
+        for session_id in idle:
+            self.close(session_id)
+
+    def open(self, exercise_type='general'):
+        """Session id of a new session on the least loaded worker"""
+        self._close_idle()
+        workers = self._workers()
+        with self.lock:
+            worker = min(workers, key=lambda candidate: len(candidate.sessions))
+            if len(worker.sessions) >= self.sessions_per_worker:
+                self.rejected += 1
+                raise PoseServiceBusy('Every pose stream worker is at its session limit')
+            session_id = uuid.uuid4().hex
+            worker.sessions.add(session_id)
+            self.sessions[session_id] = {'worker': worker, 'exercise_type': exercise_type,
+                                         'last_seen': time.monotonic(), 'busy': False}
+        try:
+            worker.call(self.open_timeout, 'open', session_id, exercise_type)
+        except PoseServiceUnavailable:
+            self.close(session_id)
+            raise
+        except (EOFError, OSError):
+            self._replace(worker)
+            raise PoseServiceUnavailable('Pose stream worker failed')
+        with self.lock:
+            self.opened += 1
+        return session_id
+
+    def frame(self, session_id, frame_data, timeout=None):
+        """Incremental feedback for one encoded frame of a session; KeyError for an unknown session"""
+        with self.lock:
+            session = self.sessions.get(session_id)
+            if session is None:
+                raise KeyError(session_id)
+            if session['busy']:
+                self.dropped += 1
+                raise PoseServiceBusy('Previous frame is still being analyzed')
+            session['busy'] = True
+            worker = session['worker']
+        timeout = self.timeout if timeout is None else timeout
+        try:
+            reply = worker.call(timeout, 'frame', session_id, frame_data, time.time() + timeout)
+        except PoseServiceUnavailable:
+            with self.lock:
+                self.expired += 1
+            raise
+        except (EOFError, OSError):
+            self._replace(worker)
+            raise PoseServiceUnavailable('Pose stream worker failed; open a new session')
+        finally:
+            with self.lock:
+                session['busy'] = False
+                session['last_seen'] = time.monotonic()
+        if reply is False:
+            raise KeyError(session_id)
+        if reply is None:
+            with self.lock:
+                self.expired += 1
+            raise PoseServiceUnavailable('Pose analysis timed out')
+        with self.lock:
+            self.completed += 1
+        return reply
+
+    def close(self, session_id):
+        """Release a session's tracking graph; False if it was not open"""
+        with self.lock:
+            session = self.sessions.pop(session_id, None)
+            if session is None:
+                return False
+            session['worker'].sessions.discard(session_id)
+        try:
+            session['worker'].call(self.timeout, 'close', session_id)
+        except (PoseServiceUnavailable, EOFError, OSError):
+            pass  # a dead worker is replaced on its next frame; its graphs are gone already
+        return True
+
+    def stats(self):
+        with self.lock:
+            return {'workers': self.workers, 'sessions_per_worker': self.sessions_per_worker,
+                    'sessions': len(self.sessions), 'opened': self.opened, 'completed': self.completed,
+                    'rejected': self.rejected, 'dropped': self.dropped, 'expired': self.expired,
+                    'lost': self.lost}
+
+    def shutdown(self):
+        with self.lock:
+            pool, self.pool = self.pool, []
+            self.sessions.clear()
+        for worker in pool:
+            worker.stop()
+
+
+def _benchmark(image_data, frames, workers):
+    """Frames per second with `workers` processes kept saturated by as many client threads"""
+    service = PoseService(workers=workers, max_pending=workers * 2, timeout=60)
+    try:
+        service.start()
+        service.analyze(image_data)
+        remaining = [frames]
+        lock = threading.Lock()
+
+        def client():
+            while True:
+                with lock:
+                    if remaining[0] <= 0:
+                        return
+                    remaining[0] -= 1
+                service.analyze(image_data)
+
+        threads = [threading.Thread(target=client) for _ in range(workers * 2)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return frames / (time.perf_counter() - started)
+    finally:
+        service.shutdown()
+
+
+def _cpu_seconds(pids):
+    """User + system CPU seconds used so far by the given processes (Linux /proc)"""
+    ticks = os.sysconf('SC_CLK_TCK')
+    total = 0
+    for pid in pids:
+        with open(f'/proc/{pid}/stat') as handle:
+            fields = handle.read().rsplit(')', 1)[1].split()
+        total += int(fields[11]) + int(fields[12])  # utime, stime
+    return total / ticks
+
+
+def _measure(run, frames, worker_pids):
+    """(mean ms, p95 ms, server CPU ms per frame) of `frames` sequential calls of run()"""
+    latencies = []
+    cpu = _cpu_seconds(worker_pids) + time.process_time()
+    for _ in range(frames):
+        started = time.perf_counter()
+        run()
+        latencies.append(time.perf_counter() - started)
+    cpu = _cpu_seconds(worker_pids) + time.process_time() - cpu
+    latencies.sort()
+    return (1000 * sum(latencies) / frames, 1000 * latencies[int(frames * 0.95) - 1], 1000 * cpu / frames)
+
+
+def _benchmark_stream(image_data, frames):
+    """Per-frame latency and CPU of the per-request path (base64 in a JSON body, a still-image
+    Pose) against a streaming session (raw JPEG, a tracking Pose), one worker each"""
+    body = json.dumps({'image': base64.b64encode(image_data).decode(), 'exercise_type': 'squats'})
+    service = PoseService(workers=1, timeout=60)
+    stream = PoseStreamService(workers=1, timeout=60)
+    try:
+        service.start()
+        pids = list(service.executor._processes)
+
+        def per_request():
+            data = json.loads(body)  # what the endpoint does with the request body
+            json.dumps(service.analyze(data['image'], data['exercise_type']))
+
+        per_request()
+        results = {'per-request': _measure(per_request, frames, pids)}
+        service.shutdown()
+
+        stream.start()
+        session_id = stream.open('squats')
+        pids = [worker.process.pid for worker in stream.pool]
+
+        def streamed():
+            json.dumps(stream.frame(session_id, image_data))
+
+        streamed()
+        results['stream'] = _measure(streamed, frames, pids)
+        return results
+    finally:
+        service.shutdown()
+        stream.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Pose service benchmarks')
+    parser.add_argument('--image', help='JPEG/PNG to analyze (default: a synthetic 640x480 frame)')
+    parser.add_argument('--frames', type=int, default=200)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--stream', action='store_true', help='compare per-request and streaming session frames')
+    args = parser.parse_args()
+
+    if args.image:
+        with open(args.image, 'rb') as handle:
+            image_data = handle.read()
+    else:
+        frame = np.random.default_rng(0).integers(0, 256, (480, 640, 3), dtype=np.uint8)
+        image_data = cv2.imencode('.jpg', frame)[1].tobytes()
+
+    if args.stream:
+        results = _benchmark_stream(image_data, args.frames)
+        for path, (mean, p95, cpu) in results.items():
+            print(f'{path}: {mean:.1f} ms mean, {p95:.1f} ms p95, {cpu:.1f} ms server CPU per frame')
+        return
+
+    baseline = None
+    for workers in args.workers:
+        fps = _benchmark(image_data, args.frames, workers)
+        baseline = baseline or fps
+        print(f'{workers} worker(s): {fps:.1f} frames/s ({fps / baseline:.2f}x)')
+
+
+if __name__ == '__main__':
+    main()
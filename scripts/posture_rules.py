@@ -0,0 +1,219 @@
+"""
+Posture rule engine: the exercise and machine rule tables in posture_rules.json compiled
+once into index arrays, then evaluated as numpy operations over every frame of a clip
+at once.
+
+A rule bounds one measure of a frame, and a rule fails when the measure is out of range.
+Measures:
+    angle     joint angle in degrees, mean of the visible body sides
+    symmetry  difference in degrees between the left and right side of a joint angle
+    level     vertical offset between two points, as a fraction of the frame height
+    tilt      angle in degrees of the segment between two points away from vertical
+Each measure is only checked on frames where the landmarks it uses are visible.
+Points are MediaPipe Pose landmark names or the midpoints declared under "points".
+"""
+
+import json
+import os
+
+import numpy as np
+
+# MediaPipe Pose landmark names, in landmark index order
+LANDMARK_NAMES = (
+    'nose', 'left_eye_inner', 'left_eye', 'left_eye_outer', 'right_eye_inner', 'right_eye', 'right_eye_outer',
+    'left_ear', 'right_ear', 'mouth_left', 'mouth_right', 'left_shoulder', 'right_shoulder', 'left_elbow',
+    'right_elbow', 'left_wrist', 'right_wrist', 'left_pinky', 'right_pinky', 'left_index', 'right_index',
+    'left_thumb', 'right_thumb', 'left_hip', 'right_hip', 'left_knee', 'right_knee', 'left_ankle',
+    'right_ankle', 'left_heel', 'right_heel', 'left_foot_index', 'right_foot_index',
+)
+
+RULES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'posture_rules.json')
+
+VISIBILITY_THRESHOLD = 0.5
+
+MEASURE_KINDS = ('angle', 'symmetry', 'level', 'tilt')
+
+
+def _key(name):
+    return name.strip().lower().replace('-', '_').replace(' ', '_')
+
+
+class RuleGroup:
+    """The rules checked for one exercise (plus an optional machine), as parallel arrays
+    over (measure column, min, max, issue, recommendation) rules"""
+
+    def __init__(self, rules):
+        self.columns = np.array([rule[0] for rule in rules], dtype=np.intp)
+        self.low = np.array([rule[1] for rule in rules], dtype=np.float64)
+        self.high = np.array([rule[2] for rule in rules], dtype=np.float64)
+        self.issues = [rule[3] for rule in rules]
+        self.recommendations = [rule[4] for rule in rules]
+
+
+class FrameEvaluation:
+    """Results of one RuleGroup over N frames.
+
+    checked[i, r] tells whether rule r could be checked on frame i and failed[i, r] whether
+    it was checked and failed; scores are the percentage of checked rules passed (0 when
+    nothing could be checked). angles maps each joint angle name to N values, NaN where
+    neither side was visible.
+    """
+
+    def __init__(self, group, checked, failed, angles):
+        self.group = group
+        self.checked = checked
+        self.failed = failed
+        self.angles = angles
+        checks = checked.sum(axis=1)
+        passed = checks - failed.sum(axis=1)
+        self.checks = checks
+        self.scores = np.where(checks > 0, np.rint(100 * passed / np.maximum(checks, 1)), 0).astype(np.int64)
+
+    def __len__(self):
+        return len(self.scores)
+
+    def frame_issues(self, index):
+        """([issues], [recommendations]) failed on one frame, in rule order"""
+        failed = np.flatnonzero(self.failed[index])
+        return ([self.group.issues[rule] for rule in failed],
+                [self.group.recommendations[rule] for rule in failed])
+
+
+class PostureRules:
+    """A compiled rule book. Build it once (see load_rules) and share it between threads:
+    every exercise and machine combination is compiled up front and nothing changes after."""
+
+    def __init__(self, spec):
+        index = {name: position for position, name in enumerate(LANDMARK_NAMES)}
+        # Every point is the mean of two landmarks; a plain landmark is itself twice
+        self.point_index = dict(index)
+        pairs = [(position, position) for position in range(len(LANDMARK_NAMES))]
+        for name, (first, second) in spec.get('points', {}).items():
+            self.point_index[name] = len(pairs)
+            pairs.append((index[first], index[second]))
+        self.point_pairs = np.array(pairs, dtype=np.intp)
+
+        self.angle_names = list(spec['angles'])
+        triples = []
+        for name in self.angle_names:
+            for side in spec['angles'][name]:  # left, then right
+                triples.append([self._point(point) for point in side])
+        self.triples = np.array(triples, dtype=np.intp)
+
+        # Measure matrix columns: angle means, angle symmetries, then one per distinct level/tilt segment
+        self.segments = []  # (kind, first point, second point)
+        shared = [self._compile_rule(rule) for rule in spec.get('shared_rules', ())]
+        self.exercises, self.exercise_aliases = {}, {}
+        for name, entry in spec['exercises'].items():
+            self.exercises[name] = [self._compile_rule(rule) for rule in entry['rules']] + shared
+            self._add_aliases(self.exercise_aliases, name, entry)
+        if 'general' not in self.exercises:
+            raise ValueError('The rule book needs a "general" exercise')
+        self.machines, self.machine_aliases, self.machine_info = {}, {}, {}
+        for name, entry in spec.get('machines', {}).items():
+            self.machines[name] = [self._compile_rule(rule) for rule in entry['rules']]
+            self.machine_info[name] = {'key_points': entry.get('key_points', []),
+                                       'common_mistakes': entry.get('common_mistakes', [])}
+            self._add_aliases(self.machine_aliases, name, entry)
+
+        segments = np.array([segment[1:] for segment in self.segments], dtype=np.intp).reshape(-1, 2)
+        self.segment_starts, self.segment_ends = segments[:, 0], segments[:, 1]
+        self.segment_tilts = np.array([segment[0] == 'tilt' for segment in self.segments], dtype=bool)
+        self.groups = {
+            (exercise, machine): RuleGroup(rules + (self.machines[machine] if machine else []))
+            for exercise, rules in self.exercises.items() for machine in [None, *self.machines]
+        }
+
+    def _point(self, name):
+        if name not in self.point_index:
+            raise ValueError(f'Unknown point: {name!r}')
+        return self.point_index[name]
+
+    def _compile_rule(self, rule):
+        """(measure column, min, max, issue, recommendation) for one rule table entry"""
+        kinds = [kind for kind in MEASURE_KINDS if kind in rule]
+        if len(kinds) != 1:
+            raise ValueError(f'A rule needs exactly one of {MEASURE_KINDS}: {rule!r}')
+        kind = kinds[0]
+        if kind in ('angle', 'symmetry'):
+            if rule[kind] not in self.angle_names:
+                raise ValueError(f'Unknown angle: {rule[kind]!r}')
+            column = self.angle_names.index(rule[kind]) + (len(self.angle_names) if kind == 'symmetry' else 0)
+        else:
+            segment = (kind, *(self._point(point) for point in rule[kind]))
+            if segment not in self.segments:
+                self.segments.append(segment)
+            column = 2 * len(self.angle_names) + self.segments.index(segment)
+        return column, rule.get('min', 0.0), rule.get('max', np.inf), rule['issue'], rule['recommendation']
+
+    @staticmethod
+    def _add_aliases(aliases, name, entry):
+        aliases[_key(name)] = name
+        for alias in entry.get('aliases', ()):
+            aliases[_key(alias)] = name
+
+    def exercise(self, name):
+        """Rule table key for an exercise name or alias; 'general' for unknown names"""
+        return self.exercise_aliases.get(_key(name or ''), 'general')
+
+    def machine(self, name):
+        """Rule table key for a machine name or alias, or None"""
+        return self.machine_aliases.get(_key(name or ''))
+
+    def measure(self, frames):
+        """(measure matrix (N, measures) with NaN where unmeasurable, {angle name: (N,) mean angles})
+        for an (N, 33, 3) or (N, 33, 4) landmark array; without a 4th visibility column every
+        landmark counts as visible"""
+        frames = np.asarray(frames, dtype=np.float64)
+        if frames.ndim == 2:
+            frames = frames[np.newaxis]
+        xy = frames[:, :, :2]
+        visible = frames[:, :, 3] >= VISIBILITY_THRESHOLD if frames.shape[2] > 3 else np.ones(frames.shape[:2], dtype=bool)
+
+        first, second = self.point_pairs[:, 0], self.point_pairs[:, 1]
+        points = (xy[:, first] + xy[:, second]) / 2  # (N, points, 2)
+        point_visible = visible[:, first] & visible[:, second]
+
+        a, vertex, b = points[:, self.triples[:, 0]], points[:, self.triples[:, 1]], points[:, self.triples[:, 2]]
+        u, v = a - vertex, b - vertex
+        norms = np.linalg.norm(u, axis=2) * np.linalg.norm(v, axis=2)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            cosine = np.clip(np.einsum('nij,nij->ni', u, v) / norms, -1.0, 1.0)
+        sides = np.degrees(np.arccos(cosine))  # (N, 2 * angles)
+        sides[~(point_visible[:, self.triples].all(axis=2) & (norms > 0))] = np.nan
+
+        left, right = sides[:, 0::2], sides[:, 1::2]
+        seen = (~np.isnan(left)).astype(np.int64) + ~np.isnan(right)  # visible sides per angle
+        total = np.nan_to_num(left) + np.nan_to_num(right)
+        means = np.where(seen > 0, total / np.maximum(seen, 1), np.nan)
+        symmetry = np.abs(left - right)  # NaN unless both sides are visible
+
+        columns = [means, symmetry]
+        if len(self.segments):
+            delta = np.abs(points[:, self.segment_ends] - points[:, self.segment_starts])
+            tilt = np.degrees(np.arctan2(delta[:, :, 0], delta[:, :, 1]))
+            segments = np.where(self.segment_tilts, tilt, delta[:, :, 1])
+            segments[~(point_visible[:, self.segment_starts] & point_visible[:, self.segment_ends])] = np.nan
+            columns.append(segments)
+        return np.concatenate(columns, axis=1), dict(zip(self.angle_names, means.T))
+
+    def evaluate(self, frames, exercise='general', machine=None):
+        """FrameEvaluation of every frame of an (N, 33, 3|4) array (or one (33, 3|4) frame)
+        against an exercise's rules, plus a machine's when given (names or aliases)"""
+        group = self.groups[self.exercise(exercise), self.machine(machine)]
+        measures, angles = self.measure(frames)
+        values = measures[:, group.columns]
+        checked = ~np.isnan(values)
+        with np.errstate(invalid='ignore'):
+            failed = checked & ((values < group.low) | (values > group.high))
+        return FrameEvaluation(group, checked, failed, angles)
+
+
+def load_rules(path=RULES_PATH):
+    """Compile the rule book from a JSON file; malformed tables raise ValueError at startup"""
+    with open(path) as handle:
+        spec = json.load(handle)
+    try:
+        return PostureRules(spec)
+    except (KeyError, TypeError) as e:
+        raise ValueError(f'Invalid posture rules in {path}: {e!r}')
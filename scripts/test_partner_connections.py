@@ -0,0 +1,77 @@
+"""
+Partner connection requests and responses through the API: interactions are recorded and
+folded into the pair aggregates, and cached recommendations of both users are dropped.
+
+    cd scripts && python -m pytest -q test_partner_connections.py
+"""
+
+import pytest
+
+import flask_backend
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    # Several views open 'fitness_app.db' relative to the working directory
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(flask_backend, 'ml_system', flask_backend.MLRecommendationSystem())
+    flask_backend.init_db()
+    return flask_backend.app.test_client()
+
+
+def _register(client, username, **fields):
+    response = client.post('/api/auth/register', json=dict(
+        username=username, email=f'{username}@example.com', password='secret', first_name=username.title(),
+        last_name='Tester', age=30, fitness_level='intermediate', goals=['strength'], **fields))
+    assert response.status_code == 201
+    return response.get_json()['user_id']
+
+
+def _rows(sql, *params):
+    conn = flask_backend.get_db_connection()
+    try:
+        return [tuple(row) for row in conn.execute(sql, params).fetchall()]
+    finally:
+        conn.close()
+
+
+def test_connect_and_respond_record_interactions(client):
+    alice, bob = _register(client, 'alice'), _register(client, 'bob')
+
+    response = client.post('/api/partners/connect', json={'user_id': alice, 'partner_id': bob, 'message': 'Hi!'})
+    assert response.status_code == 200, response.get_json()
+    response = client.post('/api/partners/respond', json={'user_id': bob, 'partner_id': alice, 'response': 'accepted'})
+    assert response.status_code == 200, response.get_json()
+
+    assert _rows('SELECT user_id, target_user_id, interaction_type FROM user_interactions ORDER BY id') == [
+        (alice, bob, 'connection_request'), (bob, alice, 'accepted')]
+    aggregates = _rows('SELECT user_id, target_user_id, score FROM interaction_aggregates ORDER BY user_id')
+    assert [(user_id, target_id) for user_id, target_id, _ in aggregates] == [(alice, bob), (bob, alice)]
+    assert [score for _, _, score in aggregates] == [pytest.approx(1, rel=1e-3), pytest.approx(2, rel=1e-3)]
+    assert _rows('SELECT user_id, partner_id, status FROM partners ORDER BY user_id') == [
+        (alice, bob, 'accepted'), (bob, alice, 'accepted')]
+
+
+def test_connect_requires_both_users(client):
+    alice = _register(client, 'alice')
+    response = client.post('/api/partners/connect', json={'user_id': alice})
+    assert response.status_code == 400
+    assert not _rows('SELECT * FROM user_interactions')
+
+
+def test_connect_drops_cached_recommendations(client):
+    alice, bob, carol = _register(client, 'alice'), _register(client, 'bob'), _register(client, 'carol')
+    cache = flask_backend.ml_system.cache
+
+    first = client.get(f'/api/partners/recommendations/{alice}').get_json()['recommendations']
+    assert {partner['user_id'] for partner in first} == {bob, carol}
+    assert cache.get(alice, 10) is not None
+    cache.put(bob, 10, [])  # a cached list of the partner's, which the connect must drop too
+
+    response = client.post('/api/partners/connect', json={'user_id': alice, 'partner_id': bob})
+    assert response.status_code == 200, response.get_json()
+
+    assert cache.get(alice, 10) is None
+    assert cache.get(bob, 10) is None
+    second = client.get(f'/api/partners/recommendations/{alice}').get_json()['recommendations']
+    assert [partner['user_id'] for partner in second] == [carol]
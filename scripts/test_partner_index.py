@@ -0,0 +1,87 @@
+"""
+Recall of PartnerIndex.top_k against brute-force scoring of every candidate: the bucket
+bounds may only prune buckets that cannot hold a top-k candidate.
+
+    cd scripts && python -m pytest -q test_partner_index.py
+"""
+
+import random
+
+import numpy as np
+import pytest
+
+from flask_backend import CandidateSnapshot, PartnerMatcher
+
+FITNESS_LEVELS = [None, 'beginner', 'Intermediate', 'advanced']
+GOALS = ['weight_loss', 'muscle_gain', 'endurance', 'strength', 'general_fitness']
+WORKOUT_TIMES = [None, 'morning', 'Evening', 'afternoon', 'flexible']
+LOCATIONS = [None, 'New York', 'Brooklyn', 'Chicago', 'Austin', 'Springfield']
+SCHEDULES = [None, 'flexible', ['saturday', 'sunday'], {'monday': ['06:00-08:00', 'evening']},
+             {'tuesday': 'morning', 'thursday': 'morning'}]
+
+
+def _random_profile(rng, user_id):
+    profile = {
+        'id': user_id,
+        'name': f'User {user_id}',
+        'age': rng.choice([None, rng.randint(18, 70)]),
+        'fitness_level': rng.choice(FITNESS_LEVELS),
+        'goals': rng.sample(GOALS, rng.randint(0, 3)),
+        'location': rng.choice(LOCATIONS),
+        'latitude': None,
+        'longitude': None,
+        'preferred_workout_time': rng.choice(WORKOUT_TIMES),
+        'availability_schedule': rng.choice(SCHEDULES),
+        'availability_bits': None,
+        'bio': '',
+        'last_active': '2026-01-01 00:00:00',
+        'is_active': rng.random() < 0.9,
+        'updated_at': '2026-01-01 00:00:00',
+    }
+    if rng.random() < 0.5:
+        profile['latitude'] = rng.uniform(40, 42)
+        profile['longitude'] = rng.uniform(-75, -73)
+    return profile
+
+
+def _recall_at_k(snapshot, user, k, row_mask):
+    """Share of the true top-k (by score, ties included) that top_k returned"""
+    rows = np.flatnonzero(row_mask)
+    scores = snapshot.matcher.score_encoded(user, snapshot.take(rows))['overall']
+    if not len(rows):
+        return 1.0
+    kth = np.sort(scores)[::-1][min(k, len(rows)) - 1]
+    returned = snapshot.index.top_k(user, k, row_mask)
+    returned_scores = dict(zip(rows.tolist(), scores.tolist()))
+    hits = sum(returned_scores[row] >= kth for row in returned.tolist())
+    return hits / min(k, len(rows))
+
+
+@pytest.mark.parametrize('seed', range(3))
+@pytest.mark.parametrize('batch_size', [1, 64])
+def test_top_k_recall_matches_brute_force(seed, batch_size):
+    rng = random.Random(seed)
+    snapshot = CandidateSnapshot(PartnerMatcher())
+    snapshot._apply([_random_profile(rng, user_id) for user_id in range(1, 2001)])
+    # Small batches check the stopping bound after almost every bucket, where pruning bites
+    snapshot.index.batch_size = batch_size
+
+    recalls = []
+    for _ in range(20):
+        user = _random_profile(rng, 0)
+        mask = snapshot.candidate_mask(exclude_ids=rng.sample(range(1, 2001), 50))
+        for k in (1, 10, 100):
+            recalls.append(_recall_at_k(snapshot, user, k, mask))
+    assert min(recalls) == 1.0
+
+
+def test_top_k_is_ordered_best_first():
+    rng = random.Random(7)
+    snapshot = CandidateSnapshot(PartnerMatcher())
+    snapshot._apply([_random_profile(rng, user_id) for user_id in range(1, 501)])
+    user = _random_profile(rng, 0)
+
+    rows = snapshot.index.top_k(user, 20, snapshot.candidate_mask())
+    scores = snapshot.matcher.score_encoded(user, snapshot.take(rows))['overall']
+    assert len(rows) == 20
+    assert np.all(np.diff(scores) <= 0)
@@ -0,0 +1,62 @@
+"""
+PartnerMatcher.score_many must give the same results as calculate_compatibility_score
+for every candidate.
+
+    cd scripts && python -m pytest -q test_partner_matcher.py
+"""
+
+import random
+
+import pytest
+
+from flask_backend import PartnerMatcher
+
+FITNESS_LEVELS = [None, '', 'beginner', 'Intermediate', 'ADVANCED', 'elite']
+GOALS = ['weight_loss', 'Muscle Gain', 'endurance', 'strength', 'general fitness', 'flexibility']
+WORKOUT_TIMES = [None, '', 'morning', 'Evening', 'flexible', 'afternoon']
+LOCATIONS = [None, '', 'New York', 'new york city', 'Brooklyn, New York', 'Chicago', 'Austin']
+SCHEDULES = [
+    None,
+    {},
+    'flexible',
+    ['saturday', 'sunday'],
+    {'monday': ['06:00-08:00', 'evening'], 'wednesday': 'morning'},
+    {'mon': ['18:00-21:00'], 'fri': ['22:00-02:00']},
+]
+
+
+def _random_profile(rng):
+    profile = {
+        'age': rng.choice([None, 0, rng.randint(18, 70)]),
+        'fitness_level': rng.choice(FITNESS_LEVELS),
+        'goals': rng.sample(GOALS, rng.randint(0, 3)),
+        'preferred_workout_time': rng.choice(WORKOUT_TIMES),
+        'location': rng.choice(LOCATIONS),
+        'availability_schedule': rng.choice(SCHEDULES),
+    }
+    if rng.random() < 0.6:
+        profile['latitude'] = rng.uniform(25, 49)
+        profile['longitude'] = rng.uniform(-124, -67)
+    return profile
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_score_many_matches_scalar_scores(seed):
+    rng = random.Random(seed)
+    matcher = PartnerMatcher()
+    for _ in range(20):
+        user = _random_profile(rng)
+        candidates = [_random_profile(rng) for _ in range(50)]
+
+        batch = matcher.score_many(user, candidates)
+
+        assert len(batch) == len(candidates)
+        for candidate, result in zip(candidates, batch):
+            expected = matcher.calculate_compatibility_score(user, candidate)
+            assert result['overall_score'] == expected['overall_score']
+            assert result['detailed_scores'] == pytest.approx(expected['detailed_scores'])
+            assert result['match_factors'] == expected['match_factors']
+
+
+def test_score_many_without_candidates():
+    assert PartnerMatcher().score_many({'age': 30}, []) == []
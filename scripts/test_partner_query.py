@@ -0,0 +1,84 @@
+"""
+build_mutual_candidate_query against a fresh database: the generated SQL is answered from
+indexes only, and preferences (stored lowercased) match users columns in any case.
+
+    cd scripts && python -m pytest -q test_partner_query.py
+"""
+
+import pytest
+
+import flask_backend
+
+
+@pytest.fixture
+def conn(tmp_path, monkeypatch):
+    # The search view opens 'fitness_app.db' relative to the working directory
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(flask_backend, 'DATABASE', str(tmp_path / 'fitness_app.db'))
+    flask_backend.init_db()
+    conn = flask_backend.get_db_connection()
+    yield conn
+    conn.close()
+
+
+def _add_user(conn, username, fitness_level, workout_time, age=30):
+    cursor = conn.execute('''
+        INSERT INTO users (username, email, password_hash, first_name, last_name, age, fitness_level,
+                           preferred_workout_time, is_active)
+        VALUES (?, ?, '', ?, '', ?, ?, ?, TRUE)
+    ''', (username, f'{username}@example.com', username, age, fitness_level, workout_time))
+    return cursor.lastrowid
+
+
+def _set_preferences(conn, user_id, **preferences):
+    conn.execute('INSERT INTO partner_preferences (user_id, min_age, max_age) VALUES (?, ?, ?)',
+                 (user_id, preferences.get('min_age'), preferences.get('max_age')))
+    flask_backend._sync_preference_lists(conn, user_id, preferences)
+
+
+def _query(conn, user_id, exclude_ids=()):
+    user = dict(conn.execute('SELECT * FROM users WHERE id = ?', (user_id,)).fetchone())
+    preferences = flask_backend.ml_system._get_partner_preferences(conn, user_id)
+    return flask_backend.build_mutual_candidate_query(user, preferences, exclude_ids, active_within_days=30)
+
+
+def test_query_plan_has_no_scans(conn):
+    user_id = _add_user(conn, 'searcher', 'intermediate', 'morning')
+    _set_preferences(conn, user_id, min_age=25, max_age=40,
+                     preferred_fitness_levels=['Intermediate', 'advanced'],
+                     preferred_workout_times=['morning'], preferred_goals=['weight loss'])
+    sql, params = _query(conn, user_id, exclude_ids=[user_id])
+
+    plan = [row[3] for row in conn.execute('EXPLAIN QUERY PLAN ' + sql, params).fetchall()]
+    assert not [step for step in plan if step.startswith('SCAN')], plan
+
+
+def test_preferences_match_mixed_case_columns(conn):
+    user_id = _add_user(conn, 'searcher', 'beginner', 'Morning')
+    _set_preferences(conn, user_id, preferred_fitness_levels=['advanced'], preferred_workout_times=['morning'])
+    advanced = _add_user(conn, 'advanced', 'Advanced', 'MORNING')
+    flexible = _add_user(conn, 'flexible', 'ADVANCED', 'Flexible')
+    _add_user(conn, 'beginner', 'Beginner', 'morning')
+    _add_user(conn, 'evening', 'advanced', 'Evening')
+    sql, params = _query(conn, user_id, exclude_ids=[user_id])
+
+    assert sorted(row[0] for row in conn.execute(sql, params)) == [advanced, flexible]
+
+
+@pytest.mark.parametrize('body', [{}, {'filters': {}}, {'user_id': None}, {'user_id': '7'}, {'user_id': 1.5},
+                                  {'user_id': True}, {'user_id': 1, 'filters': ['fitness_level']}])
+def test_search_rejects_bad_user_id_and_filters(conn, body):
+    response = flask_backend.app.test_client().post('/api/partners/search', json=body)
+    assert response.status_code == 400
+    assert response.get_json()['success'] is False
+
+
+def test_search_with_valid_user_id(conn, monkeypatch):
+    monkeypatch.setattr(flask_backend, 'ml_system', flask_backend.MLRecommendationSystem())
+    searcher = _add_user(conn, 'searcher', 'intermediate', 'morning')
+    partner = _add_user(conn, 'partner', 'Intermediate', 'Morning')
+    conn.commit()
+    response = flask_backend.app.test_client().post('/api/partners/search', json={
+        'user_id': searcher, 'filters': {'fitness_level': 'intermediate', 'min_overlap_hours': 2}})
+    assert response.status_code == 200, response.get_json()
+    assert [found['id'] for found in response.get_json()['partners']] == [partner]